@@ -0,0 +1,28 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.db import models
+
+from xratings.fields import AnonymousRatingField, RatingField
+
+
+def total_formula(scores, vrange):
+    # Sum of the votes, easy to check in tests.
+    return sum(choice * count for choice, count in zip(vrange, scores))
+
+
+class RatingTestModel(models.Model):
+    rating = AnonymousRatingField(choices=[1, 2, 3, 4, 5],
+                                  can_change_vote=True,
+                                  formula=total_formula)
+    rating2 = RatingField(choices=[1, 2, 3, 4, 5], formula=total_formula)
+
+    class Meta:
+        app_label = 'ratings_test_app'
+
+
+class PackedRatingTestModel(models.Model):
+    rating = RatingField(choices=[1, 2, 3, 4, 5], histogram_format='packed')
+
+    class Meta:
+        app_label = 'ratings_test_app'
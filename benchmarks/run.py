@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Throughput and query counts of the vote and read paths, against SQLite or
+the database of the XRATINGS_DB_* variables (see ``settings.py``). Prints
+the results as JSON::
+
+    python benchmarks/run.py --votes 5000 --threads 8 \
+        --delete-sizes 10000,100000,1000000 --output results.json
+
+The query budgets the test suite enforces are in ``xratings/tests.py``;
+run them with::
+
+    django-admin.py test xratings --settings=settings --pythonpath=benchmarks
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+import django  # noqa
+
+if hasattr(django, 'setup'):
+    django.setup()
+
+from django.contrib.auth.models import AnonymousUser, User  # noqa
+from django.contrib.contenttypes.models import ContentType  # noqa
+from django.db import connection, connections  # noqa
+from django.template import Context, Template  # noqa
+from django.test.client import RequestFactory  # noqa
+from django.test.utils import CaptureQueriesContext  # noqa
+
+from ratings_test_app.models import (PackedRatingTestModel,  # noqa
+                                     RatingTestModel)
+from xratings.models import Vote  # noqa
+from xratings.views import AddRatingView  # noqa
+
+
+def create_database():
+    # Test database; the vote indexes of migration 0004, which are not part
+    # of the models, are created by ``create_vote_indexes``.
+    return connection.creation.create_test_db(verbosity=0)
+
+
+def get_field():
+    # The anonymous field, with database-side aggregate updates so votes of
+    # several threads on one object are all counted.
+    field = [field for field in RatingTestModel._xratings
+             if field.name == 'rating'][0]
+    field.atomic = True
+    return field
+
+
+def create_objects(count):
+    RatingTestModel.objects.bulk_create([RatingTestModel()
+                                         for i in range(count)])
+    return list(RatingTestModel.objects.order_by('-pk')
+                .values_list('pk', flat=True)[:count])
+
+
+def get_ip_address(number):
+    return '10.%d.%d.%d' % (number >> 16 & 255, number >> 8 & 255,
+                            number & 255)
+
+
+def cast_votes(field, pks, start, count):
+    # One anonymous vote per IP address, spread over the objects ``pks``.
+    for number in range(start, start + count):
+        manager = field.get_rating_manager(pks[number % len(pks)])
+        manager.add(field.range[number % len(field.range)], None,
+                    get_ip_address(number))
+
+
+def rate(count, seconds):
+    return round(count / seconds, 1) if seconds else None
+
+
+def bench_add(field, votes, objects):
+    pks = create_objects(objects)
+    started = time.time()
+    cast_votes(field, pks, 0, votes)
+    seconds = time.time() - started
+    return {'votes': votes, 'objects': objects,
+            'seconds': round(seconds, 3),
+            'votes_per_second': rate(votes, seconds)}
+
+
+def bench_add_threaded(field, votes, objects, threads):
+    pks = create_objects(objects)
+    per_thread = votes // threads
+    errors = []
+
+    def work(number):
+        try:
+            cast_votes(field, pks, (1 << 20) + number * per_thread,
+                       per_thread)
+        except Exception as e:
+            # e.g. SQLite refusing concurrent writers
+            errors.append('%s: %s' % (e.__class__.__name__, e))
+        finally:
+            connections['default'].close()
+
+    workers = [threading.Thread(target=work, args=(number,))
+               for number in range(threads)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.time() - started
+    stored = sum(sum(field.to_histogram(scores)) for scores in
+                 RatingTestModel.objects.filter(pk__in=pks)
+                 .values_list(field.scores_field_name, flat=True))
+    return {'votes': per_thread * threads, 'threads': threads,
+            'objects': objects, 'seconds': round(seconds, 3),
+            'votes_per_second': rate(per_thread * threads, seconds),
+            'counted_votes': stored, 'errors': errors[:10]}
+
+
+def bench_view(field, calls):
+    # Queries and time per ``AddRatingView`` call, for new and changed votes.
+    pks = create_objects(calls)
+    view, factory = AddRatingView(), RequestFactory()
+    content_type = ContentType.objects.get_for_model(RatingTestModel)
+    results = {}
+    for name, score in (('new', field.range[0]), ('changed', field.range[-1])):
+        with CaptureQueriesContext(connection) as context:
+            started = time.time()
+            for number, pk in enumerate(pks):
+                request = factory.post(
+                    '/', REMOTE_ADDR=get_ip_address((2 << 20) + number))
+                request.user = AnonymousUser()
+                view(request, content_type.pk, pk, field.name, score)
+            seconds = time.time() - started
+        results[name] = {
+            'calls': calls, 'seconds': round(seconds, 3),
+            'calls_per_second': rate(calls, seconds),
+            'queries_per_call': round(
+                float(len(context.captured_queries)) / calls, 2)}
+    return results
+
+
+def bench_delete(field, size, per_object):
+    # ``VoteQuerySet.delete`` of ``size`` votes, ``per_object`` per object,
+    # RATINGS_BATCH_SIZE votes per transaction.
+    pks = create_objects(max(1, size // per_object))
+    content_type = ContentType.objects.get_for_model(RatingTestModel)
+    chunk = []
+    for number in range(size):
+        chunk.append(Vote(content_type=content_type,
+                          object_id=pks[number % len(pks)], key=field.key,
+                          score=field.range[number % len(field.range)],
+                          ip_address=get_ip_address((3 << 20) + number)))
+        if len(chunk) == 1000:
+            Vote.objects.bulk_create(chunk)
+            chunk = []
+    Vote.objects.bulk_create(chunk)
+    # The objects are the latest ones, a range avoids a huge IN list.
+    votes = Vote.objects.filter(content_type=content_type,
+                                object_id__gte=min(pks))
+    with CaptureQueriesContext(connection) as context:
+        started = time.time()
+        votes.delete()
+        seconds = time.time() - started
+    return {'votes': size, 'objects': len(pks), 'seconds': round(seconds, 3),
+            'votes_per_second': rate(size, seconds),
+            'queries': len(context.captured_queries)}
+
+
+def bench_load(rows):
+    # Loading rows with JSON and with packed histograms, with and without
+    # reading the histograms.
+    results = {}
+    for model in (RatingTestModel, PackedRatingTestModel):
+        field = model._xratings[0]
+        name = field.scores_field_name
+        model.objects.bulk_create([
+            model(**{name: [number % 7, 1, 0, number, 2]})
+            for number in range(rows)])
+        queryset = model.objects.only('pk', name)[:rows]
+        started = time.time()
+        objects = list(queryset)
+        loaded = time.time() - started
+        started = time.time()
+        total = sum(sum(getattr(obj, field.name).scores) for obj in objects)
+        read = time.time() - started
+        results[field.histogram_format] = {
+            'rows': rows, 'load_seconds': round(loaded, 4),
+            'read_seconds': round(read, 4), 'total': total}
+    return results
+
+
+def bench_template(field, size):
+    # Renders the prefetch tag and one ``rating_by_request`` per object.
+    pks = create_objects(size)
+    user = User.objects.create(username='benchmark-%d' % (time.time() * 1e6,))
+    for pk in pks[::2]:
+        field.get_rating_manager(pk).add(field.range[0], user, '127.0.0.1')
+    objects = list(RatingTestModel.objects.filter(pk__gte=min(pks)))
+    request = RequestFactory().get('/')
+    request.user = user
+    template = Template(
+        '{%% load ratings %%}{%% prefetch_ratings_by_request request on '
+        'object_list %%}{%% for instance in object_list %%}'
+        '{%% rating_by_request request on instance.%s as vote %%}{{ vote }}'
+        '{%% endfor %%}' % (field.name,))
+    with CaptureQueriesContext(connection) as context:
+        started = time.time()
+        template.render(Context({'request': request,
+                                 'object_list': objects}))
+        seconds = time.time() - started
+    return {'objects': size, 'seconds': round(seconds, 4),
+            'queries': len(context.captured_queries)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--votes', type=int, default=2000)
+    parser.add_argument('--objects', type=int, default=100,
+                        help='Number of objects the votes are spread over.')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--view-calls', type=int, default=200)
+    parser.add_argument('--delete-sizes', default='10000,100000',
+                        help='Comma separated vote counts.')
+    parser.add_argument('--votes-per-object', type=int, default=10)
+    parser.add_argument('--list-size', type=int, default=1000,
+                        help='Number of objects of the template benchmark.')
+    parser.add_argument('--load-rows', type=int, default=10000,
+                        help='Number of rows of the loading benchmark.')
+    parser.add_argument('--output', help='File to write the JSON to.')
+    args = parser.parse_args(argv)
+
+    old_name = connection.settings_dict['NAME']
+    create_database()
+    try:
+        field = get_field()
+        results = {
+            'add': bench_add(field, args.votes, args.objects),
+            'add_threaded': bench_add_threaded(field, args.votes,
+                                               args.objects, args.threads),
+            'view': bench_view(field, args.view_calls),
+            'delete': [bench_delete(field, int(size), args.votes_per_object)
+                       for size in args.delete_sizes.split(',') if size],
+            'template': bench_template(field, args.list_size),
+            'load': bench_load(args.load_rows),
+        }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    output = json.dumps({
+        'vendor': connection.vendor,
+        'django': django.get_version(),
+        'python': platform.python_version(),
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
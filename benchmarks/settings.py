@@ -0,0 +1,67 @@
+# coding=utf-8
+"""
+Settings for the test suite and the benchmarks: SQLite by default, any
+other database with the XRATINGS_DB_* environment variables, e.g.::
+
+    XRATINGS_DB_ENGINE=django.db.backends.postgresql_psycopg2 \
+    XRATINGS_DB_NAME=xratings XRATINGS_DB_USER=postgres \
+    django-admin.py test xratings --settings=settings --pythonpath=benchmarks
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+ENGINE = os.environ.get('XRATINGS_DB_ENGINE', 'django.db.backends.sqlite3')
+
+# A file, not memory: the threaded benchmarks need the connections of all
+# threads to see the same database.
+SQLITE_NAME = os.path.join(tempfile.gettempdir(), 'xratings_test.sqlite3')
+
+DATABASES = {
+    'default': {
+        'ENGINE': ENGINE,
+        'NAME': os.environ.get('XRATINGS_DB_NAME', SQLITE_NAME),
+        'USER': os.environ.get('XRATINGS_DB_USER', ''),
+        'PASSWORD': os.environ.get('XRATINGS_DB_PASSWORD', ''),
+        'HOST': os.environ.get('XRATINGS_DB_HOST', ''),
+        'PORT': os.environ.get('XRATINGS_DB_PORT', ''),
+        'TEST_NAME': SQLITE_NAME if ENGINE.endswith('sqlite3') else None,
+    },
+}
+DATABASES['default']['TEST'] = {'NAME': DATABASES['default']['TEST_NAME']}
+
+INSTALLED_APPS = (
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'xratings',
+    'ratings_test_app',
+)
+
+
+class DisableMigrations(object):
+    # The South migrations of xratings are not Django migrations; the tables
+    # are created from the models.
+
+    def __contains__(self, app_label):
+        return True
+
+    def __getitem__(self, app_label):
+        return 'notmigrations'
+
+
+MIGRATION_MODULES = DisableMigrations()
+SOUTH_TESTS_MIGRATE = False
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+SECRET_KEY = 'xratings-test'
+USE_TZ = True
+DEBUG = False
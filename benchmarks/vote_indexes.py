@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Query plans and timings of the ``Vote`` lookups before and after the indexes
+of migration 0004, on a synthetic SQLite table. Needs only the standard
+library::
+
+    python benchmarks/vote_indexes.py --rows 1000000 --lookups 5000
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from xratings import indexes  # noqa
+
+VENDOR = 'sqlite'
+
+CREATE_TABLE = """
+CREATE TABLE xratings_vote (
+    id integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    content_type_id integer NOT NULL,
+    object_id integer unsigned NOT NULL,
+    "key" varchar(32) NOT NULL,
+    score integer NOT NULL,
+    user_id integer NULL,
+    ip_address char(39) NOT NULL,
+    cookie varchar(32) NULL,
+    date_added datetime NOT NULL,
+    date_changed datetime NOT NULL
+)
+"""
+
+# The unique constraint of migration 0001.
+CREATE_OLD_UNIQUE = (
+    'CREATE UNIQUE INDEX xratings_vote_old_uniq ON xratings_vote (%s)'
+    % ', '.join('"%s"' % column for column in indexes.OLD_UNIQUE_COLUMNS))
+DROP_OLD_UNIQUE = 'DROP INDEX xratings_vote_old_uniq'
+
+# The queries of ``get_rating_for_user``/``add``, ``DatabaseLimiter`` and
+# the vote histograms of ``Vote.objects.delete``/``xratings_rebuild``.
+QUERIES = [
+    ('user vote',
+     'SELECT score FROM xratings_vote WHERE content_type_id = ? '
+     'AND object_id = ? AND "key" = ? AND user_id = ?'),
+    ('anonymous vote',
+     'SELECT score FROM xratings_vote WHERE content_type_id = ? '
+     'AND object_id = ? AND "key" = ? AND user_id IS NULL '
+     'AND ip_address = ? AND cookie IS NULL'),
+    ('ip limit',
+     'SELECT COUNT(*) FROM xratings_vote WHERE content_type_id = ? '
+     'AND object_id = ? AND "key" = ? AND ip_address = ? '
+     'AND date_changed >= ?'),
+    ('histograms',
+     'SELECT object_id, "key", score, COUNT(id) FROM xratings_vote '
+     'WHERE content_type_id = ? AND object_id >= ? AND object_id < ? '
+     'GROUP BY object_id, "key", score'),
+]
+
+KEYS = ['%032x' % n for n in range(3)]
+
+
+def populate(conn, rows, objects, users, seed):
+    rnd = random.Random(seed)
+    start = datetime(2015, 1, 1)
+
+    def votes():
+        for _ in range(rows):
+            when = (start + timedelta(minutes=rnd.randrange(525600))
+                    ).isoformat(str(' '))
+            ip = '10.%d.%d.%d' % (rnd.randrange(256), rnd.randrange(256),
+                                  rnd.randrange(256))
+            user = rnd.randrange(1, users) if rnd.random() < 0.7 else None
+            yield (1, rnd.randrange(objects), rnd.choice(KEYS),
+                   rnd.randint(1, 5), user, ip, None, when, when)
+
+    conn.executemany(
+        'INSERT INTO xratings_vote (content_type_id, object_id, "key", '
+        'score, user_id, ip_address, cookie, date_added, date_changed) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', votes())
+    conn.commit()
+
+
+def sample_params(conn, lookups, seed):
+    # Parameters of existing votes, so lookups hit rows.
+    rnd = random.Random(seed)
+    count = conn.execute('SELECT MAX(id) FROM xratings_vote').fetchone()[0]
+    ids = [rnd.randint(1, count) for _ in range(lookups)]
+    params = dict((name, []) for name, _ in QUERIES)
+    for pk in ids:
+        object_id, key, user_id, ip, changed = conn.execute(
+            'SELECT object_id, "key", user_id, ip_address, date_changed '
+            'FROM xratings_vote WHERE id = ?', (pk,)).fetchone()
+        params['user vote'].append((1, object_id, key, user_id or 0))
+        params['anonymous vote'].append((1, object_id, key, ip))
+        params['ip limit'].append((1, object_id, key, ip, changed))
+        params['histograms'].append((1, object_id, object_id + 100))
+    return params
+
+
+def measure(conn, params):
+    results = {}
+    for name, sql in QUERIES:
+        plan = [row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN ' + sql, params[name][0])]
+        started = time.time()
+        for args in params[name]:
+            conn.execute(sql, args).fetchall()
+        elapsed = time.time() - started
+        results[name] = {
+            'plan': plan,
+            'total_ms': round(elapsed * 1000, 2),
+            'per_query_us': round(elapsed * 1e6 / len(params[name]), 2),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--objects', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', default=':memory:')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as JSON.')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.database)
+    conn.execute('DROP TABLE IF EXISTS xratings_vote')
+    conn.execute(CREATE_TABLE)
+    conn.execute(CREATE_OLD_UNIQUE)
+    populate(conn, args.rows, args.objects, args.users, args.seed)
+    conn.execute('ANALYZE')
+    params = sample_params(conn, args.lookups, args.seed)
+
+    before = measure(conn, params)
+
+    started = time.time()
+    deleted = 0
+    for sql in indexes.get_dedupe_sql(VENDOR):
+        deleted += conn.execute(sql).rowcount
+    conn.execute(DROP_OLD_UNIQUE)
+    for sql in indexes.get_create_sql(VENDOR):
+        conn.execute(sql)
+    conn.execute('ANALYZE')
+    conn.commit()
+    migrate_ms = round((time.time() - started) * 1000, 2)
+
+    after = measure(conn, params)
+
+    results = {
+        'rows': args.rows,
+        'lookups': args.lookups,
+        'duplicates_deleted': deleted,
+        'migrate_ms': migrate_ms,
+        'before': before,
+        'after': after,
+    }
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('%d rows, %d lookups per query; migration took %.0f ms and '
+          'deleted %d duplicates' % (args.rows, args.lookups, migrate_ms,
+                                     deleted))
+    for name, _ in QUERIES:
+        print('\n%s' % name)
+        for label, result in (('before', before[name]),
+                              ('after', after[name])):
+            print('  %-6s %10.2f us/query  %s' % (
+                label, result['per_query_us'], ' | '.join(result['plan'])))
+
+
+if __name__ == '__main__':
+    main()
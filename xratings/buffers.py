@@ -0,0 +1,221 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import atexit
+import threading
+import time
+import weakref
+from importlib import import_module
+
+from django.core.cache import get_cache
+from django.db import connections, transaction
+
+from xratings.default_settings import (RATINGS_BUFFER, RATINGS_BUFFER_CACHE,
+                                       RATINGS_BUFFER_SIZE,
+                                       RATINGS_BUFFER_MAX_AGE)
+from xratings.limiters import total_seconds
+from xratings.utils import get_label, get_rating_field
+
+
+class BaseBuffer(object):
+    """
+    Write-behind buffer for the histogram deltas of votes added with
+    ``RatingManager.add(..., commit=False)``. Deltas are summed per object
+    and rating field and applied by ``flush`` with one conditional UPDATE
+    per object, once ``size`` votes are pending or the oldest of them is
+    ``max_age`` old (RATINGS_BUFFER_SIZE and RATINGS_BUFFER_MAX_AGE by
+    default). ``RatingManager.add`` only buffers the delta once the
+    transaction storing the vote commits.
+    """
+
+    def __init__(self, size=None, max_age=None):
+        self.size = RATINGS_BUFFER_SIZE if size is None else size
+        self.max_age = total_seconds(max_age or RATINGS_BUFFER_MAX_AGE)
+
+    def add(self, manager, delta):
+        # Buffers ``delta`` for ``manager``'s object and flushes if due.
+        field = manager.field
+        self.push((get_label(field.model), field.name, manager.instance.pk),
+                  delta)
+        if self.is_due():
+            self.flush()
+
+    def flush(self):
+        # Applies the pending deltas; returns the number of objects updated.
+        pending = self.pop()
+        by_field = {}
+        for (label, field_name, pk), delta in pending.items():
+            if any(delta):
+                by_field.setdefault((label, field_name), {})[pk] = delta
+        updated = 0
+        for (label, field_name), deltas in sorted(by_field.items()):
+            try:
+                model, field = get_rating_field(label, field_name)
+                with transaction.atomic(using=model._default_manager.db):
+                    field.apply_deltas(deltas)
+            except Exception:
+                # Keep what was not applied for the next flush.
+                for (label, field_name), deltas in by_field.items():
+                    for pk, delta in deltas.items():
+                        self.push((label, field_name, pk), delta)
+                raise
+            updated += len(deltas)
+            del by_field[label, field_name]
+        return updated
+
+    def push(self, key, delta):
+        raise NotImplementedError
+
+    def pop(self):
+        # Removes and returns the pending deltas as ``{key: delta}``.
+        raise NotImplementedError
+
+    def is_due(self):
+        raise NotImplementedError
+
+
+def merge(pending, key, delta):
+    current = pending.get(key)
+    if current is None:
+        pending[key] = list(delta)
+    else:
+        pending[key] = [a + b for a, b in zip(current, delta)]
+
+
+# The ``LocMemBuffer`` instances, flushed when the process exits.
+_locmem_buffers = weakref.WeakSet()
+
+
+def flush_locmem_buffers():
+    for locmem in list(_locmem_buffers):
+        locmem.flush()
+
+
+atexit.register(flush_locmem_buffers)
+
+
+class LocMemBuffer(BaseBuffer):
+    """
+    Keeps the deltas in process memory. A timer thread flushes them
+    ``max_age`` after the first pending vote, as does the exit of the
+    process.
+    """
+
+    def __init__(self, size=None, max_age=None):
+        super(LocMemBuffer, self).__init__(size, max_age)
+        self.pending = {}
+        self.count = 0
+        self.since = None
+        self.lock = threading.Lock()
+        _locmem_buffers.add(self)
+
+    def push(self, key, delta):
+        with self.lock:
+            merge(self.pending, key, delta)
+            self.count += 1
+            if self.since is None:
+                self.since = time.time()
+                timer = threading.Timer(self.max_age, self.flush_in_thread)
+                timer.daemon = True
+                timer.start()
+
+    def pop(self):
+        with self.lock:
+            pending = self.pending
+            self.pending, self.count, self.since = {}, 0, None
+        return pending
+
+    def flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+    def is_due(self):
+        return (self.count >= self.size or self.since is not None and
+                time.time() - self.since >= self.max_age)
+
+
+class CacheBuffer(BaseBuffer):
+    """
+    Keeps the deltas in the RATINGS_BUFFER_CACHE cache, shared by all
+    processes using it. Every vote is an entry numbered by a counter;
+    ``flush`` takes the entries after the last flushed one under a lock, so
+    only one process applies them.
+    """
+    # Seconds after which a numbered entry that never got written (its
+    # process died) is skipped, and a flush lock is considered stale.
+    grace = 30
+
+    def __init__(self, size=None, max_age=None, cache=None):
+        super(CacheBuffer, self).__init__(size, max_age)
+        self.cache = get_cache(cache or RATINGS_BUFFER_CACHE)
+        self.timeout = max(3600, int(self.max_age * 10))
+        self.prefix = 'xratings:buffer:'
+
+    def push(self, key, delta):
+        self.cache.add(self.prefix + 'last', 0, self.timeout)
+        number = self.cache.incr(self.prefix + 'last')
+        self.cache.set('%s%d' % (self.prefix, number),
+                       (key, list(delta), time.time()), self.timeout)
+        self.cache.add(self.prefix + 'since', time.time(), self.timeout)
+
+    def pop(self):
+        lock = self.prefix + 'lock'
+        if not self.cache.add(lock, 1, self.grace):
+            return {}
+        try:
+            values = self.cache.get_many([self.prefix + 'flushed',
+                                          self.prefix + 'last'])
+            flushed = values.get(self.prefix + 'flushed', 0)
+            last = values.get(self.prefix + 'last', 0)
+            names = ['%s%d' % (self.prefix, number)
+                     for number in range(flushed + 1, last + 1)]
+            entries = self.cache.get_many(names)
+            pending, taken = {}, []
+            for name in names:
+                if name not in entries:
+                    # Numbered but not written yet, unless later entries
+                    # are long past.
+                    later = [entry[2] for entry in entries.values()]
+                    if not later or min(later) > time.time() - self.grace:
+                        break
+                    taken.append(name)
+                    continue
+                key, delta, stamp = entries.pop(name)
+                merge(pending, key, delta)
+                taken.append(name)
+            if taken:
+                self.cache.set(self.prefix + 'flushed',
+                               flushed + len(taken), self.timeout)
+                self.cache.delete_many(taken)
+                self.cache.delete(self.prefix + 'since')
+                if len(taken) < len(names):
+                    self.cache.add(self.prefix + 'since', time.time(),
+                                   self.timeout)
+        finally:
+            self.cache.delete(lock)
+        return pending
+
+    def is_due(self):
+        values = self.cache.get_many([self.prefix + 'flushed',
+                                      self.prefix + 'last',
+                                      self.prefix + 'since'])
+        count = (values.get(self.prefix + 'last', 0) -
+                 values.get(self.prefix + 'flushed', 0))
+        since = values.get(self.prefix + 'since')
+        return (count >= self.size or since is not None and
+                time.time() - since >= self.max_age)
+
+
+_buffer = None
+
+
+def get_buffer():
+    # Returns the instance of RATINGS_BUFFER.
+    global _buffer
+    if _buffer is None:
+        module, name = RATINGS_BUFFER.rsplit('.', 1)
+        _buffer = getattr(import_module(module), name)()
+    return _buffer
@@ -1,45 +1,118 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
-from math import sqrt
 from datetime import timedelta
 
 from django.conf import settings
 
+# The formulas, still importable from here.
+from xratings.formulas import rating_bin_formula, rating_var_formula  # noqa
+
 # Used to limit the number of unique IPs that can vote on a single object+field.
 #   useful if you're getting rating spam by users registering multiple accounts
 RATINGS_VOTES_PER_IP = getattr(settings, 'RATINGS_VOTES_PER_IP', 3)
 RATINGS_VOTES_PER_IP_TIMEDELTA = getattr(settings,
                                          'RATINGS_VOTES_PER_IP_TIMEDELTA',
                                          timedelta(days=1))
+# Class checking RATINGS_VOTES_PER_IP: 'xratings.limiters.DatabaseLimiter'
+#   counts votes in the database, 'xratings.limiters.CacheLimiter' keeps
+#   counters in the RATINGS_VOTES_PER_IP_CACHE cache and
+#   'xratings.limiters.LocMemLimiter' in process memory.
+RATINGS_VOTES_PER_IP_LIMITER = getattr(settings,
+                                       'RATINGS_VOTES_PER_IP_LIMITER',
+                                       'xratings.limiters.DatabaseLimiter')
+RATINGS_VOTES_PER_IP_CACHE = getattr(settings, 'RATINGS_VOTES_PER_IP_CACHE',
+                                     'default')
+
+# Name of the cookie identifying an anonymous voter of an object, formatted
+#   with the ``content_type`` id, the ``object_id`` and the first 6
+#   characters of the field's ``key``.
+RATINGS_COOKIE_NAME = getattr(settings, 'RATINGS_COOKIE_NAME',
+                              'vote-%(content_type)d.%(object_id)d.%(key)s')
+
+# Apply vote deltas with conditional UPDATE queries instead of mutating the
+#   instance and waiting for ``save()``. Can be overridden per field with the
+#   ``atomic`` argument of ``RatingField``.
+RATINGS_ATOMIC_UPDATES = getattr(settings, 'RATINGS_ATOMIC_UPDATES', False)
+# Number of optimistic attempts before the row (of the rated object or the
+#   vote) is locked for the update.
+RATINGS_ATOMIC_RETRIES = getattr(settings, 'RATINGS_ATOMIC_RETRIES', 3)
+
+# Number of objects whose aggregates are updated per transaction by bulk
+#   operations such as deleting votes.
+RATINGS_BATCH_SIZE = getattr(settings, 'RATINGS_BATCH_SIZE', 500)
+
+# Write-behind buffer for votes added with ``add(..., commit=False)``:
+#   'xratings.buffers.LocMemBuffer' keeps the deltas in process memory,
+#   'xratings.buffers.CacheBuffer' in the RATINGS_BUFFER_CACHE cache. They
+#   are applied once RATINGS_BUFFER_SIZE votes are pending or the oldest is
+#   RATINGS_BUFFER_MAX_AGE old, or by the ``xratings_flush`` command.
+RATINGS_BUFFER = getattr(settings, 'RATINGS_BUFFER',
+                         'xratings.buffers.LocMemBuffer')
+RATINGS_BUFFER_CACHE = getattr(settings, 'RATINGS_BUFFER_CACHE', 'default')
+RATINGS_BUFFER_SIZE = getattr(settings, 'RATINGS_BUFFER_SIZE', 100)
+RATINGS_BUFFER_MAX_AGE = getattr(settings, 'RATINGS_BUFFER_MAX_AGE',
+                                 timedelta(seconds=10))
+
+# Where vote histograms are kept: 'json' stores them in the
+#   ``<field>_scores`` column of the rated model, 'table' in ``VoteCount``
+#   rows (one per object, field and choice). Can be overridden per field with
+#   the ``storage`` argument of ``RatingField``.
+RATINGS_STORAGE = getattr(settings, 'RATINGS_STORAGE', 'json')
+
+# Format of the ``<field>_scores`` column: 'json' text, or 'packed' binary
+#   fixed-width integers, only decoded when the histogram is read. Can be
+#   overridden per field with the ``histogram_format`` argument of
+#   ``RatingField``; the column type changes, so run ``xratings_rebuild``
+#   after migrating a field from one to the other.
+RATINGS_HISTOGRAM_FORMAT = getattr(settings, 'RATINGS_HISTOGRAM_FORMAT',
+                                   'json')
+
+# Sums of the shard rows of fields with ``RatingField(shards=N)`` are cached
+#   in RATINGS_SHARDS_CACHE for RATINGS_SHARDS_CACHE_TIMEOUT seconds.
+RATINGS_SHARDS_CACHE = getattr(settings, 'RATINGS_SHARDS_CACHE', 'default')
+RATINGS_SHARDS_CACHE_TIMEOUT = getattr(settings,
+                                       'RATINGS_SHARDS_CACHE_TIMEOUT', 5)
+
+# Keep hourly vote counts so the day, week and month scores only contain
+#   votes from the last day, week or month. Requires running the
+#   ``xratings_rollup`` management command periodically.
+RATINGS_ROLLING_PERIODS = getattr(settings, 'RATINGS_ROLLING_PERIODS', False)
+RATINGS_PERIOD_LENGTHS = getattr(settings, 'RATINGS_PERIOD_LENGTHS', {
+    'day': timedelta(days=1),
+    'week': timedelta(days=7),
+    'month': timedelta(days=30),
+})
+
+# Materialized leaderboards, kept up to date as votes arrive, as a dict
+#   mapping 'app_label.ModelName.field_name' to ``{period: size}``, period
+#   being 'score', 'day', 'week' or 'month'. E.g.
+#   ``{'blog.Post.rating': {'score': 1000, 'week': 500}}``.
+RATINGS_LEADERBOARDS = getattr(settings, 'RATINGS_LEADERBOARDS', {})
 
+# Sorted sets of object scores per rating field and period, kept up to date
+#   as votes arrive, for rank and top-N lookups without the database:
+#   'xratings.ranking.MemoryRanking' keeps them in process memory,
+#   'xratings.ranking.RedisRanking' in the Redis server at
+#   RATINGS_RANKING_URL. Disabled if ``None``.
+RATINGS_RANKING = getattr(settings, 'RATINGS_RANKING', None)
+RATINGS_RANKING_URL = getattr(settings, 'RATINGS_RANKING_URL',
+                              'redis://localhost:6379/0')
 
-def rating_bin_formula(scores, vrange):
-    #reddit furmula
-    if len(scores) == 0:
-        return 0
-    downs, ups = scores
-    n = ups + downs
-    if n == 0:
-        return 0
-    z = 1.25
-    p = float(ups) / n
-
-    left = p + 1 / (2 * n) * z * z
-    right = z * sqrt(p * (1 - p) / n + z * z / (4 * n * n))
-    under = 1 + 1 / n * z * z
-    return (left - right) / under
-
-
-def rating_var_formula(scores, vrange):
-    if (not(isinstance(scores, list) and isinstance(vrange, list)) or
-            not (sum(scores) > 0 and len(vrange) > 0)):
-        return 0
-    votes = float(sum(scores))
-    vmin = float(0)
-    avg = sum([a * b for a, b in zip(vrange, scores)]) / sum(scores)
-    fix = 0.1
-    return (votes / (votes + vmin)) * avg + (vmin / (votes + vmin)) * fix
+# Collector of the timings of the vote path and of rejected votes:
+#   'xratings.metrics.NullCollector' records nothing,
+#   'xratings.metrics.HistogramCollector' keeps histograms in process memory
+#   and 'xratings.metrics.StatsdCollector' sends them to the statsd server at
+#   RATINGS_METRICS_STATSD, prefixed with RATINGS_METRICS_PREFIX.
+RATINGS_METRICS = getattr(settings, 'RATINGS_METRICS',
+                          'xratings.metrics.NullCollector')
+RATINGS_METRICS_STATSD = getattr(settings, 'RATINGS_METRICS_STATSD',
+                                 'localhost:8125')
+RATINGS_METRICS_PREFIX = getattr(settings, 'RATINGS_METRICS_PREFIX',
+                                 'xratings')
+# Also count the queries of every phase. Forces the debug cursor, which
+#   keeps the SQL of every query of the connection like DEBUG does.
+RATINGS_METRICS_QUERIES = getattr(settings, 'RATINGS_METRICS_QUERIES', False)
 
 RATINGS_DEFAULT_FORMULA = getattr(settings, 'RATINGS_DEFAULT_FORMULA',
                                   rating_bin_formula)
@@ -1,21 +1,36 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
+import random
+from base64 import b64encode
 from hashlib import md5
 from django.conf import settings
 
+from django.utils import six
 from django.utils.six import python_2_unicode_compatible
 from django.utils.timezone import now
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import IntegerField, FloatField
+from django.core.cache import get_cache
+from django.db import connections, transaction
+from django.db.models import IntegerField, FloatField, BinaryField, F
 from django_extensions.db.fields.json import JSONField
 
-from xratings.default_settings import RATINGS_VOTES_PER_IP
-from xratings.models import Vote
+from xratings.histograms import LazyHistogram, Sequence, pack
+from xratings.models import Vote, VoteCount, HourlyVoteCount
+from xratings.querysets import load_deferred_columns
+from xratings.votecache import get_vote_cache
+from xratings.limiters import get_limiter
+from xratings.buffers import get_buffer
+from xratings.transactions import on_commit
+from xratings.metrics import get_collector
+from xratings.signals import rating_changed, xrating_rated, xrating_will_rate
 from xratings.exceptions import (InvalidRating, CannotDeleteVote, AuthRequired,
                                 IPLimitReached, CannotChangeVote)
 from xratings.default_settings import RATINGS_DEFAULT_FORMULA, \
-    RATINGS_VOTES_PER_IP_TIMEDELTA
+    RATINGS_ATOMIC_UPDATES, RATINGS_ATOMIC_RETRIES, RATINGS_STORAGE, \
+    RATINGS_ROLLING_PERIODS, RATINGS_SHARDS_CACHE, \
+    RATINGS_SHARDS_CACHE_TIMEOUT, RATINGS_HISTOGRAM_FORMAT, \
+    RATINGS_COOKIE_NAME
 
 if 'django.contrib.contenttypes' not in settings.INSTALLED_APPS:
     raise ImportError('xratings requires django.contrib.contenttypes in your '
@@ -24,6 +39,17 @@ if 'django.contrib.contenttypes' not in settings.INSTALLED_APPS:
 
 __all__ = ('Rating', 'RatingField', 'AnonymousRatingField')
 
+STORAGE_JSON = 'json'
+STORAGE_TABLE = 'table'
+
+FORMAT_JSON = 'json'
+FORMAT_PACKED = 'packed'
+
+
+# Exceptions rejecting a vote, counted by the metrics collector.
+VOTE_ERRORS = (InvalidRating, CannotDeleteVote, AuthRequired, IPLimitReached,
+               CannotChangeVote)
+
 
 def md5_hexdigest(value):
     return md5(value).hexdigest()
@@ -39,18 +65,67 @@ class Rating(object):
         self.votes = votes
 
 
+class RatingSpec(object):
+    # Names and lookups of a ``RatingField`` computed once per model, shared
+    # by all of its ``RatingManager`` instances.
+    __slots__ = ('model', 'name', 'key', 'score', 'day', 'week', 'month',
+                 'scores', 'columns', 'index', 'manager_cache_name',
+                 'histogram_cache_name', '_content_type_id')
+
+    def __init__(self, model, name, key, vrange):
+        self.model = model
+        self.name = name
+        self.key = key
+        self.score = '%s_score' % (name,)
+        self.day = '%s_day' % (name,)
+        self.week = '%s_week' % (name,)
+        self.month = '%s_month' % (name,)
+        self.scores = '%s_scores' % (name,)
+        self.columns = (self.score, self.day, self.week, self.month,
+                        self.scores)
+        # choice -> position in the histogram
+        self.index = dict((choice, i) for i, choice in enumerate(vrange))
+        self.manager_cache_name = '_%s_manager' % (name,)
+        self.histogram_cache_name = '_%s_histogram' % (name,)
+        self._content_type_id = None
+
+    @property
+    def content_type_id(self):
+        # Resolved on first use, the table may not exist at import time.
+        if self._content_type_id is None:
+            self._content_type_id = ContentType.objects\
+                .get_for_model(self.model).pk
+        return self._content_type_id
+
+
+def _stale_manager():
+    return None
+
+
 @python_2_unicode_compatible
 class RatingManager(object):
+    __slots__ = ('instance', 'field', 'spec', 'score_field_name',
+                 'score_day_field_name', 'score_week_field_name',
+                 'score_month_field_name', 'scores_field_name',
+                 'histogram_loaded_name', 'rating_field_names')
+
     def __init__(self, instance, field):
-        self.content_type = None
         self.instance = instance
         self.field = field
+        spec = self.spec = field.spec
+
+        self.score_field_name = spec.score
+        self.score_day_field_name = spec.day
+        self.score_week_field_name = spec.week
+        self.score_month_field_name = spec.month
+        self.scores_field_name = spec.scores
+        self.histogram_loaded_name = spec.histogram_cache_name
+        self.rating_field_names = spec.columns
 
-        self.score_field_name = '%s_score' % (self.field.name,)
-        self.score_day_field_name = '%s_day' % (self.field.name,)
-        self.score_week_field_name = '%s_week' % (self.field.name,)
-        self.score_month_field_name = '%s_month' % (self.field.name,)
-        self.scores_field_name = '%s_scores' % (self.field.name,)
+    def __reduce__(self):
+        # Managers are cached on instances; a pickled instance gets a new
+        # one when it is accessed.
+        return (_stale_manager, ())
 
     def __str__(self):
         return '%d' % self.get_rating()
@@ -101,114 +176,132 @@ class RatingManager(object):
 
         use_cookies = (self.field.allow_anonymous and self.field.use_cookies)
         if use_cookies:
-            # TODO: move 'vote-%d.%d.%s' to settings or something
-            cookie_name = 'vote-%d.%d.%s' % (
-                kwargs['content_type'].pk, kwargs['object_id'],
-                kwargs['key'][:6],)  # -> md5_hexdigest?
-            cookie = cookies.get(cookie_name)
+            cookie = cookies.get(self.get_cookie_name())
             if cookie:
                 kwargs['cookie'] = cookie
             else:
                 kwargs['cookie__isnull'] = True
-        try:
-            rating = Vote.objects.get(**kwargs)
-            return rating.score
-        except Vote.MultipleObjectsReturned:
-            pass
-        except Vote.DoesNotExist:
-            pass
-        return
+
+        cache = get_vote_cache()
+        if cache is not None:
+            vote_key = self.get_vote_key(user, ip_address, cookies)
+            if vote_key in cache:
+                return cache[vote_key]
+        # Duplicates can only be left over from the unique constraint of
+        # migration 0001 (backends without partial indexes); the latest
+        # counts.
+        scores = list(Vote.objects.filter(**kwargs).order_by('-pk')
+                      .values_list('score', flat=True)[:1])
+        score = scores[0] if scores else None
+        if cache is not None:
+            cache[vote_key] = score
+        return score
+
+    def get_vote_key(self, user, ip_address=None, cookies=None):
+        # Identifies the vote ``get_rating_for_user`` looks up, see
+        # ``VoteManager.get_for_voter_in_bulk``.
+        cookie = None
+        if self.field.allow_anonymous and self.field.use_cookies:
+            cookie = (cookies or {}).get(self.get_cookie_name()) or None
+        if user is not None and user.is_authenticated():
+            user_id, ip_address = user.pk, None
+        else:
+            user_id = None
+        return (self.spec.content_type_id, self.instance.pk, self.spec.key,
+                user_id, ip_address, cookie)
 
     def add(self, score, user, ip_address, cookies=None, commit=True):
+        collector = get_collector()
+        try:
+            with collector.phase('add'):
+                return self._add(score, user, ip_address, cookies, commit,
+                                 collector)
+        except VOTE_ERRORS as e:
+            collector.incr('rejected.%s' % (e.__class__.__name__,))
+            raise
+
+    def _add(self, score, user, ip_address, cookies, commit, collector):
         if not cookies:
             cookies = {}
 
-        try:
-            score = int(score)
-        except (ValueError, TypeError):
-            raise InvalidRating('%s is not a valid choice for %s' %
-                                (score, self.field.name))
-
+        score, user = self.field.clean_vote(score, user)
         delete = (score == 0)
-        if delete and not self.field.allow_delete:
-            raise CannotDeleteVote('you are not allowed to delete votes for %s' %
-                                   (self.field.name,))
-
-        if not self.field.check_range(score):
-            raise InvalidRating('%s is not a valid choice for %s' %
-                                (score, self.field.name))
-
-        is_anonymous = (user is None or not user.is_authenticated())
-        if is_anonymous and not self.field.allow_anonymous:
-            raise AuthRequired('user must be a user, not `%r`' % (user,))
+        if xrating_will_rate.has_listeners(self.field.model):
+            xrating_will_rate.send(sender=self.field.model,
+                                   obj=self.instance, score=score, user=user)
 
-        if is_anonymous:
-            user = None
-
-        defaults = {
-            'score': score,
-            'ip_address': ip_address
-        }
-        kwargs = {
+        lookup = {
             'content_type': self.get_content_type(),
             'object_id': self.instance.pk,
             'key': self.field.key,
             'user': user
         }
+        defaults = {'ip_address': ip_address}
         if not user:
-            kwargs['ip_address'] = ip_address
+            lookup['ip_address'] = ip_address
 
         use_cookies = (self.field.allow_anonymous and self.field.use_cookies)
         if use_cookies:
+            cookie_name = self.get_cookie_name()
+            cookie = lookup['cookie'] = cookies.get(cookie_name) or None
             defaults['cookie'] = now().strftime('%Y%m%d%H%M%S%f')
-            cookie_name = 'vote-%d.%d.%s' % (kwargs['content_type'].pk,
-                                             kwargs['object_id'],
-                                             kwargs['key'][:6],)
-            cookie = cookies.get(cookie_name)
-            if not cookie:
-                kwargs['cookie__isnull'] = True
-            kwargs['cookie'] = cookie
 
-        try:
-            rating, created = Vote.objects.get(**kwargs), False
-        except Vote.DoesNotExist:
-            if delete:
+        new_score = None if delete else score
+        cache = get_vote_cache()
+        if cache is not None:
+            # Votes known to exist or not can be rejected without queries.
+            cached = cache.get(self.get_vote_key(user, ip_address, cookies),
+                               0)
+            if cached is None and delete:
                 raise CannotDeleteVote(
-                    'attempt to find and delete your vote for %s is failed' %
-                    (self.field.name,))
-            if RATINGS_VOTES_PER_IP > 0:
-                num_votes = Vote.objects.filter(
-                    content_type=kwargs['content_type'],
-                    object_id=kwargs['object_id'],
-                    key=kwargs['key'],
-                    ip_address=ip_address,
-                    date_changed__gte=now() - RATINGS_VOTES_PER_IP_TIMEDELTA
-                ).count()
-                if num_votes >= RATINGS_VOTES_PER_IP:
-                    raise IPLimitReached()
-            kwargs.update(defaults)
-            if use_cookies:
-                cookie = defaults['cookie']
-                kwargs.pop('cookie__isnull', '')
-            rating, created = Vote.objects.create(**kwargs), True
-
-        # self.score = self.get_rating()
-
-        if not created:
-            if self.field.can_change_vote:
-                self.scores[self.field.range.index(rating.score)] -= 1
-                if not delete:
-                    self.scores[self.field.range.index(score)] += 1
-                else:
-                    rating.delete()
-            else:
+                    'attempt to find and delete your vote for %s is '
+                    'failed' % (self.field.name,))
+            if cached and not self.field.can_change_vote:
                 raise CannotChangeVote()
-        else:
-            if not (isinstance(self.scores, list) and len(self.scores) == len([0] * len(self.field.range))):
-                self.scores = [0] * len(self.field.range)
-            self.scores[self.field.range.index(score)] += 1
 
-        self.score = self.get_rating()
+        counted = False
+        try:
+            with transaction.atomic(using=Vote.objects.db):
+                # One query on PostgreSQL: inserts, changes or deletes the vote
+                # and returns the previous score.
+                old = Vote.objects.record(lookup, new_score, defaults,
+                                          update=self.field.can_change_vote)
+                created = old is None
+                old_score = None if created else old[0]
+                if created:
+                    if delete:
+                        raise CannotDeleteVote(
+                            'attempt to find and delete your vote for %s is '
+                            'failed' % (self.field.name,))
+                    with collector.phase('limiter'):
+                        self.check_ip_limit(ip_address)
+                    counted = True
+                    if use_cookies:
+                        cookie = defaults['cookie']
+                elif not self.field.can_change_vote:
+                    raise CannotChangeVote()
+                delta = self.get_delta(old_score, new_score)
+                if RATINGS_ROLLING_PERIODS:
+                    self._count_hourly(old, new_score)
+                if commit:
+                    with collector.phase('aggregate'):
+                        self.apply_delta(delta)
+        except Exception:
+            # Not stored after all.
+            if counted:
+                get_limiter().release(self, ip_address)
+            raise
+        if not commit:
+            # The scores are updated later, see ``xratings.buffers``, if the
+            # vote is committed.
+            with collector.phase('aggregate'):
+                on_commit(lambda: get_buffer().add(self, delta),
+                          using=Vote.objects.db)
+
+        if cache is not None:
+            if use_cookies:
+                cookies = {cookie_name: cookie}
+            cache[self.get_vote_key(user, ip_address, cookies)] = new_score
 
         # return value
         adds = {
@@ -219,22 +312,229 @@ class RatingManager(object):
             'score_sum': self.get_real_rating(),
             'scores': self.scores,
             'deleted': delete,
-            'created': created}
+            'created': created,
+            'previous_score': old_score,
+            'buffered': not commit}
         if use_cookies:
             adds['cookie_name'] = cookie_name
             adds['cookie'] = cookie
+        if xrating_rated.has_listeners(self.field.model):
+            xrating_rated.send(sender=self.field.model, obj=self.instance,
+                               score=score, user=user)
         return adds
 
+    def _count_hourly(self, old, new_score):
+        # Moves the vote from the hourly count it was in, ``old`` being its
+        # previous ``(score, date_changed)``, to the current hour's.
+        votes = []
+        key = (self.spec.content_type_id, self.instance.pk, self.field.key)
+        if old is not None:
+            votes.append(key + (old[0], old[1], -1))
+        if new_score is not None:
+            votes.append(key + (new_score, now(), 1))
+        HourlyVoteCount.objects.add_votes(votes)
+
+    def check_ip_limit(self, ip_address):
+        # Called after a new vote from ``ip_address`` has been inserted; a
+        # rejected vote is rolled back and does not count.
+        limiter = get_limiter()
+        if not limiter.allow(self, ip_address):
+            limiter.release(self, ip_address)
+            raise IPLimitReached()
+
+    def get_cookie_name(self):
+        return RATINGS_COOKIE_NAME % {
+            'content_type': self.spec.content_type_id,
+            'object_id': self.instance.pk, 'key': self.field.key[:6]}
+
     def _rm_vote(self, score):
-        self.scores[self.field.range.index(score)] -= 1
+        self.apply_delta(self.get_delta(score, None))
+
+    def get_delta(self, old_score=None, new_score=None):
+        # Returns per-choice vote count changes for replacing ``old_score``
+        # with ``new_score``, ``None`` meaning no vote.
+        delta = [0] * len(self.field.range)
+        if old_score is not None:
+            delta[self.spec.index[old_score]] -= 1
+        if new_score is not None:
+            delta[self.spec.index[new_score]] += 1
+        return delta
+
+    def apply_delta(self, delta, atomic=None):
+        # Adds ``delta`` to the histogram and recalculates the scores, either
+        # on the instance (saved by the caller) or directly in the database.
+        if atomic is None:
+            atomic = self.field.atomic
+        self.field.observe_deltas([delta])
+        if self.field.shards > 1:
+            self._apply_delta_sharded(delta)
+            return
+        if self.field.storage == STORAGE_TABLE:
+            self._apply_delta_table(delta)
+            return
+        if atomic:
+            self._apply_delta_atomic(delta)
+            return
+        old_score = self.score or 0
+        scores = self.field.to_histogram(self.scores)
+        self.scores = [a + b for a, b in zip(scores, delta)]
         self.score = self.get_rating()
+        self._record_change(self.score - old_score)
+
+    def _apply_delta_atomic(self, delta, current=None):
+        queryset = self.field.model._default_manager.filter(
+            pk=self.instance.pk)
+        # A loaded instance usually still holds the stored values, which
+        # saves reading them before the first attempt.
+        if current is None and not self.instance._state.adding:
+            self.load_deferred()
+            current = dict((name, getattr(self.instance, name))
+                           for name in self.rating_field_names)
+        for attempt in range(RATINGS_ATOMIC_RETRIES):
+            current = current or self._read_values(queryset)
+            values = self._update_if_unchanged(queryset, delta, current)
+            if values is not None:
+                break
+            current = None
+        else:
+            # Too much contention for optimistic writes, wait for the row.
+            with transaction.atomic(using=queryset.db):
+                queryset = queryset.select_for_update()
+                current = self._read_values(queryset)
+                values = self._update_if_unchanged(queryset, delta, current,
+                                                   locked=True)
+        for name, value in values.items():
+            setattr(self.instance, name, value)
+        self._record_change(values[self.score_field_name] -
+                            (current[self.score_field_name] or 0))
+
+    def _read_values(self, queryset):
+        rows = list(queryset.values(*self.rating_field_names)[:1])
+        if not rows:
+            raise self.field.model.DoesNotExist()
+        return rows[0]
+
+    def _update_if_unchanged(self, queryset, delta, current, locked=False):
+        # Conditional UPDATE: only succeeds if the histogram still is the
+        # ``current`` one, so concurrent votes are never lost. Returns the
+        # new values of the rating columns, or ``None`` if the row was
+        # changed in the meantime. A row ``locked`` by the caller is updated
+        # unconditionally: the text of the stored histogram may not compare
+        # equal to ``current`` even though it is unchanged.
+        raw = current[self.scores_field_name]
+        scores = [a + b for a, b in zip(self.field.to_histogram(raw), delta)]
+        new_score = self.field.rating_calculator(scores, self.field.range)
+        diff = new_score - (current[self.score_field_name] or 0)
+
+        connection = connections[queryset.db]
+        column = '%s.%s' % (
+            connection.ops.quote_name(self.field.model._meta.db_table),
+            connection.ops.quote_name(self.field.scores_field.column))
+        if raw is None and not locked:
+            queryset = queryset.extra(where=['%s IS NULL' % column])
+        elif not locked:
+            if not isinstance(raw, six.string_types):
+                raw = self.field.scores_field.get_db_prep_save(raw,
+                                                              connection)
+            queryset = queryset.extra(where=['%s = %%s' % column],
+                                      params=[raw])
+        updated = queryset.update(**{
+            self.scores_field_name: scores,
+            self.score_field_name: new_score,
+            self.score_day_field_name: F(self.score_day_field_name) + diff,
+            self.score_week_field_name: F(self.score_week_field_name) + diff,
+            self.score_month_field_name: F(self.score_month_field_name) + diff,
+        })
+        if not updated:
+            if locked:
+                raise self.field.model.DoesNotExist()
+            return None
+        values = {self.scores_field_name: scores,
+                  self.score_field_name: new_score}
+        for name in (self.score_day_field_name, self.score_week_field_name,
+                     self.score_month_field_name):
+            values[name] = (current[name] or 0) + diff
+        return values
+
+    def _apply_delta_table(self, delta):
+        # Histogram rows are incremented in place; the rated model's row only
+        # receives the recalculated scores.
+        content_type = self.get_content_type()
+        with transaction.atomic(using=VoteCount.objects.db):
+            VoteCount.objects.add_delta(content_type, self.instance.pk,
+                                        self.field.key, self.field.range,
+                                        delta)
+            scores = VoteCount.objects.get_histogram(
+                content_type, self.instance.pk, self.field.key,
+                self.field.range)
+        old_scores = [a - b for a, b in zip(scores, delta)]
+        new_score = self.field.rating_calculator(scores, self.field.range)
+        diff = new_score - self.field.rating_calculator(old_scores,
+                                                        self.field.range)
+        self.scores = scores
+        self._update_score(new_score, diff)
+        self.refresh()
+        self._record_change(diff)
+
+    def _apply_delta_sharded(self, delta):
+        # Increments one of the shard rows only; the rated model's row is
+        # updated by ``xratings.shards.fold``.
+        VoteCount.objects.add_delta(
+            self.get_content_type(), self.instance.pk, self.field.key,
+            self.field.range, delta,
+            shard=random.randint(1, self.field.shards))
+        self.scores = [a + b for a, b in zip(self.scores, delta)]
+
+    def _update_score(self, new_score, diff):
+        # Sets the score column and moves the period scores by ``diff``.
+        queryset = self.field.model._default_manager.filter(
+            pk=self.instance.pk)
+        queryset.update(**{
+            self.score_field_name: new_score,
+            self.score_day_field_name: F(self.score_day_field_name) + diff,
+            self.score_week_field_name: F(self.score_week_field_name) + diff,
+            self.score_month_field_name: F(self.score_month_field_name) + diff,
+        })
+
+    def _record_change(self, diff):
+        # Called once the instance holds the new scores: notifies the
+        # receivers of ``rating_changed``.
+        if not diff:
+            return
+        if rating_changed.has_listeners(self.field.model):
+            rating_changed.send(sender=self.field.model, manager=self,
+                                diff=diff)
+
+    def refresh(self):
+        # Reloads the rating columns (and only them) from the database.
+        names = [self.score_field_name, self.score_day_field_name,
+                 self.score_week_field_name, self.score_month_field_name]
+        if self.field.storage == STORAGE_JSON:
+            names.append(self.scores_field_name)
+        values = self.field.model._default_manager.filter(
+            pk=self.instance.pk).values_list(*names)[0]
+        for name, value in zip(names, values):
+            setattr(self.instance, name, value)
+        if self.field.storage == STORAGE_JSON:
+            self.scores = self.field.to_histogram(self.scores)
+
+    def load_deferred(self):
+        # Loads the rating columns deferred by ``with_ratings`` or
+        # ``without_ratings``, together for the whole result set.
+        instance_dict = self.instance.__dict__
+        for name in self.rating_field_names:
+            if name not in instance_dict:
+                load_deferred_columns(self.instance, self.field)
+                return
 
     @property
     def score(self, default=None):
+        self.load_deferred()
         return getattr(self.instance, self.score_field_name, default)
 
     @score.setter
     def score(self, value):
+        self.load_deferred()
         old = getattr(self.instance, self.score_field_name, 0)
 
         old_day = getattr(self.instance, self.score_day_field_name, 0)
@@ -253,33 +553,98 @@ class RatingManager(object):
 
     @property
     def scores(self, default=None):
+        self.load_deferred()
+        if (self.field.storage == STORAGE_TABLE and
+                not getattr(self.instance, self.histogram_loaded_name, False)):
+            if self.field.shards > 1:
+                self.scores = self._get_sharded_histogram()
+            else:
+                self.scores = VoteCount.objects.get_histogram(
+                    self.get_content_type(), self.instance.pk,
+                    self.field.key, self.field.range)
         return getattr(self.instance, self.scores_field_name, default)
 
     @scores.setter
     def scores(self, value):
         setattr(self.instance, self.scores_field_name, value)
+        if self.field.storage == STORAGE_TABLE:
+            # The column is only a cache of the ``VoteCount`` rows.
+            setattr(self.instance, self.histogram_loaded_name, True)
+
+    def _get_sharded_histogram(self):
+        cache = get_cache(RATINGS_SHARDS_CACHE)
+        key = 'xratings:shards:%s:%s:%s' % (self.spec.content_type_id,
+                                            self.instance.pk, self.spec.key)
+        scores = cache.get(key)
+        if scores is None:
+            scores = VoteCount.objects.get_histogram(
+                self.get_content_type(), self.instance.pk, self.field.key,
+                self.field.range)
+            cache.set(key, scores, RATINGS_SHARDS_CACHE_TIMEOUT)
+        return scores
 
     def get_content_type(self):
-        if self.content_type is None:
-            self.content_type = ContentType.objects\
-                .get_for_model(self.instance)
-        return self.content_type
+        return ContentType.objects.get_for_id(self.spec.content_type_id)
 
 
 class RatingCreator(object):
     def __init__(self, field):
         self.field = field
-        self.score_field_name = '%s_score' % (self.field.name,)
-        self.score_day_field_name = '%s_day' % (self.field.name,)
-        self.score_week_field_name = '%s_week' % (self.field.name,)
-        self.score_month_field_name = '%s_month' % (self.field.name,)
-        self.scores_field_name = '%s_scores' % (self.field.name,)
+        self.cache_name = field.spec.manager_cache_name
 
     def __get__(self, instance, type=None):
         if instance is None:
             raise AttributeError('Can only be accessed via an instance.')
             # return self.field
-        return RatingManager(instance, self.field)
+        # One manager per instance; copies of the instance get their own.
+        manager = instance.__dict__.get(self.cache_name)
+        if manager is None or manager.instance is not instance:
+            manager = RatingManager(instance, self.field)
+            instance.__dict__[self.cache_name] = manager
+        return manager
+
+
+class PackedHistogramField(BinaryField):
+    """
+    Binary column holding a histogram of ``length`` counts as fixed-width
+    integers, see ``xratings.histograms``. Loaded values are
+    ``LazyHistogram`` objects, decoded only when the counts are read.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.length = kwargs.pop('length')
+        super(PackedHistogramField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(PackedHistogramField,
+                                         self).deconstruct()
+        kwargs['length'] = self.length
+        return name, path, args, kwargs
+
+    def get_default(self):
+        return LazyHistogram(pack([0] * self.length))
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return value
+        return LazyHistogram(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, (LazyHistogram, list)):
+            return value
+        # Base64 text of serialized objects.
+        value = super(PackedHistogramField, self).to_python(value)
+        return LazyHistogram(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if (value is not None and
+                not isinstance(value, (bytes, bytearray, memoryview))):
+            value = pack(value)
+        return super(PackedHistogramField, self).get_db_prep_value(
+            value, connection, prepared)
+
+    def value_to_string(self, obj):
+        return b64encode(pack(self.value_from_object(obj))).decode('ascii')
 
 
 class RatingField(IntegerField):
@@ -295,6 +660,26 @@ class RatingField(IntegerField):
         self.use_cookies = kwargs.pop('use_cookies', False)
         self.allow_delete = kwargs.pop('allow_delete', False)
         self.rating_calculator = kwargs.pop('formula', RATINGS_DEFAULT_FORMULA)
+        self.atomic = kwargs.pop('atomic', RATINGS_ATOMIC_UPDATES)
+        # Spreads the vote counts over this many rows per choice, for objects
+        # receiving too many votes to update one row each time.
+        self.shards = kwargs.pop('shards', 1)
+        self.storage = kwargs.pop('storage', STORAGE_TABLE if self.shards > 1
+                                  else RATINGS_STORAGE)
+        if self.storage not in (STORAGE_JSON, STORAGE_TABLE):
+            raise ValueError('%s: unknown storage `%s`.' %
+                             (self.__class__.__name__, self.storage))
+        if self.shards > 1 and self.storage != STORAGE_TABLE:
+            raise ValueError('%s: `shards` requires `storage=\'table\'`.' %
+                             (self.__class__.__name__,))
+        # How the ``<field>_scores`` column holds the histogram: 'json' text
+        # or 'packed' fixed-width integers.
+        self.histogram_format = kwargs.pop('histogram_format',
+                                           RATINGS_HISTOGRAM_FORMAT)
+        if self.histogram_format not in (FORMAT_JSON, FORMAT_PACKED):
+            raise ValueError('%s: unknown histogram format `%s`.' %
+                             (self.__class__.__name__,
+                              self.histogram_format))
         kwargs['editable'] = False
         kwargs['default'] = 0
         kwargs['blank'] = True
@@ -302,6 +687,7 @@ class RatingField(IntegerField):
 
     def contribute_to_class(self, cls, name, virtual_only=False):
         self.name = name
+        self.model = cls
 
         # Computed rating
         self.score_field = FloatField(editable=False, db_index=True,
@@ -322,9 +708,15 @@ class RatingField(IntegerField):
 
         # Each score qty [5,9]
         scores = [0] * len(self.range)
-        self.scores_field = JSONField(editable=False, default=scores)
+        if self.histogram_format == FORMAT_PACKED:
+            self.scores_field = PackedHistogramField(length=len(self.range))
+        else:
+            self.scores_field = JSONField(editable=False, default=scores)
         cls.add_to_class('%s_scores' % (self.name,), self.scores_field)
         self.key = md5_hexdigest(self.name)
+        self.spec = RatingSpec(cls, name, self.key, self.range)
+        if hasattr(self.rating_calculator, 'contribute_to_field'):
+            self.rating_calculator.contribute_to_field(self)
 
         field = RatingCreator(self)
 
@@ -334,6 +726,11 @@ class RatingField(IntegerField):
 
         setattr(cls, name, field)
 
+    def get_rating_manager(self, pk):
+        # Returns a manager for the object with primary key ``pk`` without
+        # loading it; only useful with ``atomic`` fields.
+        return RatingManager(self.model(pk=pk), self)
+
     def get_db_prep_save(self, value, connection):
         # XXX: what happens here?
         pass
@@ -347,10 +744,70 @@ class RatingField(IntegerField):
         defaults.update(kwargs)
         return super(RatingField, self).formfield(**defaults)
 
+    def to_histogram(self, value):
+        # Decodes a ``<field>_scores`` value (``values_list`` may return it
+        # serialized) into a sequence with one count per choice.
+        if isinstance(value, (six.string_types, six.binary_type, bytearray,
+                              memoryview)):
+            value = self.scores_field.to_python(value)
+        if not (isinstance(value, Sequence) and
+                len(value) == len(self.range)):
+            return [0] * len(self.range)
+        return value
+
+    def clean_vote(self, score, user):
+        # Validates a vote, returns the score as an integer (0 meaning
+        # deletion) and the user, ``None`` if anonymous.
+        try:
+            score = int(score)
+        except (ValueError, TypeError):
+            raise InvalidRating('%s is not a valid choice for %s' %
+                                (score, self.name))
+
+        delete = (score == 0)
+        if delete and not self.allow_delete:
+            raise CannotDeleteVote('you are not allowed to delete votes for '
+                                   '%s' % (self.name,))
+
+        if not self.check_range(score):
+            raise InvalidRating('%s is not a valid choice for %s' %
+                                (score, self.name))
+
+        is_anonymous = (user is None or not user.is_authenticated())
+        if is_anonymous and not self.allow_anonymous:
+            raise AuthRequired('user must be a user, not `%r`' % (user,))
+
+        if is_anonymous:
+            user = None
+        return score, user
+
+    def apply_deltas(self, deltas):
+        # Applies ``{pk: delta}`` to many objects at once, reading their
+        # current values with a single query; missing objects are skipped.
+        if self.storage == STORAGE_TABLE:
+            for pk, delta in deltas.items():
+                self.get_rating_manager(pk).apply_delta(delta)
+            return
+        rows = self.model._default_manager.filter(pk__in=list(deltas))\
+            .values('pk', *self.spec.columns)
+        self.observe_deltas(deltas.values())
+        for current in rows:
+            manager = self.get_rating_manager(current.pop('pk'))
+            manager._apply_delta_atomic(deltas[manager.instance.pk], current)
+
+    def observe_deltas(self, deltas):
+        # Lets formulas keeping statistics of all votes, such as
+        # ``xratings.priors.BayesianFormula``, see the histogram deltas.
+        if hasattr(self.rating_calculator, 'observe'):
+            self.rating_calculator.observe(deltas)
+
+    @classmethod
+    def bulk_add(cls, votes, chunk_size=1000):
+        # See ``VoteManager.bulk_add``.
+        return Vote.objects.bulk_add(votes, chunk_size=chunk_size)
+
     def check_range(self, score):
-        if isinstance(self.range, list):
-            return score in self.range
-        return False
+        return score in self.spec.index
 
 
 class AnonymousRatingField(RatingField):
@@ -0,0 +1,119 @@
+# coding=utf-8
+"""
+Rating formulas: ``formula(scores, vrange)`` returns the score of one
+histogram. A formula can have a vectorized implementation taking a 2-D
+NumPy array of histograms (one row per object) and returning an array of
+scores, which must equal the scalar results exactly; ``evaluate`` uses it
+for batches when NumPy is installed.
+"""
+from __future__ import unicode_literals
+
+from math import sqrt
+
+from xratings.histograms import Sequence
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_vectorized = {}
+
+
+def register(formula, vectorized):
+    # Registers ``vectorized`` as the batch implementation of ``formula``.
+    _vectorized[formula] = vectorized
+
+
+def vectorizes(formula):
+    # Decorator version of ``register``.
+    def decorator(vectorized):
+        register(formula, vectorized)
+        return vectorized
+    return decorator
+
+
+def get_vectorized(formula):
+    # Returns the batch implementation of ``formula`` if there is one and
+    # NumPy is installed; formula objects can define it as their
+    # ``vectorized`` method.
+    if numpy is None:
+        return None
+    return getattr(formula, 'vectorized', None) or _vectorized.get(formula)
+
+
+def evaluate(formula, histograms, vrange):
+    # Returns the scores of a list of histograms.
+    vectorized = get_vectorized(formula)
+    if vectorized is None or not histograms:
+        return [formula(scores, vrange) for scores in histograms]
+    array = numpy.array(histograms, dtype=numpy.int64)\
+        .reshape(len(histograms), len(vrange))
+    return vectorized(array, vrange).tolist()
+
+
+def rating_bin_formula(scores, vrange):
+    #reddit furmula
+    if len(scores) == 0:
+        return 0
+    downs, ups = scores
+    n = ups + downs
+    if n == 0:
+        return 0
+    z = 1.25
+    p = float(ups) / n
+
+    left = p + 1 / (2 * n) * z * z
+    right = z * sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+    under = 1 + 1 / n * z * z
+    return (left - right) / under
+
+
+@vectorizes(rating_bin_formula)
+def rating_bin_formula_vectorized(histograms, vrange):
+    # Same operations in the same order as ``rating_bin_formula``.
+    if histograms.shape[1] == 0:
+        return numpy.zeros(histograms.shape[0])
+    if histograms.shape[1] != 2:
+        raise ValueError('rating_bin_formula needs two choices.')
+    downs, ups = histograms[:, 0], histograms[:, 1]
+    n = ups + downs
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        z = 1.25
+        p = ups.astype(numpy.float64) / n
+
+        left = p + 1 / (2 * n) * z * z
+        right = z * numpy.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        under = 1 + 1 / n * z * z
+        return numpy.where(n == 0, 0.0, (left - right) / under)
+
+
+def rating_var_formula(scores, vrange):
+    if (not(isinstance(scores, Sequence) and isinstance(vrange, list)) or
+            not (sum(scores) > 0 and len(vrange) > 0)):
+        return 0
+    votes = float(sum(scores))
+    vmin = float(0)
+    avg = sum([a * b for a, b in zip(vrange, scores)]) / sum(scores)
+    fix = 0.1
+    return (votes / (votes + vmin)) * avg + (vmin / (votes + vmin)) * fix
+
+
+@vectorizes(rating_var_formula)
+def rating_var_formula_vectorized(histograms, vrange):
+    # Same operations in the same order as ``rating_var_formula``; the
+    # products are summed column by column like ``sum`` does.
+    if not isinstance(vrange, list) or len(vrange) == 0:
+        return numpy.zeros(histograms.shape[0])
+    total = histograms.sum(axis=1)
+    weighted = 0
+    for column, choice in enumerate(vrange):
+        weighted = weighted + choice * histograms[:, column]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        votes = total.astype(numpy.float64)
+        vmin = float(0)
+        avg = weighted / total
+        fix = 0.1
+        scores = ((votes / (votes + vmin)) * avg +
+                  (vmin / (votes + vmin)) * fix)
+    return numpy.where(total > 0, scores, 0.0)
@@ -0,0 +1,105 @@
+# coding=utf-8
+"""
+Fixed-width binary encoding of vote histograms: one little-endian signed
+64-bit integer per choice. ``LazyHistogram`` keeps the encoded bytes of a
+loaded row and only decodes them when the counts are read.
+"""
+from __future__ import unicode_literals
+
+import struct
+import sys
+from array import array
+
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+WIDTH = 8
+
+
+def _get_typecode():
+    # Array type code of 64-bit integers, ``None`` if there is none.
+    for typecode in ('q', 'l'):
+        try:
+            if array(typecode).itemsize == WIDTH:
+                return typecode
+        except ValueError:
+            pass
+    return None
+
+
+TYPECODE = _get_typecode()
+
+
+def pack(counts):
+    # Returns the encoded ``counts``.
+    if isinstance(counts, LazyHistogram):
+        return counts.data
+    return struct.pack(str('<%dq') % len(counts), *counts)
+
+
+def unpack(data):
+    # Returns the counts encoded in ``data`` as an ``array``, or a list if
+    # the platform has no 64-bit array type.
+    if TYPECODE is None:
+        return list(struct.unpack(str('<%dq') % (len(data) // WIDTH), data))
+    counts = array(str(TYPECODE))
+    if hasattr(counts, 'frombytes'):
+        counts.frombytes(data)
+    else:
+        counts.fromstring(data)
+    if sys.byteorder != 'little':
+        counts.byteswap()
+    return counts
+
+
+class LazyHistogram(Sequence):
+    """
+    Read-only sequence of vote counts, decoded from ``data`` on first
+    access. Its length and the encoded value are available without
+    decoding; changes build a new list, e.g.
+    ``[a + b for a, b in zip(histogram, delta)]``.
+    """
+    __slots__ = ('data', '_counts')
+
+    def __init__(self, data):
+        self.data = bytes(data)
+        self._counts = None
+
+    @property
+    def counts(self):
+        if self._counts is None:
+            self._counts = unpack(self.data)
+        return self._counts
+
+    def __len__(self):
+        return len(self.data) // WIDTH
+
+    def __getitem__(self, index):
+        return self.counts[index]
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyHistogram):
+            return self.data == other.data
+        if isinstance(other, Sequence):
+            return list(self.counts) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (self.__class__, (self.data,))
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self.counts))
+
+    def tolist(self):
+        return list(self.counts)
@@ -0,0 +1,110 @@
+# coding=utf-8
+"""
+SQL for the indexes of the ``Vote`` table, shared by the migration that
+creates them, ``xratings.models.create_vote_indexes`` and
+``benchmarks/vote_indexes.py``; it does not import Django.
+
+``vendor`` is a Django database vendor: 'postgresql', 'sqlite', 'mysql', ...
+"""
+from __future__ import unicode_literals
+
+TABLE = 'xratings_vote'
+
+# Backends with partial (``WHERE``) and expression indexes.
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+# Columns of ``Vote.Meta.unique_together`` before the partial indexes.
+OLD_UNIQUE_COLUMNS = ['content_type_id', 'object_id', 'key', 'user_id',
+                      'ip_address', 'cookie']
+
+
+def quote(vendor, name):
+    if vendor == 'mysql':
+        return '`%s`' % (name,)
+    return '"%s"' % (name,)
+
+
+def get_dedupe_sql(vendor):
+    """
+    Deletes all but the latest of duplicate votes, which the old unique
+    constraint let through because NULLs never compare equal. The aggregates
+    of the affected objects need ``xratings_rebuild`` afterwards.
+    """
+    if vendor not in PARTIAL_INDEX_VENDORS:
+        return []
+    key = quote(vendor, 'key')
+    return [
+        'DELETE FROM %(table)s WHERE user_id IS NOT NULL AND id NOT IN ('
+        'SELECT MAX(id) FROM %(table)s WHERE user_id IS NOT NULL '
+        'GROUP BY content_type_id, object_id, %(key)s, user_id, '
+        'COALESCE(cookie, \'\'))'
+        % {'table': TABLE, 'key': key},
+        'DELETE FROM %(table)s WHERE user_id IS NULL AND id NOT IN ('
+        'SELECT MAX(id) FROM %(table)s WHERE user_id IS NULL '
+        'GROUP BY content_type_id, object_id, %(key)s, ip_address, '
+        'COALESCE(cookie, \'\'))'
+        % {'table': TABLE, 'key': key},
+    ]
+
+
+def get_create_sql(vendor, include=False):
+    """
+    Returns the statements creating the vote indexes:
+
+    * one vote per user, cookie, object and field for authenticated votes;
+      serves ``get_rating_for_user``, ``add`` and the vote prefetch,
+    * one vote per IP address, cookie, object and field for anonymous votes;
+      serves the same lookups for anonymous voters,
+    * (object, field, IP address, date) for ``DatabaseLimiter``,
+    * (object, field, score) for the GROUP BY queries of vote
+      deletion and ``xratings_rebuild``.
+
+    The first two are partial indexes where the backend has them; ``include``
+    adds the score as a covering column (PostgreSQL >= 11).
+    """
+    names = {'table': TABLE, 'key': quote(vendor, 'key'),
+             'include': ' INCLUDE (score)' if include else ''}
+    statements = []
+    if vendor in PARTIAL_INDEX_VENDORS:
+        statements += [
+            'CREATE UNIQUE INDEX xratings_vote_user_uniq ON %(table)s '
+            '(content_type_id, object_id, %(key)s, user_id, '
+            'COALESCE(cookie, \'\'))%(include)s '
+            'WHERE user_id IS NOT NULL' % names,
+            'CREATE UNIQUE INDEX xratings_vote_anonymous_uniq ON %(table)s '
+            '(content_type_id, object_id, %(key)s, ip_address, '
+            'COALESCE(cookie, \'\'))%(include)s '
+            'WHERE user_id IS NULL' % names,
+        ]
+    statements += [
+        'CREATE INDEX xratings_vote_ip_limit ON %(table)s '
+        '(content_type_id, object_id, %(key)s, ip_address, date_changed)'
+        % names,
+        'CREATE INDEX xratings_vote_histogram ON %(table)s '
+        '(content_type_id, object_id, %(key)s, score)' % names,
+    ]
+    return statements
+
+
+def get_index_names(vendor):
+    # Names of the indexes of ``get_create_sql``, in the same order.
+    names = ['xratings_vote_ip_limit', 'xratings_vote_histogram']
+    if vendor in PARTIAL_INDEX_VENDORS:
+        names = ['xratings_vote_user_uniq',
+                 'xratings_vote_anonymous_uniq'] + names
+    return names
+
+
+def get_old_unique_sql(vendor):
+    # The unique constraint of migration 0001 as an index, for tables built
+    # from the models on backends without partial indexes.
+    return 'CREATE UNIQUE INDEX xratings_vote_old_uniq ON %s (%s)' % (
+        TABLE, ', '.join(quote(vendor, column)
+                         for column in OLD_UNIQUE_COLUMNS))
+
+
+def get_drop_sql(vendor):
+    names = get_index_names(vendor)
+    if vendor == 'mysql':
+        return ['DROP INDEX %s ON %s' % (name, TABLE) for name in names]
+    return ['DROP INDEX %s' % (name,) for name in names]
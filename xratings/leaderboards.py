@@ -0,0 +1,139 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from django.db.models import Q
+
+from xratings.default_settings import RATINGS_LEADERBOARDS
+from xratings.models import LeaderboardEntry
+from xratings.signals import rating_changed
+from xratings.utils import get_label, get_rating_fields
+
+PERIODS = ('score', 'day', 'week', 'month')
+
+Page = namedtuple('Page', ('objects', 'next_cursor'))
+
+
+def get_sizes(field):
+    # Returns ``{period: size}`` of the materialized leaderboards of
+    # ``field``, see RATINGS_LEADERBOARDS.
+    return RATINGS_LEADERBOARDS.get(get_label(field.model, field), {})
+
+
+def encode_cursor(cursor):
+    # ``(score, pk)`` to a string for URLs.
+    return '%r:%d' % cursor
+
+
+def decode_cursor(value):
+    # Raises ``ValueError`` for malformed cursors.
+    score, pk = value.rsplit(':', 1)
+    return float(score), int(pk)
+
+
+class Leaderboard(object):
+    """
+    Objects of ``model`` ordered by a score of their rating field
+    ``field_name``, highest first: ``period`` is 'score', 'day', 'week' or
+    'month'. Pages start after a cursor, the ``(score, pk)`` of the last
+    object seen, instead of an OFFSET, so deep pages cost as much as the
+    first one.
+
+    Without ``queryset`` the first pages are read from the materialized
+    leaderboard if RATINGS_LEADERBOARDS has one for the field and period.
+    """
+
+    def __init__(self, model, field_name, period='score', queryset=None):
+        if period not in PERIODS:
+            raise ValueError('Unknown period `%s`.' % (period,))
+        fields = [field for field in getattr(model, '_xratings', [])
+                  if field.name == field_name]
+        if not fields:
+            raise LookupError('`%s` has no rating field `%s`.' %
+                              (get_label(model), field_name))
+        self.model = model
+        self.field = fields[0]
+        self.period = period
+        self.column = getattr(self.field.spec, period)
+        self.materialized = (queryset is None and
+                             period in get_sizes(self.field))
+        if queryset is None:
+            queryset = model._default_manager.all()
+        self.queryset = queryset.order_by('-%s' % (self.column,), '-pk')
+
+    def get_page(self, cursor=None, size=20):
+        # Returns a ``Page`` of at most ``size`` objects; its ``next_cursor``
+        # is ``None`` on the last page.
+        objects = []
+        if self.materialized:
+            objects = self.get_materialized(cursor, size)
+            if objects:
+                cursor = self.get_cursor(objects[-1])
+        if len(objects) < size:
+            # The materialized leaderboard is the exact top; the rest
+            # follows in the rated model's table.
+            queryset = self.seek(self.queryset, cursor, self.column, 'pk')
+            objects += list(queryset[:size - len(objects)])
+        next_cursor = None
+        if len(objects) == size:
+            next_cursor = self.get_cursor(objects[-1])
+        return Page(objects, next_cursor)
+
+    def get_materialized(self, cursor, size):
+        entries = LeaderboardEntry.objects.filter(
+            content_type=self.field.spec.content_type_id,
+            key=self.field.key, period=self.period)\
+            .order_by('-score', '-object_id')
+        rows = list(self.seek(entries, cursor, 'score', 'object_id')
+                    .values_list('object_id', flat=True)[:size])
+        # Entries of deleted objects are skipped.
+        found = self.model._default_manager.in_bulk(rows)
+        return [found[pk] for pk in rows if pk in found]
+
+    def get_cursor(self, obj):
+        return getattr(obj, self.column), obj.pk
+
+    def seek(self, queryset, cursor, score_name, pk_name):
+        if cursor is None:
+            return queryset
+        score, pk = cursor
+        return queryset.filter(Q(**{'%s__lt' % (score_name,): score}) |
+                               Q(**{score_name: score,
+                                    '%s__lt' % (pk_name,): pk}))
+
+
+def refresh(model, field, period=None):
+    # Rebuilds the materialized leaderboards of ``field`` (or only the one
+    # of ``period``) from the rated model's table.
+    for name, size in get_sizes(field).items():
+        if period is not None and name != period:
+            continue
+        column = getattr(field.spec, name)
+        rows = model._default_manager.order_by('-%s' % (column,), '-pk')\
+            .values_list('pk', column)[:size]
+        LeaderboardEntry.objects.replace(field.spec.content_type_id,
+                                         field.key, name, rows)
+
+
+def refresh_all():
+    for model, field in get_rating_fields():
+        if get_sizes(field):
+            refresh(model, field)
+
+
+def update_leaderboards(sender, manager, diff, **kwargs):
+    # Receiver of ``rating_changed``.
+    spec = manager.spec
+    for period, size in get_sizes(manager.field).items():
+        score = getattr(manager.instance, getattr(spec, period))
+        count = LeaderboardEntry.objects.update_entry(
+            spec.content_type_id, spec.key, period, manager.instance.pk,
+            score, size)
+        if count is not None and count < size // 2:
+            # Shrunk too much by objects falling out.
+            refresh(manager.field.model, manager.field, period)
+
+
+if RATINGS_LEADERBOARDS:
+    rating_changed.connect(update_leaderboards)
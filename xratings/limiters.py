@@ -0,0 +1,165 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from importlib import import_module
+
+from django.core.cache import get_cache
+from django.utils.timezone import now
+
+from xratings.default_settings import (RATINGS_VOTES_PER_IP,
+                                       RATINGS_VOTES_PER_IP_TIMEDELTA,
+                                       RATINGS_VOTES_PER_IP_LIMITER,
+                                       RATINGS_VOTES_PER_IP_CACHE)
+from xratings.models import Vote
+
+
+def total_seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+class BaseLimiter(object):
+    """
+    Limits the number of new votes an IP address can cast on an object's
+    rating field within a period (RATINGS_VOTES_PER_IP and
+    RATINGS_VOTES_PER_IP_TIMEDELTA by default).
+
+    Limiters other than ``DatabaseLimiter`` count hits rather than stored
+    votes: a vote rejected or failing in ``RatingManager.add`` is released,
+    but one rolled back by an enclosing transaction, or deleted later,
+    still counts until its window ends.
+    """
+
+    def __init__(self, limit=None, period=None):
+        self.limit = RATINGS_VOTES_PER_IP if limit is None else limit
+        self.period = total_seconds(period or RATINGS_VOTES_PER_IP_TIMEDELTA)
+
+    def allow(self, manager, ip_address):
+        # Called after a new vote from ``ip_address`` was stored through
+        # ``manager``; returns whether it is within the limit.
+        if self.limit <= 0:
+            return True
+        return self.hit(manager, ip_address)
+
+    def release(self, manager, ip_address):
+        # Takes back the hit of a vote ``allow`` counted but that was not
+        # stored after all.
+        if self.limit > 0:
+            self.unhit(manager, ip_address)
+
+    def hit(self, manager, ip_address):
+        raise NotImplementedError
+
+    def unhit(self, manager, ip_address):
+        pass
+
+    def get_key(self, manager, ip_address):
+        return 'xratings:ip:%s:%s:%s:%s' % (manager.spec.content_type_id,
+                                            manager.instance.pk,
+                                            manager.spec.key, ip_address)
+
+
+class DatabaseLimiter(BaseLimiter):
+    # Counts the votes in the ``Vote`` table; votes not stored after all are
+    # not counted, nothing to release.
+
+    def hit(self, manager, ip_address):
+        num_votes = Vote.objects.filter(
+            content_type=manager.spec.content_type_id,
+            object_id=manager.instance.pk,
+            key=manager.spec.key,
+            ip_address=ip_address,
+            date_changed__gte=now() - timedelta(seconds=self.period)
+        ).count()
+        return num_votes <= self.limit
+
+
+class CacheLimiter(BaseLimiter):
+    """
+    Sliding window counter in Django's cache framework: the counts of the
+    current and the previous fixed window are kept, the previous one weighted
+    by how much of it still overlaps the sliding window. Costs one ``add``,
+    one ``incr`` and one ``get`` per new vote.
+    """
+
+    def __init__(self, limit=None, period=None, cache=None):
+        super(CacheLimiter, self).__init__(limit, period)
+        self.cache = get_cache(cache or RATINGS_VOTES_PER_IP_CACHE)
+
+    def hit(self, manager, ip_address):
+        key = self.get_key(manager, ip_address)
+        position = time.time() / self.period
+        window = int(position)
+        current_key = '%s:%d' % (key, window)
+        # Expire after the window stops being the previous one.
+        timeout = int(self.period * 2) + 1
+        self.cache.add(current_key, 0, timeout)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Evicted between ``add`` and ``incr``.
+            self.cache.set(current_key, 1, timeout)
+            current = 1
+        previous = self.cache.get('%s:%d' % (key, window - 1)) or 0
+        weight = 1 - (position - window)
+        return previous * weight + current <= self.limit
+
+    def unhit(self, manager, ip_address):
+        window = int(time.time() / self.period)
+        try:
+            self.cache.decr('%s:%d' % (self.get_key(manager, ip_address),
+                                       window))
+        except ValueError:
+            # Expired or evicted.
+            pass
+
+
+class LocMemLimiter(BaseLimiter):
+    """
+    Sliding window log kept in process memory, for single process setups.
+    At most ``max_entries`` (IP address, object, field) combinations are
+    remembered, the least recently used are dropped first.
+    """
+
+    def __init__(self, limit=None, period=None, max_entries=10000):
+        super(LocMemLimiter, self).__init__(limit, period)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, manager, ip_address):
+        key = self.get_key(manager, ip_address)
+        stamp = time.time()
+        with self.lock:
+            hits = self.entries.pop(key, None)
+            if hits is None:
+                hits = deque(maxlen=self.limit + 1)
+            while hits and hits[0] <= stamp - self.period:
+                hits.popleft()
+            hits.append(stamp)
+            self.entries[key] = hits
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return len(hits) <= self.limit
+
+    def unhit(self, manager, ip_address):
+        key = self.get_key(manager, ip_address)
+        with self.lock:
+            hits = self.entries.get(key)
+            if hits:
+                hits.pop()
+
+
+_limiter = None
+
+
+def get_limiter():
+    # Returns the instance of RATINGS_VOTES_PER_IP_LIMITER.
+    global _limiter
+    if _limiter is None:
+        module, name = RATINGS_VOTES_PER_IP_LIMITER.rsplit('.', 1)
+        _limiter = getattr(import_module(module), name)()
+    return _limiter
@@ -0,0 +1,16 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from xratings.buffers import get_buffer
+
+
+class Command(BaseCommand):
+    help = ('Applies the vote deltas pending in RATINGS_BUFFER. Only useful '
+            'with a buffer shared between processes, such as '
+            'xratings.buffers.CacheBuffer.')
+
+    def handle(self, *args, **options):
+        updated = get_buffer().flush()
+        self.stdout.write('%d objects updated.' % (updated,))
@@ -0,0 +1,38 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from xratings.shards import fold, fold_all
+from xratings.utils import get_label, get_rating_field
+
+
+class Command(BaseCommand):
+    args = '[<app_label.ModelName> <field_name>]'
+    help = ('Collapses the counter shards of rating fields with `shards` '
+            'and writes their scores to the rated models. Folds every such '
+            'field if none is given.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=None,
+                    help='Number of objects per transaction. Defaults to '
+                         'RATINGS_BATCH_SIZE.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if not args:
+            results = fold_all(batch_size)
+        elif len(args) == 2:
+            try:
+                model, field = get_rating_field(*args)
+            except (ValueError, LookupError) as e:
+                raise CommandError(e)
+            results = {get_label(model, field): fold(model, field,
+                                                     batch_size)}
+        else:
+            raise CommandError('Usage: %s' % (self.args,))
+        for label, folded in sorted(results.items()):
+            self.stdout.write('%s: %d objects folded.' % (label, folded))
@@ -0,0 +1,58 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from xratings.models import VoteCount
+from xratings.utils import get_rating_field
+
+
+class Command(BaseCommand):
+    args = '<app_label.ModelName> <field_name>'
+    help = ('Copies the vote histograms of a rating field from its '
+            '`<field>_scores` column into `VoteCount` rows, for switching '
+            'the field to `storage=\'table\'`.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=1000,
+                    help='Number of rows per INSERT. Defaults to 1000.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: %s' % (self.args,))
+        try:
+            model, field = get_rating_field(*args)
+        except (ValueError, LookupError) as e:
+            raise CommandError(e)
+
+        batch_size = options['batch_size']
+        content_type = ContentType.objects.get_for_model(model)
+        rows = model._default_manager.order_by('pk')\
+            .values_list('pk', '%s_scores' % (field.name,))
+
+        created = 0
+        with transaction.atomic(using=VoteCount.objects.db):
+            VoteCount.objects.filter(content_type=content_type,
+                                     key=field.key).delete()
+            batch = []
+            for pk, raw in rows.iterator():
+                scores = field.to_histogram(raw)
+                for choice, count in zip(field.range, scores):
+                    if count:
+                        batch.append(VoteCount(content_type=content_type,
+                                               object_id=pk, key=field.key,
+                                               choice=choice, count=count))
+                if len(batch) >= batch_size:
+                    VoteCount.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            VoteCount.objects.bulk_create(batch)
+            created += len(batch)
+
+        self.stdout.write('Created %d VoteCount rows for %s.%s.' %
+                          (created, args[0], field.name))
@@ -0,0 +1,102 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from functools import reduce
+from multiprocessing import Pool
+from operator import or_
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+
+from xratings.default_settings import RATINGS_RANKING
+from xratings.leaderboards import get_sizes, refresh
+from xratings.models import Checkpoint
+from xratings.ranking import load
+from xratings.rebuild import rebuild, get_shards, get_checkpoint_name
+from xratings.utils import get_rating_field, get_rating_fields, get_label
+
+
+def rebuild_shard(task):
+    model_label, field_name, start, end, batch_size = task
+    model, field = get_rating_field(model_label, field_name)
+    return rebuild(model, field, start, end, batch_size,
+                   checkpoint=get_checkpoint_name(model, field, start))
+
+
+def close_connections():
+    # Forked workers must not share the parent's database connections.
+    for connection in connections.all():
+        connection.close()
+
+
+class Command(BaseCommand):
+    args = '[<app_label.ModelName.field_name> ...]'
+    help = ('Recalculates vote histograms and scores of rating fields from '
+            'the Vote table, all rating fields if none are given, then '
+            'rebuilds their materialized leaderboards and rankings. '
+            'Interrupted rebuilds continue where they stopped.')
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=1,
+                    help='Number of worker processes. Defaults to 1.'),
+        make_option('--shard-size', dest='shard_size', type='int',
+                    default=100000,
+                    help='Number of primary keys per unit of work. '
+                         'Defaults to 100000.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=None,
+                    help='Number of objects per transaction. Defaults to '
+                         'RATINGS_BATCH_SIZE.'),
+        make_option('--restart', dest='restart', action='store_true',
+                    default=False,
+                    help='Ignore the progress of a previous rebuild.'),
+    )
+
+    def handle(self, *args, **options):
+        fields = []
+        for label in args:
+            try:
+                model_label, field_name = label.rsplit('.', 1)
+                fields.append(get_rating_field(model_label, field_name))
+            except (ValueError, LookupError) as e:
+                raise CommandError(e)
+        if not args:
+            fields = list(get_rating_fields())
+
+        if not fields:
+            return
+
+        checkpoints = []
+        tasks = []
+        for model, field in fields:
+            prefix = get_checkpoint_name(model, field, '')
+            checkpoints.append(Q(name__startswith=prefix))
+            for start, end in get_shards(model, field,
+                                         options['shard_size']):
+                tasks.append((get_label(model), field.name, start, end,
+                              options['batch_size']))
+        checkpoints = Checkpoint.objects.filter(reduce(or_, checkpoints))
+        if options['restart']:
+            checkpoints.delete()
+
+        close_connections()
+        if options['workers'] > 1:
+            pool = Pool(options['workers'], initializer=close_connections)
+            try:
+                rebuilt = sum(pool.imap_unordered(rebuild_shard, tasks))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            rebuilt = sum(map(rebuild_shard, tasks))
+
+        # Every shard is finished, the next run starts from scratch.
+        checkpoints.delete()
+        # The objects were rebuilt without sending ``rating_changed``.
+        for model, field in fields:
+            if get_sizes(field):
+                refresh(model, field)
+            if RATINGS_RANKING:
+                load(model, field)
+        self.stdout.write('Rebuilt %d objects.' % (rebuilt,))
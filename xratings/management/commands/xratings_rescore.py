@@ -0,0 +1,73 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from xratings.default_settings import RATINGS_RANKING
+from xratings.leaderboards import get_sizes, refresh
+from xratings.priors import (BayesianFormula, recompute_prior, rescore,
+                             rescore_all)
+from xratings.ranking import load
+from xratings.utils import get_label, get_rating_field, get_rating_fields
+
+
+class Command(BaseCommand):
+    args = '[<app_label.ModelName> <field_name>]'
+    help = ('Recalculates the scores of rating fields with a '
+            'BayesianFormula whose mean vote drifted beyond the threshold. '
+            'Checks every such field if none is given. The materialized '
+            'leaderboards and rankings of rescored fields are rebuilt.')
+    option_list = BaseCommand.option_list + (
+        make_option('--force', action='store_true', dest='force',
+                    default=False,
+                    help='Rescore even if the mean did not drift.'),
+        make_option('--recompute-prior', action='store_true',
+                    dest='recompute_prior', default=False,
+                    help='Recount the votes of the prior from the Vote '
+                         'table first.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=None,
+                    help='Number of objects per UPDATE. Defaults to '
+                         'RATINGS_BATCH_SIZE.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) == 2:
+            try:
+                fields = [get_rating_field(*args)]
+            except (ValueError, LookupError) as e:
+                raise CommandError(e)
+            if not isinstance(fields[0][1].rating_calculator,
+                              BayesianFormula):
+                raise CommandError('%s does not use a BayesianFormula.' %
+                                   (get_label(*fields[0]),))
+        elif not args:
+            fields = [(model, field) for model, field in get_rating_fields()
+                      if isinstance(field.rating_calculator,
+                                    BayesianFormula)]
+        else:
+            raise CommandError('Usage: %s' % (self.args,))
+
+        if options['recompute_prior']:
+            for model, field in fields:
+                recompute_prior(model, field)
+        if len(args) == 2:
+            model, field = fields[0]
+            results = {(model, field): rescore(model, field,
+                                               options['force'],
+                                               options['batch_size'])}
+        else:
+            results = rescore_all(options['force'], options['batch_size'])
+        for (model, field), rescored in sorted(
+                results.items(), key=lambda item: get_label(*item[0])):
+            self.stdout.write('%s: %d objects rescored.' %
+                              (get_label(model, field), rescored))
+            if not rescored:
+                continue
+            # Rescored without sending ``rating_changed``.
+            if get_sizes(field):
+                refresh(model, field)
+            if RATINGS_RANKING:
+                load(model, field)
@@ -0,0 +1,27 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from xratings.default_settings import RATINGS_RANKING
+from xratings.leaderboards import refresh_all
+from xratings.periods import rollup
+from xratings.ranking import load_all
+
+
+class Command(BaseCommand):
+    help = ('Recalculates the day, week and month scores of objects whose '
+            'windows changed since the previous run and removes expired '
+            'hourly vote counts, then rebuilds the materialized leaderboards '
+            'and the rankings. '
+            'Needs RATINGS_ROLLING_PERIODS.')
+
+    def handle(self, *args, **options):
+        for label, updated in sorted(rollup().items()):
+            self.stdout.write('%s: %d objects recalculated.' %
+                              (label, updated))
+        # Votes leaving a window move objects without sending
+        # ``rating_changed``.
+        refresh_all()
+        if RATINGS_RANKING:
+            load_all()
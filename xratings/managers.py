@@ -2,38 +2,458 @@
 from __future__ import unicode_literals
 
 import itertools
-from operator import itemgetter
+from collections import defaultdict, namedtuple
+from functools import reduce
+from operator import or_
 
-from django.db.models import Manager
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Manager, F, Q, Sum, get_model
+from django.utils.timezone import now
 from django.db.models.query import QuerySet
 from django.contrib.contenttypes.models import ContentType
 
+from xratings.default_settings import (RATINGS_ATOMIC_RETRIES,
+                                       RATINGS_BATCH_SIZE,
+                                       RATINGS_PERIOD_LENGTHS,
+                                       RATINGS_ROLLING_PERIODS)
+from xratings.exceptions import (InvalidRating, CannotChangeVote,
+                                 CannotDeleteVote, AuthRequired)
+from xratings.metrics import get_collector
+from xratings.utils import truncate_hour
+
+
+# A validated vote of ``VoteManager.add_in_bulk``; ``voter`` is
+# ``(user_id, ip_address, cookie)`` with ``None`` for the parts that do not
+# identify the voter.
+BulkVote = namedtuple('BulkVote', ('index', 'obj', 'field', 'content_type',
+                                   'score', 'voter', 'ip_address', 'cookie'))
+
+# Returned by ``VoteManager._record_optimistic`` when the vote changed.
+_CONFLICT = object()
+
 
 class VoteQuerySet(QuerySet):
     def delete(self, *args, **kwargs):
         # Handles updating the related `votes` and `score` fields attached to
-        # the model.
-        qs = self.distinct()\
-            .values_list('score', 'content_type', 'object_id')\
-            .order_by('content_type', 'object_id')
+        # the model: RATINGS_BATCH_SIZE votes per transaction are locked,
+        # counted per object and score and deleted together with the
+        # aggregate update, so concurrent votes are not lost and memory use
+        # does not grow with the number of votes. Returns ``(deleted,
+        # {model label: deleted})`` like ``QuerySet.delete`` of Django 1.9.
+        deleted, per_model = 0, {}
+        label = '%s.%s' % (self.model._meta.app_label,
+                           self.model._meta.object_name)
+        fields = {}
+        cutoff = now() - max(RATINGS_PERIOD_LENGTHS.values())
+        votes = self.order_by('pk')
+        last = None
+        while True:
+            with transaction.atomic(using=self.db):
+                batch = votes if last is None else votes.filter(pk__gt=last)
+                rows = list(batch.select_for_update().values_list(
+                    'pk', 'content_type', 'object_id', 'key', 'score',
+                    'date_changed')[:RATINGS_BATCH_SIZE])
+                if not rows:
+                    break
+                last = rows[-1][0]
 
-        qs = list(qs)
-        for ct_type, votes_a in itertools.groupby(qs, itemgetter(1)):
-            model = ContentType.objects.get(pk=ct_type).model_class()
-            for ct_pk, votes_b in itertools.groupby(votes_a, itemgetter(2)):
-                obj = model.objects.get(pk=ct_pk)
-                for vote in votes_b:
-                    for field in getattr(obj, '_xratings', []):
-                        getattr(obj, field.name)._rm_vote(score=vote[0])
-                obj.save()
+                deltas, hourly = defaultdict(dict), []
+                for pk, ct_pk, object_id, key, score, date_changed in rows:
+                    if ct_pk not in fields:
+                        model = ContentType.objects.get_for_id(ct_pk)\
+                            .model_class()
+                        fields[ct_pk] = dict(
+                            (field.key, field)
+                            for field in getattr(model, '_xratings', []))
+                    field = fields[ct_pk].get(key)
+                    if field is None or score not in field.spec.index:
+                        continue
+                    delta = deltas[field].setdefault(
+                        object_id, [0] * len(field.range))
+                    delta[field.spec.index[score]] -= 1
+                    if date_changed >= cutoff:
+                        hourly.append((ct_pk, object_id, key, score,
+                                       date_changed, -1))
 
-        retval = super(VoteQuerySet, self).delete(*args, **kwargs)
-        return retval
+                if RATINGS_ROLLING_PERIODS:
+                    count_hourly(hourly)
+                for field, field_deltas in deltas.items():
+                    field.apply_deltas(field_deltas)
+                QuerySet.delete(self.model.objects.using(self.db)
+                                .filter(pk__in=[row[0] for row in rows]),
+                                *args, **kwargs)
+            # The locked rows are the deleted ones; counted here since
+            # ``QuerySet.delete`` returns nothing before Django 1.9.
+            deleted += len(rows)
+            if len(rows) < RATINGS_BATCH_SIZE:
+                break
+        if deleted:
+            per_model[label] = deleted
+        return deleted, per_model
 
 
 class VoteManager(Manager):
-    def get_query_set(self):
-        return VoteQuerySet(self.model)
+    def get_queryset(self):
+        return VoteQuerySet(self.model, using=self._db)
+    get_query_set = get_queryset
+
+    def get_for_voter_in_bulk(self, objects, user, ip_address=None,
+                              cookies=None, field_names=None):
+        """
+        Returns the scores a user, or an anonymous IP address, gave to
+        ``objects`` (of any content types) in one query, as a dict mapping
+        ``RatingManager.get_vote_key`` to the score or ``None``.
+
+        All rating fields are included unless ``field_names`` is given.
+        Cookies are matched as in ``RatingManager.get_rating_for_user``.
+        """
+        managers = []
+        for obj in objects:
+            for field in getattr(obj, '_xratings', []):
+                if field_names is None or field.name in field_names:
+                    managers.append(getattr(obj, field.name))
+        if not managers:
+            return {}
+
+        is_user = user is not None and user.is_authenticated()
+        if not (is_user or ip_address):
+            raise ValueError('``user`` or ``ip_address`` must be present.')
+
+        votes = {}
+        object_ids = defaultdict(set)
+        cookie_keys = set()
+        for manager in managers:
+            votes[manager.get_vote_key(user, ip_address, cookies)] = None
+            object_ids[manager.spec.content_type_id].add(manager.instance.pk)
+            if manager.field.allow_anonymous and manager.field.use_cookies:
+                cookie_keys.add(manager.field.key)
+
+        condition = reduce(or_, [Q(content_type=ct_pk, object_id__in=ids)
+                                 for ct_pk, ids in object_ids.items()])
+        rows = self.filter(condition, key__in=set(manager.field.key
+                                                  for manager in managers))
+        if is_user:
+            rows = rows.filter(user=user)
+        else:
+            rows = rows.filter(user__isnull=True, ip_address=ip_address)
+        for ct_pk, object_id, key, user_id, ip, cookie, score in \
+                rows.values_list('content_type', 'object_id', 'key', 'user',
+                                 'ip_address', 'cookie', 'score'):
+            vote_key = (ct_pk, object_id, key, user_id,
+                        None if user_id else ip,
+                        cookie if key in cookie_keys else None)
+            if vote_key in votes:
+                votes[vote_key] = score
+        return votes
+
+    def record(self, lookup, score, defaults=None, update=True):
+        """
+        Stores the vote matching ``lookup`` (field names to values, ``None``
+        meaning NULL) and returns its previous ``(score, date_changed)``,
+        ``None`` if there was no vote.
+
+        A missing vote is created with ``score`` and ``defaults``; an existing
+        one gets ``score``, or is deleted if ``score`` is ``None``, unless
+        ``update`` is false. The aggregates are not touched.
+
+        Writes are optimistic: the vote is read without locks and only
+        changed if it still has the score read, a concurrent insert of the
+        same vote fails on the unique indexes. Both conflicts are retried
+        RATINGS_ATOMIC_RETRIES times before the vote is locked.
+        """
+        defaults = defaults or {}
+        collector = get_collector()
+        connection = connections[self.db]
+        for attempt in range(RATINGS_ATOMIC_RETRIES):
+            try:
+                with transaction.atomic(using=self.db):
+                    if connection.vendor == 'postgresql':
+                        # The lookup is part of the write.
+                        with collector.phase('write', self.db):
+                            return self._record_postgresql(
+                                connection, lookup, score, defaults, update)
+                    old = self._record_optimistic(
+                        lookup, score, defaults, update, collector)
+                if old is not _CONFLICT:
+                    return old
+            except IntegrityError:
+                # The same vote was inserted concurrently.
+                pass
+            collector.incr('conflicts.vote')
+
+        # Too much contention for optimistic writes, wait for the vote.
+        with transaction.atomic(using=self.db):
+            with collector.phase('lookup', self.db):
+                rows = list(self.select_for_update().filter(**lookup)
+                            .values_list('pk', 'score', 'date_changed')[:1])
+            if rows:
+                pk, old_score, old_date = rows[0]
+                if update:
+                    with collector.phase('write', self.db):
+                        self._change(pk, old_score, score)
+                return old_score, old_date
+            if score is not None:
+                with collector.phase('write', self.db):
+                    self.create(score=score, **dict(lookup, **defaults))
+            return None
+
+    def _record_optimistic(self, lookup, score, defaults, update, collector):
+        # One attempt of ``record``, returns ``_CONFLICT`` if the vote was
+        # changed since it was read.
+        with collector.phase('lookup', self.db):
+            rows = list(self.filter(**lookup)
+                        .values_list('pk', 'score', 'date_changed')[:1])
+        if not rows:
+            if score is not None:
+                with collector.phase('write', self.db):
+                    self.create(score=score, **dict(lookup, **defaults))
+            return None
+        pk, old_score, old_date = rows[0]
+        if update:
+            with collector.phase('write', self.db):
+                if not self._change(pk, old_score, score):
+                    return _CONFLICT
+        return old_score, old_date
+
+    def _change(self, pk, old_score, score):
+        # Sets the score of vote ``pk``, or deletes it if ``score`` is
+        # ``None``, provided it still is ``old_score``; returns the number of
+        # votes changed.
+        if score is not None:
+            return self.filter(pk=pk, score=old_score)\
+                .update(score=score, date_changed=now())
+        # Not ``VoteQuerySet.delete``, which would update the aggregates;
+        # the number of deleted rows is needed, too.
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE %s = %%s AND %s = %%s' % (
+            qn(opts.db_table), qn(opts.pk.column),
+            qn(opts.get_field('score').column)), [pk, old_score])
+        return cursor.rowcount
+
+    def bulk_add(self, votes, chunk_size=1000):
+        """
+        Adds votes from an iterable of ``(object, field_name, score, user,
+        ip_address, cookie)`` tuples, ``chunk_size`` at a time, see
+        ``add_in_bulk``.
+
+        Returns a dict with the number of created, changed and deleted votes
+        and of rejected ones.
+        """
+        votes = iter(votes)
+        totals = dict.fromkeys(('created', 'changed', 'deleted', 'rejected'),
+                               0)
+        while True:
+            chunk = list(itertools.islice(votes, chunk_size))
+            if not chunk:
+                break
+            for result in self.add_in_bulk(chunk):
+                if isinstance(result, Exception):
+                    result = 'rejected'
+                totals[result] += 1
+        return totals
+
+    def add_in_bulk(self, votes):
+        """
+        Adds a list of ``(object, field_name, score, user, ip_address,
+        cookie)`` votes in one transaction, in order, as if
+        ``RatingManager.add`` was called for each of them; the IP limit is
+        not checked.
+
+        Existing votes are fetched and locked with one query per content type
+        and field, new ones are inserted with ``bulk_create`` and every object
+        gets a single aggregate update. The batch is retried
+        RATINGS_ATOMIC_RETRIES times if a new vote was inserted concurrently.
+        Returns one result per vote: 'created', 'changed', 'deleted' or the
+        exception rejecting it.
+        """
+        results = [None] * len(votes)
+        pending = []
+        for index, (obj, field_name, score, user, ip_address, cookie) \
+                in enumerate(votes):
+            fields = [field for field in getattr(obj, '_xratings', [])
+                      if field.name == field_name]
+            if not fields:
+                results[index] = InvalidRating('%s is not a rating field' %
+                                               (field_name,))
+                continue
+            field = fields[0]
+            try:
+                score, user = field.clean_vote(score, user)
+            except (InvalidRating, CannotDeleteVote, AuthRequired) as e:
+                results[index] = e
+                continue
+            if not (field.allow_anonymous and field.use_cookies):
+                cookie = None
+            user_id = user.pk if user else None
+            voter = (user_id, None if user_id else ip_address, cookie or None)
+            content_type = ContentType.objects.get_for_model(obj)
+            pending.append(BulkVote(index, obj, field, content_type,
+                                    score or None, voter, ip_address, cookie))
+
+        collector = get_collector()
+        attempts = max(RATINGS_ATOMIC_RETRIES, 1)
+        for attempt in range(attempts):
+            try:
+                with transaction.atomic(using=self.db):
+                    return self._add_pending(pending, list(results))
+            except IntegrityError:
+                # One of the new votes was inserted concurrently.
+                if attempt == attempts - 1:
+                    raise
+                collector.incr('conflicts.vote')
+
+    def _add_pending(self, pending, results):
+        # Stores the validated votes of ``add_in_bulk``; the existing votes
+        # are locked until the aggregates are updated, so a concurrent vote
+        # can not change them in between.
+
+        # Current scores of the voters, keyed by content type, field key,
+        # object and voter.
+        groups = defaultdict(list)
+        for item in pending:
+            groups[(item.content_type, item.field.key)].append(item)
+        existing = {}
+        for (content_type, key), items in groups.items():
+            user_ids = set(item.voter[0] for item in items if item.voter[0])
+            ips = set(item.voter[1] for item in items if not item.voter[0])
+            condition = Q()
+            if user_ids:
+                condition |= Q(user__in=user_ids)
+            if ips:
+                condition |= Q(user__isnull=True, ip_address__in=ips)
+            field = items[0].field
+            use_cookies = field.allow_anonymous and field.use_cookies
+            rows = self.select_for_update().filter(
+                condition, content_type=content_type, key=key,
+                object_id__in=set(item.obj.pk for item in items))
+            for pk, object_id, user_id, ip_address, cookie, score, date in \
+                    rows.values_list('pk', 'object_id', 'user', 'ip_address',
+                                     'cookie', 'score', 'date_changed'):
+                voter = (user_id, None if user_id else ip_address,
+                         cookie if use_cookies else None)
+                existing[(content_type.pk, key, object_id, voter)] = \
+                    (pk, score, date)
+
+        # Replay the votes: [pk, stored score, final score, last item,
+        # date of the stored score].
+        state = {}
+        for item in pending:
+            index, field, score = item.index, item.field, item.score
+            vote_key = (item.content_type.pk, field.key, item.obj.pk,
+                        item.voter)
+            if vote_key not in state:
+                pk, stored, date = existing.get(vote_key,
+                                                (None, None, None))
+                state[vote_key] = [pk, stored, stored, item, date]
+            entry = state[vote_key]
+            current = entry[2]
+            if current is None and score is None:
+                results[index] = CannotDeleteVote(
+                    'attempt to find and delete your vote for %s is failed'
+                    % (field.name,))
+                continue
+            if current is not None and not field.can_change_vote:
+                results[index] = CannotChangeVote()
+                continue
+            entry[2], entry[3] = score, item
+            if current is None:
+                results[index] = 'created'
+            else:
+                results[index] = 'deleted' if score is None else 'changed'
+
+        new_votes, deleted, changed = [], [], defaultdict(list)
+        deltas, hourly, stamp = {}, [], now()
+        for pk, stored, final, item, date in state.values():
+            if stored == final:
+                continue
+            obj, field, content_type = item.obj, item.field, item.content_type
+            if pk is None:
+                new_votes.append(self.model(
+                    content_type=content_type, object_id=obj.pk,
+                    key=field.key, score=final, user_id=item.voter[0],
+                    ip_address=item.ip_address, cookie=item.cookie))
+            elif final is None:
+                deleted.append(pk)
+            else:
+                changed[final].append(pk)
+            manager = getattr(obj, field.name)
+            delta = deltas.setdefault((content_type.pk, obj.pk, field.key),
+                                      (manager, [0] * len(field.range)))[1]
+            for score, step, when in ((stored, -1, date), (final, 1, stamp)):
+                if score is not None:
+                    delta[field.spec.index[score]] += step
+                    hourly.append((content_type.pk, obj.pk, field.key, score,
+                                   when, step))
+
+        self.bulk_create(new_votes)
+        for score, pks in changed.items():
+            self.filter(pk__in=pks).update(score=score, date_changed=stamp)
+        if deleted:
+            # Not ``VoteQuerySet.delete``, the aggregates follow below.
+            QuerySet.delete(self.filter(pk__in=deleted))
+        if RATINGS_ROLLING_PERIODS:
+            count_hourly(hourly)
+        for manager, delta in deltas.values():
+            manager.apply_delta(delta, atomic=True)
+        return results
+
+    def _record_postgresql(self, connection, lookup, score, defaults, update):
+        # A single statement: the CTEs lock and read the current vote, then
+        # change it or insert a new one.
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        names = {'table': qn(opts.db_table), 'pk': qn(opts.pk.column)}
+        stamp = now()
+
+        def prepare(name, value):
+            field = opts.get_field(name)
+            if hasattr(value, '_get_pk_val'):
+                value = value._get_pk_val()
+            return qn(field.column), field.get_db_prep_save(value, connection)
+
+        where, params = [], []
+        for name, value in lookup.items():
+            column, value = prepare(name, value)
+            if value is None:
+                where.append('%s IS NULL' % (column,))
+            else:
+                where.append('%s = %%s' % (column,))
+                params.append(value)
+        names['where'] = ' AND '.join(where)
+        sql = ['WITH old AS (SELECT %(pk)s, score, date_changed '
+               'FROM %(table)s WHERE %(where)s LIMIT 1 FOR UPDATE)']
+
+        if update and score is None:
+            sql.append(', changed AS (DELETE FROM %(table)s '
+                       'WHERE %(pk)s IN (SELECT %(pk)s FROM old))')
+        elif update:
+            sql.append(', changed AS (UPDATE %(table)s '
+                       'SET score = %%s, date_changed = %%s '
+                       'WHERE %(pk)s IN (SELECT %(pk)s FROM old))')
+            params.extend([score, prepare('date_changed', stamp)[1]])
+
+        if score is not None:
+            values = dict(lookup, **defaults)
+            values.update(score=score, date_added=stamp, date_changed=stamp)
+            columns = []
+            for name, value in values.items():
+                column, value = prepare(name, value)
+                columns.append(column)
+                params.append(value)
+            names['columns'] = ', '.join(columns)
+            names['values'] = ', '.join(['%s'] * len(columns))
+            sql.append(', added AS (INSERT INTO %(table)s (%(columns)s) '
+                       'SELECT %(values)s WHERE NOT EXISTS '
+                       '(SELECT 1 FROM old))')
+        sql.append(' SELECT score, date_changed FROM old')
+
+        cursor = connection.cursor()
+        cursor.execute(''.join(sql) % names, params)
+        row = cursor.fetchone()
+        return tuple(row) if row else None
 
     def get_for_user_in_bulk(self, objects, user):
         objects = list(objects)
@@ -47,3 +467,177 @@ class VoteManager(Manager):
         else:
             vote_dict = {}
         return vote_dict
+
+
+def increment_or_create(manager, lookup, field_name, amount):
+    # Adds ``amount`` to ``field_name`` of the row matching ``lookup`` with a
+    # single UPDATE, creating the row if it does not exist yet.
+    queryset = manager.filter(**lookup)
+    if queryset.update(**{field_name: F(field_name) + amount}):
+        return
+    kwargs = dict(lookup, **{field_name: amount})
+    try:
+        with transaction.atomic(using=manager.db):
+            manager.create(**kwargs)
+    except IntegrityError:
+        # Created concurrently.
+        queryset.update(**{field_name: F(field_name) + amount})
+
+
+class VoteCountManager(Manager):
+    def add_delta(self, content_type, object_id, key, vrange, delta, shard=0):
+        # Adds per-choice count changes with single-row UPDATEs, creating
+        # missing rows.
+        for choice, count in zip(vrange, delta):
+            if count:
+                increment_or_create(self, {'content_type': content_type,
+                                           'object_id': object_id,
+                                           'key': key,
+                                           'choice': choice,
+                                           'shard': shard},
+                                    'count', count)
+
+    def get_histogram(self, content_type, object_id, key, vrange):
+        # Sums the shards of every choice.
+        counts = dict(self.filter(content_type=content_type,
+                                  object_id=object_id, key=key)
+                      .order_by().values_list('choice')
+                      .annotate(Sum('count')))
+        return [counts.get(choice, 0) for choice in vrange]
+
+    def fold(self, content_type, key, object_ids, vrange):
+        # Moves the counts of shards > 0 of ``object_ids`` into shard 0 and
+        # returns ``{object_id: histogram}``. Must run in a transaction; the
+        # rows read are locked, so concurrent increments are never lost.
+        index = dict((choice, i) for i, choice in enumerate(vrange))
+        histograms = dict((pk, [0] * len(vrange)) for pk in object_ids)
+        rows = self.select_for_update().filter(
+            content_type=content_type, key=key, object_id__in=object_ids)\
+            .values_list('pk', 'object_id', 'choice', 'shard', 'count')
+        moved, folded = defaultdict(int), []
+        for pk, object_id, choice, shard, count in rows:
+            if choice in index:
+                histograms[object_id][index[choice]] += count
+            if shard:
+                moved[object_id, choice] += count
+                folded.append(pk)
+        self.filter(pk__in=folded).delete()
+        for (object_id, choice), count in moved.items():
+            if count:
+                increment_or_create(self, {'content_type': content_type,
+                                           'object_id': object_id,
+                                           'key': key,
+                                           'choice': choice,
+                                           'shard': 0},
+                                    'count', count)
+        return histograms
+
+
+class HourlyVoteCountManager(Manager):
+    def add_votes(self, votes, until=None):
+        """
+        Counts votes from ``(content_type_id, object_id, key, choice, when,
+        count)`` tuples in the hour containing ``when``, ``count`` being -1
+        for removed votes, with one UPDATE (or INSERT) per hour and choice.
+        Hours older than the longest period are not counted any more.
+        """
+        since = truncate_hour((until or now()) -
+                              max(RATINGS_PERIOD_LENGTHS.values()))
+        counts = defaultdict(int)
+        for content_type_id, object_id, key, choice, when, count in votes:
+            hour = truncate_hour(when)
+            if hour >= since:
+                counts[content_type_id, object_id, key, hour, choice] += count
+        # Sorted, so concurrent transactions lock the rows in the same order.
+        for (content_type_id, object_id, key, hour, choice), count in \
+                sorted(counts.items()):
+            if count:
+                increment_or_create(self, {'content_type_id': content_type_id,
+                                           'object_id': object_id,
+                                           'key': key,
+                                           'hour': hour,
+                                           'choice': choice},
+                                    'count', count)
+
+
+def count_hourly(votes):
+    # Adds votes to the hourly counts of rolling periods, see
+    # ``HourlyVoteCountManager.add_votes``.
+    get_model('xratings', 'HourlyVoteCount').objects.add_votes(votes)
+
+
+class CheckpointManager(Manager):
+    def get_value(self, name, default=None):
+        try:
+            return self.get(name=name).value
+        except self.model.DoesNotExist:
+            return default
+
+    def set_value(self, name, value):
+        if not self.filter(name=name).update(value=value, date_changed=now()):
+            self.create(name=name, value=value)
+
+
+class LeaderboardEntryManager(Manager):
+    def update_entry(self, content_type_id, key, period, object_id, score,
+                     size):
+        """
+        Keeps the entries of a leaderboard the exact top K <= ``size``
+        objects after the score of ``object_id`` changed, ordered by
+        ``(score, object_id)`` as the pages are: it enters if it ranks above
+        the lowest entry, and leaves if it falls below it, since a better
+        object might be missing. Returns K if the object left (or did not
+        enter), ``None`` otherwise.
+        """
+        entries = self.filter(content_type=content_type_id, key=key,
+                              period=period)
+        others = entries.exclude(object_id=object_id)
+        lowest = list(others.order_by('score', 'object_id')
+                      .values_list('score', 'object_id')[:1])
+        if not lowest or (score, object_id) < lowest[0]:
+            entries.filter(object_id=object_id).delete()
+            return others.count() if lowest else 0
+        count = others.count()
+        if not entries.filter(object_id=object_id).update(score=score):
+            try:
+                with transaction.atomic(using=self.db):
+                    self.create(content_type_id=content_type_id,
+                                object_id=object_id, key=key, period=period,
+                                score=score)
+            except IntegrityError:
+                # Created concurrently.
+                entries.filter(object_id=object_id).update(score=score)
+        count += 1
+        if count > size:
+            lowest = entries.order_by('score', 'object_id')\
+                .values_list('pk', flat=True)[:count - size]
+            self.filter(pk__in=list(lowest)).delete()
+        return None
+
+    def replace(self, content_type_id, key, period, rows):
+        # Replaces the entries of a leaderboard with ``(object_id, score)``
+        # rows.
+        with transaction.atomic(using=self.db):
+            self.filter(content_type=content_type_id, key=key,
+                        period=period).delete()
+            self.bulk_create([
+                self.model(content_type_id=content_type_id, key=key,
+                           period=period, object_id=object_id, score=score)
+                for object_id, score in rows])
+
+
+class RatingPriorManager(Manager):
+    def add(self, content_type, key, votes, total):
+        # Adds to the vote count and sum of a rating field with one UPDATE.
+        queryset = self.filter(content_type=content_type, key=key)
+        changes = {'votes': F('votes') + votes, 'total': F('total') + total,
+                   'date_changed': now()}
+        if queryset.update(**changes):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(content_type=content_type, key=key, votes=votes,
+                            total=total)
+        except IntegrityError:
+            # Created concurrently.
+            queryset.update(**changes)
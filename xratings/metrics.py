@@ -0,0 +1,230 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import socket
+import threading
+import time
+from bisect import bisect_left
+from importlib import import_module
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from xratings.default_settings import (RATINGS_METRICS, RATINGS_METRICS_PREFIX,
+                                       RATINGS_METRICS_QUERIES,
+                                       RATINGS_METRICS_STATSD)
+
+
+class BaseCollector(object):
+    """
+    Receives the measurements of the vote path: ``timing`` for the seconds
+    taken by a phase ('view', 'fetch', 'add', 'lookup', 'write', 'limiter',
+    'aggregate'), ``value`` for other per-vote amounts such as the queries
+    of a phase ('<phase>.queries', with RATINGS_METRICS_QUERIES) and
+    ``incr`` for counters such as rejected votes ('rejected.<exception>').
+    """
+    enabled = True
+
+    def __init__(self, count_queries=None):
+        self.count_queries = (RATINGS_METRICS_QUERIES if count_queries is None
+                              else count_queries)
+
+    def phase(self, name, using=DEFAULT_DB_ALIAS):
+        # Context manager measuring the enclosed block as phase ``name``.
+        return Phase(self, name, using if self.count_queries else None)
+
+    def timing(self, name, seconds):
+        raise NotImplementedError
+
+    def value(self, name, value):
+        raise NotImplementedError
+
+    def incr(self, name, count=1):
+        raise NotImplementedError
+
+
+class Phase(object):
+    def __init__(self, collector, name, using=None):
+        self.collector = collector
+        self.name = name
+        self.connection = None if using is None else connections[using]
+
+    def __enter__(self):
+        if self.connection is not None:
+            # ``force_debug_cursor`` on Django >= 1.8.
+            self.attr = ('force_debug_cursor'
+                         if hasattr(self.connection, 'force_debug_cursor')
+                         else 'use_debug_cursor')
+            self.debug = getattr(self.connection, self.attr)
+            setattr(self.connection, self.attr, True)
+            self.queries = len(self.connection.queries)
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.collector.timing(self.name, time.time() - self.started)
+        if self.connection is not None:
+            setattr(self.connection, self.attr, self.debug)
+            self.collector.value('%s.queries' % (self.name,),
+                                 len(self.connection.queries) - self.queries)
+
+
+class NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_phase = NullPhase()
+
+
+class NullCollector(BaseCollector):
+    """
+    Records nothing, for production setups without metrics.
+    """
+    enabled = False
+
+    def phase(self, name, using=DEFAULT_DB_ALIAS):
+        return _null_phase
+
+    def timing(self, name, seconds):
+        pass
+
+    def value(self, name, value):
+        pass
+
+    def incr(self, name, count=1):
+        pass
+
+
+# Upper bounds of the buckets of ``HistogramCollector``: 1, 2 and 5 times
+# the powers of ten from a microsecond to 10000.
+BUCKETS = [factor * 10 ** exponent for exponent in range(-6, 5)
+           for factor in (1, 2, 5)]
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the percentile, capped by the
+        # largest value.
+        rank, seen = fraction * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if index < len(BUCKETS):
+                    return min(BUCKETS[index], self.max)
+                return self.max
+        return self.max
+
+    def get_stats(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / float(self.count) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class HistogramCollector(BaseCollector):
+    """
+    Histograms and counters in process memory; ``get_stats`` returns them,
+    e.g. for a debug view or a periodic log line.
+    """
+
+    def __init__(self, count_queries=None):
+        super(HistogramCollector, self).__init__(count_queries)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def timing(self, name, seconds):
+        self.value(name, seconds)
+
+    def value(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    def incr(self, name, count=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def get_stats(self):
+        # Returns ``{'histograms': {name: stats}, 'counters': {name: n}}``.
+        with self.lock:
+            return {'histograms': dict((name, histogram.get_stats())
+                                       for name, histogram
+                                       in self.histograms.items()),
+                    'counters': dict(self.counters)}
+
+
+class StatsdCollector(BaseCollector):
+    """
+    Sends every measurement as a UDP packet to the statsd server at
+    RATINGS_METRICS_STATSD (``host:port``), names prefixed with
+    RATINGS_METRICS_PREFIX. Timings are sent in milliseconds; other values
+    are sent as timers too, which gives their distribution.
+    """
+
+    def __init__(self, address=None, prefix=None, count_queries=None):
+        super(StatsdCollector, self).__init__(count_queries)
+        host, port = (address or RATINGS_METRICS_STATSD).rsplit(':', 1)
+        self.address = (host, int(port))
+        self.prefix = RATINGS_METRICS_PREFIX if prefix is None else prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, name, value, kind):
+        packet = '%s.%s:%s|%s' % (self.prefix, name, value, kind)
+        try:
+            self.socket.sendto(packet.encode('utf-8'), self.address)
+        except socket.error:
+            # Metrics must never fail a vote.
+            pass
+
+    def timing(self, name, seconds):
+        self.send(name, '%.3f' % (seconds * 1000,), 'ms')
+
+    def value(self, name, value):
+        self.send(name, value, 'ms')
+
+    def incr(self, name, count=1):
+        self.send(name, count, 'c')
+
+
+_collector = None
+
+
+def get_collector():
+    # Returns the instance of RATINGS_METRICS.
+    global _collector
+    if _collector is None:
+        module, name = RATINGS_METRICS.rsplit('.', 1)
+        _collector = getattr(import_module(module), name)()
+    return _collector
@@ -0,0 +1,25 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from xratings import votecache
+
+
+class VoteCacheMiddleware(object):
+    # Activates ``xratings.votecache.vote_cache`` for every request.
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with votecache.vote_cache():
+            return self.get_response(request)
+
+    def process_request(self, request):
+        votecache._local.votes = {}
+
+    def process_response(self, request, response):
+        votecache._local.votes = None
+        return response
+
+    def process_exception(self, request, exception):
+        votecache._local.votes = None
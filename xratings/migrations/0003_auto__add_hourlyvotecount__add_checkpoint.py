@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import datetime
+from collections import defaultdict
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+from django.utils.timezone import now
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'HourlyVoteCount'
+        db.create_table(u'xratings_hourlyvotecount', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('content_type', self.gf('django.db.models.fields.related.ForeignKey')(related_name='hourly_vote_counts', to=orm['contenttypes.ContentType'])),
+            ('object_id', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('key', self.gf('django.db.models.fields.CharField')(max_length=32)),
+            ('hour', self.gf('django.db.models.fields.DateTimeField')(db_index=True)),
+            ('choice', self.gf('django.db.models.fields.IntegerField')()),
+            ('count', self.gf('django.db.models.fields.IntegerField')(default=0)),
+        ))
+        db.send_create_signal(u'xratings', ['HourlyVoteCount'])
+
+        # Adding unique constraint on 'HourlyVoteCount', fields ['content_type', 'object_id', 'key', 'hour', 'choice']
+        db.create_unique(u'xratings_hourlyvotecount', ['content_type_id', 'object_id', 'key', 'hour', 'choice'])
+
+        # Adding model 'Checkpoint'
+        db.create_table(u'xratings_checkpoint', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(unique=True, max_length=100)),
+            ('value', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('date_changed', self.gf('django.db.models.fields.DateTimeField')(auto_now=True, blank=True)),
+        ))
+        db.send_create_signal(u'xratings', ['Checkpoint'])
+
+        if not db.dry_run:
+            # Counts the votes of the last 30 days, the default longest
+            # period, so the period scores can be recalculated right away.
+            since = now() - datetime.timedelta(days=30)
+            counts = defaultdict(int)
+            for row in orm['xratings.Vote'].objects.filter(date_changed__gte=since).values_list(
+                    'content_type', 'object_id', 'key', 'date_changed', 'score').iterator():
+                hour = row[3].replace(minute=0, second=0, microsecond=0)
+                counts[row[:3] + (hour, row[4])] += 1
+            orm['xratings.HourlyVoteCount'].objects.bulk_create([
+                orm['xratings.HourlyVoteCount'](content_type_id=content_type_id, object_id=object_id,
+                                                key=key, hour=hour, choice=choice, count=count)
+                for (content_type_id, object_id, key, hour, choice), count in counts.items()], batch_size=1000)
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'HourlyVoteCount', fields ['content_type', 'object_id', 'key', 'hour', 'choice']
+        db.delete_unique(u'xratings_hourlyvotecount', ['content_type_id', 'object_id', 'key', 'hour', 'choice'])
+
+        # Deleting model 'HourlyVoteCount'
+        db.delete_table(u'xratings_hourlyvotecount')
+
+        # Deleting model 'Checkpoint'
+        db.delete_table(u'xratings_checkpoint')
+
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'xratings.vote': {
+            'Meta': {'unique_together': "((u'content_type', u'object_id', u'key', u'user', u'ip_address', u'cookie'),)", 'object_name': 'Vote'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'votes'", 'to': u"orm['contenttypes.ContentType']"}),
+            'cookie': ('django.db.models.fields.CharField', [], {'max_length': '32', 'null': 'True', 'blank': 'True'}),
+            'date_added': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date_changed': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.GenericIPAddressField', [], {'max_length': '39'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'score': ('django.db.models.fields.IntegerField', [], {}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "u'votes'", 'null': 'True', 'to': u"orm['auth.User']"})
+        },
+        u'xratings.votecount': {
+            'Meta': {'unique_together': "((u'content_type', u'object_id', u'key', u'choice'),)", 'object_name': 'VoteCount'},
+            'choice': ('django.db.models.fields.IntegerField', [], {}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'vote_counts'", 'to': u"orm['contenttypes.ContentType']"}),
+            'count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        u'xratings.hourlyvotecount': {
+            'Meta': {'unique_together': "((u'content_type', u'object_id', u'key', u'hour', u'choice'),)", 'object_name': 'HourlyVoteCount'},
+            'choice': ('django.db.models.fields.IntegerField', [], {}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'hourly_vote_counts'", 'to': u"orm['contenttypes.ContentType']"}),
+            'count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'hour': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        u'xratings.checkpoint': {
+            'Meta': {'object_name': 'Checkpoint'},
+            'date_changed': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '100'}),
+            'value': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        }
+    }
+
+    complete_apps = ['xratings']
@@ -1,13 +1,22 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models, connections
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.utils.encoding import python_2_unicode_compatible
 
-from xratings.managers import VoteManager
+try:
+    from django.db.models.signals import post_migrate
+except ImportError:
+    # Django < 1.7: the South migrations create the indexes.
+    post_migrate = None
+
+from xratings import indexes
+from xratings.managers import (VoteManager, VoteCountManager,
+                               HourlyVoteCountManager, CheckpointManager,
+                               LeaderboardEntryManager, RatingPriorManager)
 
 
 @python_2_unicode_compatible
@@ -27,10 +36,10 @@ class Vote(models.Model):
 
     objects = VoteManager()
 
-    class Meta:
-        unique_together = (
-            ('content_type', 'object_id', 'key', 'user',
-             'ip_address', 'cookie'))
+    # One vote per voter is enforced by the partial unique indexes of
+    # migration 0004, see ``xratings.indexes``; backends without partial
+    # indexes keep the unique constraint of migration 0001. Tables built
+    # from the models get them from ``create_vote_indexes``.
 
     def __str__(self):
         return '%s voted %s on %s' % (
@@ -41,3 +50,158 @@ class Vote(models.Model):
         if self.user:
             return '%s (%s)' % (self.user.username, self.ip_address)
         return self.ip_address
+
+
+@python_2_unicode_compatible
+class VoteCount(models.Model):
+    # Number of votes with a given score, used by fields with
+    # ``storage='table'`` instead of the ``<field>_scores`` column.
+    content_type = models.ForeignKey(ContentType, related_name='vote_counts')
+    object_id = models.PositiveIntegerField()
+    key = models.CharField(max_length=32)
+    choice = models.IntegerField()
+    count = models.IntegerField(default=0)
+    # Fields with ``shards`` increment one of the shards 1..N; shard 0 holds
+    # the counts folded by ``xratings.shards.fold``.
+    shard = models.PositiveSmallIntegerField(default=0)
+
+    objects = VoteCountManager()
+
+    class Meta:
+        unique_together = (('content_type', 'object_id', 'key', 'choice',
+                            'shard'),)
+
+    def __str__(self):
+        return '%s votes of %s for %s.%s' % (
+            self.count, self.choice, self.content_type_id, self.object_id)
+
+
+@python_2_unicode_compatible
+class HourlyVoteCount(models.Model):
+    # Number of votes with a given score cast (or last changed) within one
+    # hour; the day, week and month scores are calculated from the counts of
+    # their window. Removed votes are subtracted from the hour they were
+    # counted in.
+    content_type = models.ForeignKey(ContentType,
+                                     related_name='hourly_vote_counts')
+    object_id = models.PositiveIntegerField()
+    key = models.CharField(max_length=32)
+    hour = models.DateTimeField(db_index=True)
+    choice = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    objects = HourlyVoteCountManager()
+
+    class Meta:
+        unique_together = (('content_type', 'object_id', 'key', 'hour',
+                            'choice'),)
+
+    def __str__(self):
+        return '%s votes of %s for %s.%s at %s' % (
+            self.count, self.choice, self.content_type_id, self.object_id,
+            self.hour)
+
+
+@python_2_unicode_compatible
+class Checkpoint(models.Model):
+    # Progress of long running jobs, so they can be resumed.
+    name = models.CharField(max_length=100, unique=True)
+    value = models.TextField(blank=True)
+    date_changed = models.DateTimeField(auto_now=True, editable=False)
+
+    objects = CheckpointManager()
+
+    def __str__(self):
+        return '%s: %s' % (self.name, self.value)
+
+
+@python_2_unicode_compatible
+class LeaderboardEntry(models.Model):
+    # Materialized top objects of a rating field by one of its scores, for
+    # the fields configured in RATINGS_LEADERBOARDS.
+    content_type = models.ForeignKey(ContentType,
+                                     related_name='leaderboard_entries')
+    object_id = models.PositiveIntegerField()
+    key = models.CharField(max_length=32)
+    period = models.CharField(max_length=5)
+    score = models.FloatField()
+
+    objects = LeaderboardEntryManager()
+
+    class Meta:
+        unique_together = (('content_type', 'key', 'period', 'object_id'),)
+        index_together = (('content_type', 'key', 'period', 'score',
+                           'object_id'),)
+
+    def __str__(self):
+        return '%s.%s: %g (%s)' % (self.content_type_id, self.object_id,
+                                   self.score, self.period)
+
+
+@python_2_unicode_compatible
+class RatingPrior(models.Model):
+    # Number and sum of the votes of all objects of a rating field, kept up
+    # to date for formulas observing vote deltas, see
+    # ``xratings.priors.BayesianFormula``.
+    content_type = models.ForeignKey(ContentType,
+                                     related_name='rating_priors')
+    key = models.CharField(max_length=32)
+    votes = models.BigIntegerField(default=0)
+    total = models.FloatField(default=0)
+    # The mean the stored scores were calculated with.
+    scored_mean = models.FloatField(blank=True, null=True)
+    date_changed = models.DateTimeField(auto_now=True)
+
+    objects = RatingPriorManager()
+
+    class Meta:
+        unique_together = (('content_type', 'key'),)
+
+    def __str__(self):
+        return '%s votes averaging %s for %s.%s' % (
+            self.votes, self.mean, self.content_type_id, self.key)
+
+    @property
+    def mean(self):
+        if not self.votes:
+            return None
+        return self.total / self.votes
+
+
+def create_vote_indexes(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Creates the indexes of ``xratings.indexes`` missing from a ``Vote`` table
+    built from the models (``migrate`` of apps without Django migrations,
+    the test runner), and the unique constraint of migration 0001 on
+    backends without partial indexes. Existing indexes are left alone.
+    """
+    app_config = kwargs.get('app_config')
+    if app_config is not None and app_config.label != 'xratings':
+        return
+    connection = connections[using]
+    vendor = connection.vendor
+    cursor = connection.cursor()
+    if indexes.TABLE not in connection.introspection.table_names(cursor):
+        return
+    constraints = connection.introspection.get_constraints(cursor,
+                                                           indexes.TABLE)
+    statements = [sql for name, sql in zip(indexes.get_index_names(vendor),
+                                           indexes.get_create_sql(vendor))
+                  if name not in constraints]
+    if vendor not in indexes.PARTIAL_INDEX_VENDORS and not any(
+            constraint['unique'] and
+            set(constraint['columns']) == set(indexes.OLD_UNIQUE_COLUMNS)
+            for constraint in constraints.values()):
+        statements.append(indexes.get_old_unique_sql(vendor))
+    for sql in statements:
+        cursor.execute(sql)
+
+
+if post_migrate is not None:
+    post_migrate.connect(create_vote_indexes,
+                         dispatch_uid='xratings.create_vote_indexes')
+
+
+# Connects the receivers maintaining the materialized leaderboards and the
+# rankings.
+from xratings import leaderboards, ranking  # noqa
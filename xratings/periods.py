@@ -0,0 +1,122 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from xratings.default_settings import (RATINGS_BATCH_SIZE,
+                                       RATINGS_PERIOD_LENGTHS)
+from xratings.formulas import evaluate
+from xratings.models import HourlyVoteCount, Checkpoint
+from xratings.utils import (get_rating_fields, get_label, truncate_hour,
+                            update_rows)
+
+
+def get_window_histograms(content_type, field, object_ids, start):
+    # Sums the hourly vote counts of ``object_ids`` since ``start`` per
+    # score with one GROUP BY query.
+    histograms = dict((pk, [0] * len(field.range)) for pk in object_ids)
+    rows = HourlyVoteCount.objects.filter(
+        content_type=content_type, key=field.key, object_id__in=object_ids,
+        hour__gte=start).order_by().values_list('object_id', 'choice')\
+        .annotate(count=Sum('count'))
+    for object_id, choice, count in rows:
+        if object_id in histograms and choice in field.spec.index:
+            histograms[object_id][field.spec.index[choice]] += count
+    return histograms
+
+
+def update_periods(model, field, object_ids, until=None):
+    """
+    Sets the period scores of ``object_ids`` to the formula of the votes
+    counted within each period, with one GROUP BY query per period and one
+    batched UPDATE.
+    """
+    until = until or now()
+    content_type = ContentType.objects.get_for_model(model)
+    columns, scores = [], []
+    for period, length in sorted(RATINGS_PERIOD_LENGTHS.items()):
+        columns.append(model._meta.get_field(
+            getattr(field.spec, period)).column)
+        histograms = get_window_histograms(
+            content_type, field, object_ids, truncate_hour(until - length))
+        scores.append(evaluate(field.rating_calculator,
+                               [histograms[pk] for pk in object_ids],
+                               field.range))
+    update_rows(model, columns, [list(row) + [pk] for pk, row
+                                 in zip(object_ids, zip(*scores))])
+
+
+def recompute_periods(model, field, since=None, until=None, batch_size=None):
+    """
+    Recalculates the period scores (``<field>_day``, ``<field>_week``, ...)
+    of ``field`` from the hourly vote counts, ``batch_size`` objects per
+    transaction.
+
+    Only objects with votes after ``since`` or votes that dropped out of a
+    window between ``since`` and ``until`` are touched. Every object is
+    recalculated if ``since`` is ``None``. Returns the number of
+    recalculated objects.
+    """
+    until = until or now()
+    batch_size = batch_size or RATINGS_BATCH_SIZE
+    if since is None:
+        object_ids = model._default_manager.order_by('pk')\
+            .values_list('pk', flat=True)
+        name = 'pk'
+    else:
+        changed = Q(hour__gte=truncate_hour(since))
+        for length in RATINGS_PERIOD_LENGTHS.values():
+            changed |= Q(hour__gte=truncate_hour(since - length),
+                         hour__lt=truncate_hour(until - length))
+        object_ids = HourlyVoteCount.objects.filter(
+            changed, content_type=ContentType.objects.get_for_model(model),
+            key=field.key).order_by('object_id')\
+            .values_list('object_id', flat=True).distinct()
+        name = 'object_id'
+
+    updated, last = 0, None
+    while True:
+        page = object_ids if last is None else \
+            object_ids.filter(**{'%s__gt' % (name,): last})
+        pks = list(page[:batch_size])
+        if not pks:
+            return updated
+        last = pks[-1]
+        with transaction.atomic(using=model._default_manager.db):
+            update_periods(model, field, pks, until)
+        updated += len(pks)
+
+
+def compact(until=None):
+    # Deletes vote counts that are outside of every period.
+    until = until or now()
+    longest = max(RATINGS_PERIOD_LENGTHS.values())
+    return HourlyVoteCount.objects\
+        .filter(hour__lt=truncate_hour(until - longest))\
+        .delete()
+
+
+def rollup(until=None):
+    """
+    Recalculates the period scores of all rating fields changed since the
+    previous run and compacts the vote counts. Returns a dict mapping
+    ``'app_label.ModelName.field_name'`` to the number of recalculated
+    objects.
+    """
+    until = until or now()
+    results = {}
+    for model, field in get_rating_fields():
+        label = get_label(model, field)
+        checkpoint = 'rollup:%s' % (label,)
+        since = Checkpoint.objects.get_value(checkpoint)
+        if since:
+            since = parse_datetime(since)
+        results[label] = recompute_periods(model, field, since or None,
+                                           until)
+        Checkpoint.objects.set_value(checkpoint, until.isoformat())
+    compact(until)
+    return results
@@ -0,0 +1,170 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from xratings.default_settings import (RATINGS_BATCH_SIZE,
+                                       RATINGS_ROLLING_PERIODS)
+from xratings.formulas import evaluate, numpy
+from xratings.models import RatingPrior, Vote
+from xratings.periods import update_periods
+from xratings.rebuild import get_histograms
+from xratings.utils import get_rating_fields, update_rows
+
+
+class BayesianFormula(object):
+    """
+    Bayesian average: ``(weight * mean + sum of votes) / (weight + number
+    of votes)``, which pulls objects with few votes towards the mean vote of
+    all objects of the field.
+
+    The vote count and sum of the field are kept in a ``RatingPrior`` row,
+    updated along with every vote. Scores are calculated with the mean the
+    stored scores were calculated with, re-read every ``ttl`` seconds;
+    ``rescore`` recalculates them once the actual mean is more than
+    ``drift`` away from it. Use one instance per field::
+
+        rating = RatingField(choices=[1, 2, 3, 4, 5],
+                             formula=BayesianFormula(weight=20))
+    """
+
+    def __init__(self, weight=10, drift=0.05, ttl=60):
+        self.weight = float(weight)
+        self.drift = drift
+        self.ttl = ttl
+        self.field = None
+        self.cached = None
+
+    def contribute_to_field(self, field):
+        if self.field is not None:
+            raise ValueError('%s instances cannot be shared by fields.' %
+                             (self.__class__.__name__,))
+        self.field = field
+
+    def get_prior(self):
+        return RatingPrior.objects.filter(
+            content_type=self.field.spec.content_type_id,
+            key=self.field.key).first()
+
+    def get_mean(self, vrange):
+        if self.cached is None or self.cached[1] < time.time():
+            prior = self.get_prior()
+            mean = None
+            if prior is not None:
+                mean = prior.scored_mean
+                if mean is None:
+                    mean = prior.mean
+            self.set_mean(mean)
+        mean = self.cached[0]
+        if mean is None:
+            # No votes yet: the middle of the range.
+            return float(sum(vrange)) / len(vrange) if vrange else 0.0
+        return mean
+
+    def set_mean(self, mean):
+        self.cached = (mean, time.time() + self.ttl)
+
+    def __call__(self, scores, vrange):
+        mean = self.get_mean(vrange)
+        votes, weighted = 0, 0
+        for choice, count in zip(vrange, scores):
+            votes = votes + count
+            weighted = weighted + choice * count
+        return (self.weight * mean + weighted) / (self.weight + votes)
+
+    def vectorized(self, histograms, vrange):
+        # Same operations in the same order as ``__call__``.
+        mean = self.get_mean(vrange)
+        votes = numpy.zeros(histograms.shape[0], dtype=numpy.int64)
+        weighted = numpy.zeros(histograms.shape[0], dtype=numpy.int64)
+        for column, choice in enumerate(vrange):
+            votes = votes + histograms[:, column]
+            weighted = weighted + choice * histograms[:, column]
+        return (self.weight * mean + weighted) / (self.weight + votes)
+
+    def observe(self, deltas):
+        # Adds histogram deltas to the field's ``RatingPrior``.
+        votes, total = 0, 0
+        for delta in deltas:
+            for choice, count in zip(self.field.range, delta):
+                votes += count
+                total += choice * count
+        if votes or total:
+            RatingPrior.objects.add(self.field.spec.content_type_id,
+                                    self.field.key, votes, total)
+
+
+def recompute_prior(model, field):
+    # Sets the vote count and sum of ``field`` from the ``Vote`` table.
+    content_type = ContentType.objects.get_for_model(model)
+    values = Vote.objects.filter(content_type=content_type, key=field.key,
+                                 score__in=field.range)\
+        .aggregate(votes=Count('pk'), total=Sum('score'))
+    with transaction.atomic(using=RatingPrior.objects.db):
+        prior, created = RatingPrior.objects.get_or_create(
+            content_type=content_type, key=field.key)
+        RatingPrior.objects.filter(pk=prior.pk).update(
+            votes=values['votes'], total=values['total'] or 0)
+
+
+def rescore(model, field, force=False, batch_size=None):
+    """
+    Recalculates the scores of ``field`` with the actual mean vote if it
+    drifted too far from the one the scores were calculated with, or if
+    ``force``, along with the period scores: from the hourly vote counts
+    with rolling periods, to the score otherwise. Returns the number of
+    rescored objects.
+
+    ``rating_changed`` is not sent for the rescored objects; the
+    ``xratings_rescore`` command rebuilds the leaderboards and rankings.
+    """
+    formula = field.rating_calculator
+    prior = formula.get_prior()
+    if prior is None or prior.mean is None:
+        return 0
+    mean = prior.mean
+    if (not force and prior.scored_mean is not None and
+            abs(mean - prior.scored_mean) <= formula.drift):
+        return 0
+    # Votes from now on are scored with the new mean, too.
+    RatingPrior.objects.filter(pk=prior.pk).update(scored_mean=mean)
+    formula.set_mean(mean)
+
+    batch_size = batch_size or RATINGS_BATCH_SIZE
+    content_type = ContentType.objects.get_for_model(model)
+    names = [field.spec.score]
+    if not RATINGS_ROLLING_PERIODS:
+        names += [field.spec.day, field.spec.week, field.spec.month]
+    columns = [model._meta.get_field(name).column for name in names]
+    queryset = model._default_manager.order_by('pk')\
+        .values_list('pk', flat=True)
+    rescored, last = 0, None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        pks = list(page[:batch_size])
+        if not pks:
+            return rescored
+        last = pks[-1]
+        histograms = get_histograms(content_type, field, pks)
+        scores = evaluate(formula, [histograms[pk] for pk in pks],
+                          field.range)
+        with transaction.atomic(using=model._default_manager.db):
+            update_rows(model, columns, [[score] * len(names) + [pk]
+                                         for pk, score in zip(pks, scores)])
+            if RATINGS_ROLLING_PERIODS:
+                update_periods(model, field, pks)
+        rescored += len(pks)
+
+
+def rescore_all(force=False, batch_size=None):
+    # Rescores every field with a ``BayesianFormula`` whose prior drifted;
+    # returns ``{(model, field): rescored}``.
+    results = {}
+    for model, field in get_rating_fields():
+        if isinstance(field.rating_calculator, BayesianFormula):
+            results[model, field] = rescore(model, field, force, batch_size)
+    return results
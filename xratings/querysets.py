@@ -0,0 +1,125 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.db.models.query import QuerySet
+
+from xratings.default_settings import RATINGS_BATCH_SIZE
+from xratings.leaderboards import PERIODS
+from xratings.utils import get_label
+
+# Attribute of the instances loaded by a ``RatingQuerySetMixin`` holding the
+# ``ResultSet`` they belong to.
+RESULT_SET_ATTR = '_xratings_result_set'
+
+
+class ResultSet(list):
+    # The instances of one evaluation of a queryset. Not pickled along with
+    # each of them.
+
+    def __reduce__(self):
+        return (ResultSet, ())
+
+
+class RatingQuerySetMixin(object):
+    """
+    Selects the rating columns a view renders; mix into the rated model's
+    queryset, or use ``RatingQuerySet.as_manager()``::
+
+        Post.objects.with_ratings('rating', periods=['week'])
+        Post.objects.without_ratings()
+
+    Deferred rating columns are loaded by the ``RatingManager`` when needed,
+    for all instances of the same result set at once.
+    """
+
+    def with_ratings(self, *names, **kwargs):
+        """
+        Loads only the rating columns of the rating fields ``names`` (all of
+        them if none are given): the scores of ``periods`` ('score', 'day',
+        'week' and 'month' by default) and, unless ``histogram=False``, the
+        histogram. The columns of other rating fields are deferred.
+        """
+        periods = kwargs.pop('periods', PERIODS)
+        histogram = kwargs.pop('histogram', True)
+        if kwargs:
+            raise TypeError('Unexpected arguments: %s.' %
+                            (', '.join(sorted(kwargs)),))
+        for period in periods:
+            if period not in PERIODS:
+                raise ValueError('Unknown period `%s`.' % (period,))
+        selected = self.get_rating_fields(names)
+        deferred = []
+        for field in self.get_rating_fields(()):
+            if field not in selected:
+                deferred.extend(field.spec.columns)
+                continue
+            deferred.extend(getattr(field.spec, period) for period in PERIODS
+                            if period not in periods)
+            if not histogram:
+                deferred.append(field.spec.scores)
+        return self.defer(*deferred) if deferred else self.all()
+
+    def without_ratings(self, *names):
+        # Defers every rating column of the rating fields ``names``, or of
+        # all of them.
+        deferred = []
+        for field in self.get_rating_fields(names):
+            deferred.extend(field.spec.columns)
+        return self.defer(*deferred) if deferred else self.all()
+
+    def get_rating_fields(self, names):
+        fields = getattr(self.model, '_xratings', [])
+        if not names:
+            return list(fields)
+        by_name = dict((field.name, field) for field in fields)
+        for name in names:
+            if name not in by_name:
+                raise LookupError('`%s` has no rating field `%s`.' %
+                                  (get_label(self.model), name))
+        return [by_name[name] for name in names]
+
+    def iterator(self):
+        names, defer = self.query.deferred_loading
+        if defer and not names:
+            # Nothing deferred, nothing to load later.
+            for obj in super(RatingQuerySetMixin, self).iterator():
+                yield obj
+            return
+        result_set = ResultSet()
+        for obj in super(RatingQuerySetMixin, self).iterator():
+            setattr(obj, RESULT_SET_ATTR, result_set)
+            result_set.append(obj)
+            yield obj
+
+
+class RatingQuerySet(RatingQuerySetMixin, QuerySet):
+    pass
+
+
+def load_deferred_columns(instance, field):
+    """
+    Loads the deferred columns of rating field ``field`` of ``instance``,
+    and of the other instances of its result set still missing them, with
+    one query per RATINGS_BATCH_SIZE instances.
+    """
+    names = [name for name in field.spec.columns
+             if name not in instance.__dict__]
+    result_set = getattr(instance, RESULT_SET_ATTR, None) or [instance]
+    pending = {}
+    for obj in result_set:
+        if obj.pk is not None and any(name not in obj.__dict__
+                                      for name in names):
+            pending[obj.pk] = obj
+    pending[instance.pk] = instance
+    pks = list(pending)
+    queryset = field.model._base_manager.using(instance._state.db)
+    for start in range(0, len(pks), RATINGS_BATCH_SIZE):
+        rows = queryset.filter(pk__in=pks[start:start + RATINGS_BATCH_SIZE])\
+            .values_list('pk', *names)
+        for row in rows:
+            obj = pending[row[0]]
+            for name, value in zip(names, row[1:]):
+                if name == field.spec.scores:
+                    value = field.to_histogram(value)
+                if name not in obj.__dict__:
+                    setattr(obj, name, value)
@@ -0,0 +1,295 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import socket
+import threading
+from bisect import bisect_left, insort
+from importlib import import_module
+
+from django.utils import six
+from django.utils.six.moves.urllib.parse import urlparse
+
+from xratings.default_settings import RATINGS_RANKING, RATINGS_RANKING_URL
+from xratings.leaderboards import PERIODS
+from xratings.signals import rating_changed
+from xratings.transactions import on_commit
+from xratings.utils import get_label, get_rating_fields
+
+
+def get_key(model, field, period='score'):
+    return 'xratings:rank:%s:%s' % (get_label(model, field), period)
+
+
+class BaseRanking(object):
+    """
+    Sorted sets of object primary keys by score, one per rating field and
+    period (see ``get_key``), kept up to date as scores change. Ranks are
+    0-based, highest score first; the order of equal scores depends on the
+    backend.
+    """
+
+    def update(self, key, member, score):
+        raise NotImplementedError
+
+    def update_many(self, items):
+        # ``items`` are ``(key, member, score)`` tuples.
+        for key, member, score in items:
+            self.update(key, member, score)
+
+    def remove(self, key, member):
+        raise NotImplementedError
+
+    def score(self, key, member):
+        # Returns ``None`` for unknown members.
+        raise NotImplementedError
+
+    def rank(self, key, member):
+        # Returns ``None`` for unknown members.
+        raise NotImplementedError
+
+    def top(self, key, count, offset=0):
+        # Returns a list of ``(member, score)``.
+        raise NotImplementedError
+
+    def replace(self, key, items):
+        # Replaces the set with ``(member, score)`` items.
+        raise NotImplementedError
+
+
+class MemoryRanking(BaseRanking):
+    """
+    Sorted lists kept with ``bisect`` in process memory, for tests and
+    single process setups: lookups are O(log n), updates O(log n) plus a
+    memory move.
+    """
+
+    def __init__(self):
+        self.sets = {}
+        self.lock = threading.Lock()
+
+    def get_set(self, key):
+        # ``(scores by member, sorted list of (-score, member))``
+        return self.sets.setdefault(key, ({}, []))
+
+    def update(self, key, member, score):
+        member = six.text_type(member)
+        with self.lock:
+            scores, order = self.get_set(key)
+            self._discard(scores, order, member)
+            scores[member] = score
+            insort(order, (-score, member))
+
+    def remove(self, key, member):
+        with self.lock:
+            scores, order = self.get_set(key)
+            self._discard(scores, order, six.text_type(member))
+
+    def _discard(self, scores, order, member):
+        if member in scores:
+            del order[bisect_left(order, (-scores.pop(member), member))]
+
+    def score(self, key, member):
+        return self.get_set(key)[0].get(six.text_type(member))
+
+    def rank(self, key, member):
+        member = six.text_type(member)
+        with self.lock:
+            scores, order = self.get_set(key)
+            if member not in scores:
+                return None
+            return bisect_left(order, (-scores[member], member))
+
+    def top(self, key, count, offset=0):
+        with self.lock:
+            order = self.get_set(key)[1][offset:offset + count]
+        return [(member, -score) for score, member in order]
+
+    def replace(self, key, items):
+        scores = dict((six.text_type(member), score)
+                      for member, score in items)
+        order = sorted((-score, member) for member, score in scores.items())
+        with self.lock:
+            self.sets[key] = (scores, order)
+
+
+class RespError(Exception):
+    pass
+
+
+class RespClient(object):
+    """
+    Minimal client of the Redis protocol (RESP): one connection per thread,
+    commands and pipelines, nothing else.
+    """
+
+    def __init__(self, host='localhost', port=6379, db=0, timeout=None):
+        self.address = (host, port)
+        self.db = db
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection(self.address, self.timeout)
+            connection = self.local.connection = (sock, sock.makefile('rb'))
+            if self.db:
+                self.execute('SELECT', self.db)
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            self.local.connection = None
+            connection[1].close()
+            connection[0].close()
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        # Sends all commands, then reads all replies; error replies are
+        # raised after reading the rest.
+        sock, reader = self.get_connection()
+        try:
+            sock.sendall(b''.join(self.pack(args) for args in commands))
+            replies = [self.read(reader) for args in commands]
+        except (socket.error, EOFError):
+            self.close()
+            raise
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def pack(self, args):
+        chunks = [('*%d\r\n' % len(args)).encode('ascii')]
+        for arg in args:
+            if isinstance(arg, float):
+                arg = repr(arg)
+            if not isinstance(arg, bytes):
+                arg = six.text_type(arg).encode('utf-8')
+            chunks.append(('$%d\r\n' % len(arg)).encode('ascii'))
+            chunks.append(arg + b'\r\n')
+        return b''.join(chunks)
+
+    def read(self, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise EOFError('Connection closed.')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            return RespError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return reader.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self.read(reader) for i in range(length)]
+        raise RespError('Unknown reply `%r`.' % (line,))
+
+
+class RedisRanking(BaseRanking):
+    """
+    Sorted sets of a Redis server, or anything speaking its protocol, at
+    RATINGS_RANKING_URL (``redis://host:port/db``).
+    """
+    chunk_size = 1000
+
+    def __init__(self, url=None):
+        url = urlparse(url or RATINGS_RANKING_URL)
+        self.client = RespClient(url.hostname or 'localhost',
+                                 url.port or 6379,
+                                 int(url.path.strip('/') or 0))
+
+    def update(self, key, member, score):
+        self.client.execute('ZADD', key, float(score), member)
+
+    def update_many(self, items):
+        self.client.pipeline([('ZADD', key, float(score), member)
+                              for key, member, score in items])
+
+    def remove(self, key, member):
+        self.client.execute('ZREM', key, member)
+
+    def score(self, key, member):
+        score = self.client.execute('ZSCORE', key, member)
+        return None if score is None else float(score)
+
+    def rank(self, key, member):
+        return self.client.execute('ZREVRANK', key, member)
+
+    def top(self, key, count, offset=0):
+        if count <= 0:
+            return []
+        reply = self.client.execute('ZREVRANGE', key, offset,
+                                    offset + count - 1, 'WITHSCORES')
+        return [(reply[i].decode('utf-8'), float(reply[i + 1]))
+                for i in range(0, len(reply), 2)]
+
+    def replace(self, key, items):
+        # Filled under a temporary key, then renamed over the old set.
+        temporary = key + ':new'
+        commands, args = [('DEL', temporary)], []
+        for member, score in items:
+            args += [float(score), member]
+            if len(args) >= 2 * self.chunk_size:
+                commands.append(('ZADD', temporary) + tuple(args))
+                args = []
+        if args:
+            commands.append(('ZADD', temporary) + tuple(args))
+        if len(commands) > 1:
+            commands.append(('RENAME', temporary, key))
+        else:
+            commands.append(('DEL', key))
+        self.client.pipeline(commands)
+
+
+def load(model, field):
+    # Fills the sorted sets of ``field`` from the rated model's table.
+    ranking = get_ranking()
+    for period in PERIODS:
+        column = getattr(field.spec, period)
+        rows = model._default_manager.order_by()\
+            .values_list('pk', column).iterator()
+        ranking.replace(get_key(model, field, period), rows)
+
+
+def load_all():
+    for model, field in get_rating_fields():
+        load(model, field)
+
+
+def update_rankings(sender, manager, diff, **kwargs):
+    # Receiver of ``rating_changed``. The sorted sets are not transactional,
+    # they are updated once the outermost transaction commits.
+    field, instance = manager.field, manager.instance
+    items = [(get_key(field.model, field, period), instance.pk,
+              getattr(instance, getattr(manager.spec, period)))
+             for period in PERIODS]
+    on_commit(lambda: get_ranking().update_many(items),
+              using=instance._state.db)
+
+
+_ranking = None
+
+
+def get_ranking():
+    # Returns the instance of RATINGS_RANKING.
+    global _ranking
+    if _ranking is None:
+        module, name = RATINGS_RANKING.rsplit('.', 1)
+        _ranking = getattr(import_module(module), name)()
+    return _ranking
+
+
+if RATINGS_RANKING:
+    rating_changed.connect(update_rankings)
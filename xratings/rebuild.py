@@ -0,0 +1,126 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import Count, Min, Max
+
+from xratings.default_settings import (RATINGS_BATCH_SIZE,
+                                       RATINGS_ROLLING_PERIODS)
+from xratings.formulas import evaluate
+from xratings.models import Vote, VoteCount, Checkpoint
+from xratings.periods import update_periods
+from xratings.utils import get_label, update_rows
+
+DONE = 'done'
+
+
+def get_histograms(content_type, field, object_ids):
+    # Counts the votes of ``object_ids`` per score with one GROUP BY query.
+    histograms = dict((pk, [0] * len(field.range)) for pk in object_ids)
+    rows = Vote.objects.filter(content_type=content_type, key=field.key,
+                               object_id__in=object_ids)\
+        .order_by().values_list('object_id', 'score')\
+        .annotate(count=Count('pk'))
+    for object_id, score, count in rows:
+        if object_id in histograms and score in field.spec.index:
+            histograms[object_id][field.spec.index[score]] += count
+    return histograms
+
+
+def write_histograms(model, field, histograms):
+    # Stores histograms and recalculated scores with batched UPDATEs. The
+    # period scores are recalculated from the hourly vote counts with rolling
+    # periods, and are the score otherwise.
+    connection = connections[model._default_manager.db]
+    names = [field.spec.score]
+    if not RATINGS_ROLLING_PERIODS:
+        names += [field.spec.day, field.spec.week, field.spec.month]
+    columns = [model._meta.get_field(name).column for name in names]
+    if field.storage == 'table':
+        content_type = ContentType.objects.get_for_model(model)
+        VoteCount.objects.filter(content_type=content_type, key=field.key,
+                                 object_id__in=list(histograms)).delete()
+        VoteCount.objects.bulk_create([
+            VoteCount(content_type=content_type, object_id=pk,
+                      key=field.key, choice=choice, count=count)
+            for pk, scores in histograms.items()
+            for choice, count in zip(field.range, scores) if count])
+    else:
+        columns.append(field.scores_field.column)
+
+    pks = list(histograms)
+    new_scores = evaluate(field.rating_calculator,
+                          [histograms[pk] for pk in pks], field.range)
+    rows = []
+    for pk, score in zip(pks, new_scores):
+        row = [score] * len(names)
+        if field.storage != 'table':
+            row.append(field.scores_field.get_db_prep_save(histograms[pk],
+                                                           connection))
+        rows.append(row + [pk])
+    update_rows(model, columns, rows)
+    if RATINGS_ROLLING_PERIODS:
+        update_periods(model, field, pks)
+
+
+def rebuild(model, field, start=None, end=None, batch_size=None,
+            checkpoint=None):
+    """
+    Recalculates ``<field>_scores`` and the scores from the ``Vote``
+    table for objects with ``start <= pk < end``, ``batch_size`` objects per
+    transaction.
+
+    If ``checkpoint`` is given the last finished primary key is stored in the
+    ``Checkpoint`` with that name, and an interrupted rebuild continues from
+    there. Returns the number of rebuilt objects.
+    """
+    batch_size = batch_size or RATINGS_BATCH_SIZE
+    content_type = ContentType.objects.get_for_model(model)
+    queryset = model._default_manager.order_by('pk')
+    if start is not None:
+        queryset = queryset.filter(pk__gte=start)
+    if end is not None:
+        queryset = queryset.filter(pk__lt=end)
+
+    last = None
+    if checkpoint:
+        last = Checkpoint.objects.get_value(checkpoint)
+        if last == DONE:
+            return 0
+        last = int(last) if last else None
+
+    rebuilt = 0
+    while True:
+        batch = queryset
+        if last is not None:
+            batch = batch.filter(pk__gt=last)
+        object_ids = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not object_ids:
+            break
+        last = object_ids[-1]
+        with transaction.atomic(using=model._default_manager.db):
+            write_histograms(model, field,
+                             get_histograms(content_type, field, object_ids))
+            if checkpoint:
+                Checkpoint.objects.set_value(checkpoint, last)
+        rebuilt += len(object_ids)
+
+    if checkpoint:
+        Checkpoint.objects.set_value(checkpoint, DONE)
+    return rebuilt
+
+
+def get_shards(model, field, shard_size):
+    # Returns ``(start, end)`` primary key ranges of ``shard_size`` ids; the
+    # boundaries only depend on ``shard_size`` so checkpoints stay valid.
+    bounds = model._default_manager.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return []
+    first = bounds['low'] // shard_size * shard_size
+    return [(start, start + shard_size)
+            for start in range(first, bounds['high'] + 1, shard_size)]
+
+
+def get_checkpoint_name(model, field, start):
+    return 'rebuild:%s:%s' % (get_label(model, field), start)
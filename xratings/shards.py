@@ -0,0 +1,56 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from xratings.default_settings import RATINGS_BATCH_SIZE
+from xratings.formulas import evaluate
+from xratings.models import VoteCount
+from xratings.utils import get_rating_fields, get_label
+
+
+def fold(model, field, batch_size=None):
+    """
+    Collapses the shard rows of objects voted on since the previous fold
+    into shard 0 and writes their scores to the ``<field>_score`` columns,
+    so ordering by them keeps working. Returns the number of objects folded.
+    """
+    batch_size = batch_size or RATINGS_BATCH_SIZE
+    content_type = ContentType.objects.get_for_model(model)
+    pending = VoteCount.objects.filter(content_type=content_type,
+                                       key=field.key, shard__gt=0)\
+        .order_by('object_id').values_list('object_id', flat=True).distinct()
+    folded, last = 0, None
+    while True:
+        page = pending if last is None else pending.filter(object_id__gt=last)
+        object_ids = list(page[:batch_size])
+        if not object_ids:
+            return folded
+        last = object_ids[-1]
+        with transaction.atomic(using=VoteCount.objects.db):
+            histograms = VoteCount.objects.fold(content_type, field.key,
+                                                object_ids, field.range)
+            rows = list(model._default_manager.filter(pk__in=object_ids)
+                        .values_list('pk', field.spec.score))
+            new_scores = evaluate(field.rating_calculator,
+                                  [histograms[pk] for pk, score in rows],
+                                  field.range)
+            for (pk, old_score), new_score in zip(rows, new_scores):
+                if new_score == old_score:
+                    continue
+                diff = new_score - (old_score or 0)
+                manager = field.get_rating_manager(pk)
+                manager._update_score(new_score, diff)
+                manager.refresh()
+                manager._record_change(diff)
+        folded += len(object_ids)
+
+
+def fold_all(batch_size=None):
+    # Folds every rating field with shards; returns ``{label: folded}``.
+    results = {}
+    for model, field in get_rating_fields():
+        if field.shards > 1:
+            results[get_label(model, field)] = fold(model, field, batch_size)
+    return results
@@ -9,3 +9,8 @@ xrating_rated = Signal(
 
 xrating_will_rate = Signal(
     providing_args=['obj', 'score', 'user'])
+
+# Sent once the scores of an object's rating field changed, with the
+# ``RatingManager`` (its instance holding the new scores) and the change of
+# ``<field>_score``.
+rating_changed = Signal(providing_args=['manager', 'diff'])
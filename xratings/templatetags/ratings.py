@@ -4,8 +4,23 @@ from __future__ import unicode_literals
 from django import template
 from django.db.models import ObjectDoesNotExist
 
+from xratings.models import Vote
+from xratings.votecache import get_vote_cache
+
 register = template.Library()
 
+# Context variable holding the votes loaded by the prefetch tags.
+VOTES_CONTEXT_VAR = '_xratings_votes'
+
+
+def get_prefetched_vote(context, field, user, ip_address=None, cookies=None):
+    # Returns ``(found, score)`` from the votes loaded by a prefetch tag.
+    votes = context.get(VOTES_CONTEXT_VAR)
+    if not votes:
+        return False, None
+    vote_key = field.get_vote_key(user, ip_address, cookies)
+    return vote_key in votes, votes.get(vote_key)
+
 
 class RatingByRequestNode(template.Node):
     def __init__(self, request, obj, context_var):
@@ -20,6 +35,12 @@ class RatingByRequestNode(template.Node):
             field = getattr(obj, self.field_name)
         except (template.VariableDoesNotExist, AttributeError):
             return ''
+        found, vote = get_prefetched_vote(context, field, request.user,
+                                          request.META['REMOTE_ADDR'],
+                                          request.COOKIES)
+        if found:
+            context[self.context_var] = vote
+            return ''
         try:
             vote = field.get_rating_for_user(request.user,
                                              request.META['REMOTE_ADDR'],
@@ -63,6 +84,10 @@ class RatingByUserNode(RatingByRequestNode):
             field = getattr(obj, self.field_name)
         except template.VariableDoesNotExist:
             return ''
+        found, vote = get_prefetched_vote(context, field, user)
+        if found:
+            context[self.context_var] = vote
+            return ''
         try:
             vote = field.get_rating_for_user(user)
             context[self.context_var] = vote
@@ -94,3 +119,75 @@ def rating_by_user(parser, token):
         raise template.TemplateSyntaxError(
             'fourth argument to `%s` tag must be `as`' % bits[0])
     return RatingByUserNode(bits[1], bits[3], bits[5])
+
+
+class PrefetchRatingsNode(template.Node):
+    def __init__(self, voter, objects, by_request):
+        self.voter = voter
+        self.objects = objects
+        self.by_request = by_request
+
+    def render(self, context):
+        try:
+            voter = template.resolve_variable(self.voter, context)
+            objects = template.resolve_variable(self.objects, context)
+        except template.VariableDoesNotExist:
+            return ''
+        votes = dict(context.get(VOTES_CONTEXT_VAR) or {})
+        try:
+            if self.by_request:
+                votes.update(Vote.objects.get_for_voter_in_bulk(
+                    objects, voter.user, voter.META['REMOTE_ADDR'],
+                    voter.COOKIES))
+            else:
+                votes.update(Vote.objects.get_for_voter_in_bulk(objects,
+                                                                voter))
+        except ValueError:
+            # Anonymous user without an IP address.
+            return ''
+        context[VOTES_CONTEXT_VAR] = votes
+        cache = get_vote_cache()
+        if cache is not None:
+            cache.update(votes)
+        return ''
+
+
+def prefetch_ratings(parser, token, by_request):
+    bits = token.contents.split()
+    if len(bits) != 4:
+        raise template.TemplateSyntaxError(
+            '`%s` tag takes exactly three arguments' % bits[0])
+    if bits[2] != 'on':
+        raise template.TemplateSyntaxError(
+            'second argument to `%s` tag must be `on`' % bits[0])
+    return PrefetchRatingsNode(bits[1], bits[3], by_request)
+
+
+@register.tag
+def prefetch_ratings_by_request(parser, token):
+    """
+    Loads the votes cast by a user or anonymous IP on a list of objects (of
+    any models, on all of their rating fields) with a single query, so
+    ``rating_by_request`` does not query the database for each of them.
+    Must be used in the same block as, or outside of, the loop.
+
+    Example usage::
+
+        {% prefetch_ratings_by_request request on object_list %}
+        {% for instance in object_list %}
+            {% rating_by_request request on instance.rating as vote %}
+        {% endfor %}
+    """
+    return prefetch_ratings(parser, token, by_request=True)
+
+
+@register.tag
+def prefetch_ratings_by_user(parser, token):
+    """
+    Same as ``prefetch_ratings_by_request`` for ``rating_by_user``.
+
+    Example usage::
+
+        {% prefetch_ratings_by_user user on object_list %}
+    """
+    return prefetch_ratings(parser, token, by_request=False)
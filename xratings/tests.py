@@ -1,34 +1,65 @@
-from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from exceptions import IPLimitReached
-from models import Vote, SimilarUser, IgnoredObject
-from ratings_test_app.models import *
+from django.db import connection, connections, transaction
+from django.db.models import Count
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from ratings_test_app.models import RatingTestModel
+from xratings import (buffers, fields, formulas, histograms, leaderboards,
+                      limiters, managers, metrics, periods, priors)
+from xratings.exceptions import CannotDeleteVote, IPLimitReached
+from xratings.fields import (RatingField, PackedHistogramField,
+                             STORAGE_TABLE)
+from xratings.leaderboards import Leaderboard
+from xratings.models import LeaderboardEntry, Vote, create_vote_indexes
+from xratings.querysets import RatingQuerySet
+from xratings.ranking import MemoryRanking, RespClient, RespError
+from xratings.signals import xrating_rated
+from xratings.utils import get_label
+from xratings.views import AddRatingView, BatchRatingView
+from xratings.votecache import vote_cache
+from datetime import timedelta
+import io
+import json
 import random
+import threading
 import unittest
 
 
-settings.RATINGS_VOTES_PER_IP = 1
-
+class RatingTestCase(TestCase):
+    def setUp(self):
+        self.old_limiter = limiters._limiter
+        limiters._limiter = limiters.DatabaseLimiter(limit=1)
+        self.old_atomic = [field.atomic
+                           for field in RatingTestModel._xratings]
+        for field in RatingTestModel._xratings:
+            field.atomic = True
+
+    def tearDown(self):
+        limiters._limiter = self.old_limiter
+        for field, atomic in zip(RatingTestModel._xratings, self.old_atomic):
+            field.atomic = atomic
 
-class RatingTestCase(unittest.TestCase):
     def testRatings(self):
         instance = RatingTestModel.objects.create()
 
         # Test adding votes
         instance.rating.add(score=1, user=None, ip_address='127.0.0.1')
         self.assertEquals(instance.rating.score, 1)
-        self.assertEquals(instance.rating.votes, 1)
+        self.assertEquals(instance.rating.get_sum_votes(), 1)
 
         # Test adding votes
         instance.rating.add(score=2, user=None, ip_address='127.0.0.2')
         self.assertEquals(instance.rating.score, 3)
-        self.assertEquals(instance.rating.votes, 2)
+        self.assertEquals(instance.rating.get_sum_votes(), 2)
 
         # Test changing of votes
         instance.rating.add(score=2, user=None, ip_address='127.0.0.1')
         self.assertEquals(instance.rating.score, 4)
-        self.assertEquals(instance.rating.votes, 2)
+        self.assertEquals(instance.rating.get_sum_votes(), 2)
 
         # Test users
         user = User.objects.create(username=str(random.randint(0, 100000000)))
@@ -36,11 +67,11 @@ class RatingTestCase(unittest.TestCase):
 
         instance.rating.add(score=2, user=user, ip_address='127.0.0.3')
         self.assertEquals(instance.rating.score, 6)
-        self.assertEquals(instance.rating.votes, 3)
+        self.assertEquals(instance.rating.get_sum_votes(), 3)
 
         instance.rating2.add(score=2, user=user, ip_address='127.0.0.3')
         self.assertEquals(instance.rating2.score, 2)
-        self.assertEquals(instance.rating2.votes, 1)
+        self.assertEquals(instance.rating2.get_sum_votes(), 1)
 
         self.assertRaises(IPLimitReached, instance.rating2.add, score=2, user=user2, ip_address='127.0.0.3')
 
@@ -50,92 +81,580 @@ class RatingTestCase(unittest.TestCase):
         instance = RatingTestModel.objects.get(pk=instance.pk)
 
         self.assertEquals(instance.rating.score, 4)
-        self.assertEquals(instance.rating.votes, 2)
+        self.assertEquals(instance.rating.get_sum_votes(), 2)
         self.assertEquals(instance.rating2.score, 0)
-        self.assertEquals(instance.rating2.votes, 0)
-
-class RecommendationsTestCase(unittest.TestCase):
-    def setUp(self):
-        self.instance = RatingTestModel.objects.create()
-        self.instance2 = RatingTestModel.objects.create()
-        self.instance3 = RatingTestModel.objects.create()
-        self.instance4 = RatingTestModel.objects.create()
-        self.instance5 = RatingTestModel.objects.create()
-
-        # Test users
-        self.user = User.objects.create(username=str(random.randint(0, 100000000)))
-        self.user2 = User.objects.create(username=str(random.randint(0, 100000000)))
-
-    def testExclusions(self):
-        Vote.objects.all().delete()
-
-        self.instance.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance2.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance3.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance4.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance5.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance.rating.add(score=1, user=self.user2, ip_address='127.0.0.2')
-
-        # we should only need to call this once
-        SimilarUser.objects.update_recommendations()
-
-        self.assertEquals(SimilarUser.objects.count(), 2)
-
-        recs = list(SimilarUser.objects.get_recommendations(self.user2, RatingTestModel))
-        self.assertEquals(len(recs), 4)
+        self.assertEquals(instance.rating2.get_sum_votes(), 0)
 
-        ct = ContentType.objects.get_for_model(RatingTestModel)
 
-        IgnoredObject.objects.create(user=self.user2, content_type=ct, object_id=self.instance2.pk)
+def count_queries(context):
+    # Savepoints and BEGIN depend on the test transaction, not on the code
+    # under test.
+    return len([query for query in context.captured_queries
+                if 'SAVEPOINT' not in query['sql'] and
+                query['sql'] != 'BEGIN'])
 
-        recs = list(SimilarUser.objects.get_recommendations(self.user2, RatingTestModel))
-        self.assertEquals(len(recs), 3)
 
-        IgnoredObject.objects.create(user=self.user2, content_type=ct, object_id=self.instance3.pk)
-        IgnoredObject.objects.create(user=self.user2, content_type=ct, object_id=self.instance4.pk)
+def get_field(name):
+    # ``_xratings`` follows the order of the class attributes, which is not
+    # the definition order on Python 2.
+    return [field for field in RatingTestModel._xratings
+            if field.name == name][0]
 
-        recs = list(SimilarUser.objects.get_recommendations(self.user2, RatingTestModel))
-        self.assertEquals(len(recs), 1)
-        self.assertEquals(recs, [self.instance5])
 
-        self.instance5.rating.add(score=1, user=self.user2, ip_address='127.0.0.2')
-        recs = list(SimilarUser.objects.get_recommendations(self.user2, RatingTestModel))
-        self.assertEquals(len(recs), 0)
-
-    def testSimilarUsers(self):
-        Vote.objects.all().delete()
-
-        self.instance.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance2.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance3.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance4.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance5.rating.add(score=1, user=self.user, ip_address='127.0.0.1')
-        self.instance.rating.add(score=1, user=self.user2, ip_address='127.0.0.2')
-        self.instance2.rating.add(score=1, user=self.user2, ip_address='127.0.0.2')
-        self.instance3.rating.add(score=1, user=self.user2, ip_address='127.0.0.2')
-
-        SimilarUser.objects.update_recommendations()
-
-        self.assertEquals(SimilarUser.objects.count(), 2)
-
-        recs = list(SimilarUser.objects.get_recommendations(self.user2, RatingTestModel))
-        self.assertEquals(len(recs), 2)
+class VoteTestMixin(object):
+    def setUp(self):
+        self.field = get_field('rating')
+        self.old_options = (self.field.atomic, self.field.can_change_vote)
+        self.field.atomic = self.field.can_change_vote = True
+        self.instance = RatingTestModel.objects.create()
+        self.user = User.objects.create(username='voter')
+        self.content_type = ContentType.objects.get_for_id(
+            ContentType.objects.get_for_model(RatingTestModel).pk)
+        # Finding, inserting or changing a vote is a single query there.
+        self.vote_queries = 1 if connection.vendor == 'postgresql' else 2
 
-        self.instance4.rating.add(score=1, user=self.user2, ip_address='127.0.0.2')
+    def tearDown(self):
+        self.field.atomic, self.field.can_change_vote = self.old_options
 
-        SimilarUser.objects.update_recommendations()
+    def vote(self, score):
+        request = RequestFactory().post('/')
+        request.user = self.user
+        return AddRatingView()(request, self.content_type.pk,
+                               self.instance.pk, self.field.name, score)
 
-        self.assertEquals(SimilarUser.objects.count(), 2)
 
-        recs = list(SimilarUser.objects.get_recommendations(self.user2, RatingTestModel))
-        self.assertEquals(len(recs), 1)
-        self.assertEquals(recs, [self.instance5])
+class VoteTestCase(VoteTestMixin, TestCase):
+    pass
 
-        self.instance5.rating.add(score=1, user=self.user2, ip_address='127.0.0.2')
 
-        SimilarUser.objects.update_recommendations()
+class TransactionVoteTestCase(VoteTestMixin, TransactionTestCase):
+    # For code running when the outermost transaction commits.
 
-        self.assertEquals(SimilarUser.objects.count(), 2)
+    def setUp(self):
+        # Flushing the database recreates the content types with new ids.
+        ContentType.objects.clear_cache()
+        for field in RatingTestModel._xratings:
+            field.spec._content_type_id = None
+        super(TransactionVoteTestCase, self).setUp()
+
+
+class VoteQueryCountTestCase(VoteTestCase):
+    def testNewVoteQueries(self):
+        # object, vote, IP limit, aggregates
+        with CaptureQueriesContext(connection) as context:
+            self.vote(self.field.range[0])
+        self.assertEqual(count_queries(context), 3 + self.vote_queries)
+
+    def testChangedVoteQueries(self):
+        self.vote(self.field.range[0])
+        # object, vote, aggregates
+        with CaptureQueriesContext(connection) as context:
+            self.vote(self.field.range[-1])
+        self.assertEqual(count_queries(context), 2 + self.vote_queries)
+
+        instance = RatingTestModel.objects.get(pk=self.instance.pk)
+        self.assertEqual(getattr(instance, self.field.name).scores,
+                         [0] * (len(self.field.range) - 1) + [1])
+
+
+class QueryBudgetTestCase(VoteTestCase):
+    # Query counts of the hot paths; a change of these is a regression
+    # unless the budget is updated on purpose.
+
+    def testAddQueries(self):
+        # vote, IP limit, aggregates
+        manager = getattr(self.instance, self.field.name)
+        with CaptureQueriesContext(connection) as context:
+            manager.add(self.field.range[0], self.user, '127.0.0.1')
+        self.assertEqual(count_queries(context), 2 + self.vote_queries)
+
+    def deleteQueries(self, objects, votes_per_object):
+        pks = [RatingTestModel.objects.create().pk for i in range(objects)]
+        Vote.objects.bulk_create([
+            Vote(content_type=self.content_type, object_id=pk,
+                 key=self.field.key, score=self.field.range[0],
+                 ip_address='10.0.%d.%d' % (i, j))
+            for i, pk in enumerate(pks) for j in range(votes_per_object)])
+        with CaptureQueriesContext(connection) as context:
+            Vote.objects.filter(object_id__in=pks).delete()
+        return count_queries(context)
+
+    def testDeleteQueries(self):
+        # locked votes, aggregates read, one aggregate UPDATE per object and
+        # DELETE
+        queries = self.deleteQueries(5, 1)
+        self.assertEqual(queries, 3 + 5)
+        # the same up to RATINGS_BATCH_SIZE votes
+        self.assertEqual(self.deleteQueries(5, 20), queries)
+
+    def testDeleteUpdatesScores(self):
+        manager = getattr(self.instance, self.field.name)
+        low, high = self.field.range[0], self.field.range[-1]
+        for i, score in enumerate([low, high, high]):
+            manager.add(score, None, '127.0.0.%d' % i)
+        deleted = Vote.objects.filter(
+            ip_address__in=['127.0.0.0', '127.0.0.1']).delete()
+        self.assertEqual(deleted, (2, {'xratings.Vote': 2}))
+        instance = RatingTestModel.objects.get(pk=self.instance.pk)
+        scores = [0] * (len(self.field.range) - 1) + [1]
+        self.assertEqual(getattr(instance, self.field.name).scores, scores)
+        self.assertEqual(getattr(instance, self.field.name).score,
+                         self.field.rating_calculator(scores,
+                                                      self.field.range))
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def testLargeListQueries(self):
+        objects = [RatingTestModel.objects.create() for i in range(300)]
+        request = RequestFactory().get('/')
+        request.user = self.user
+        template = Template(
+            '{%% load ratings %%}{%% prefetch_ratings_by_request request on '
+            'object_list %%}{%% for instance in object_list %%}'
+            '{%% rating_by_request request on instance.%s as vote %%}'
+            '{{ vote }}{%% endfor %%}' % (self.field.name,))
+        with self.assertNumQueries(1):
+            template.render(Context({'request': request,
+                                     'object_list': objects}))
+
+
+class VoteCacheTestCase(VoteTestCase):
+    def render(self, template, objects):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        return Template('{% load ratings %}' + template).render(
+            Context({'request': request, 'object_list': objects,
+                     'instance': self.instance}))
+
+    def testRepeatedLookups(self):
+        manager = getattr(self.instance, self.field.name)
+        with vote_cache():
+            with self.assertNumQueries(1):
+                manager.get_rating_for_user(self.user)
+                manager.get_rating_for_user(self.user)
+
+    def testViewFillsCache(self):
+        score = self.field.range[0]
+        with vote_cache():
+            self.vote(score)
+            with self.assertNumQueries(0):
+                self.assertEqual(getattr(self.instance, self.field.name)
+                                 .get_rating_for_user(self.user), score)
+                self.render('{%% rating_by_user request.user on '
+                            'instance.%s as vote %%}' % (self.field.name,),
+                            [])
+
+    def testTemplateTags(self):
+        objects = [RatingTestModel.objects.create() for i in range(10)]
+        template = ('{%% prefetch_ratings_by_request request on '
+                    'object_list %%}{%% for instance in object_list %%}'
+                    '{%% rating_by_request request on instance.%s as vote %%}'
+                    '{{ vote }}{%% endfor %%}' % (self.field.name,))
+        with self.assertNumQueries(1):
+            self.render(template, objects)
+        with vote_cache():
+            self.render(template, objects)
+            with self.assertNumQueries(0):
+                self.render('{% for instance in object_list %}'
+                            '{% rating_by_request request on instance.'
+                            + self.field.name + ' as vote %}{% endfor %}',
+                            objects)
+
+
+class ConcurrentVoteTestCase(TransactionTestCase):
+    # Voters changing and deleting their votes from many threads at once.
+    threads = 8
+    rounds = 25
 
-        recs = list(SimilarUser.objects.get_recommendations(self.user2, RatingTestModel))
-        self.assertEquals(len(recs), 0)
+    def setUp(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('The threads need concurrent writers.')
+        # Flushing the database recreates the content types with new ids.
+        ContentType.objects.clear_cache()
+        for field in RatingTestModel._xratings:
+            field.spec._content_type_id = None
+        # The unique indexes keeping one vote per voter.
+        create_vote_indexes(using=connection.alias)
+        self.field = get_field('rating')
+        self.old_options = (self.field.atomic, self.field.can_change_vote,
+                            self.field.allow_delete)
+        self.field.atomic = self.field.can_change_vote = True
+        self.field.allow_delete = True
+
+    def tearDown(self):
+        (self.field.atomic, self.field.can_change_vote,
+         self.field.allow_delete) = self.old_options
+
+    def testAggregatesMatchVotes(self):
+        pks = [RatingTestModel.objects.create().pk for i in range(2)]
+        users = [User.objects.create(username='voter%d' % i)
+                 for i in range(4)]
+        errors = []
+
+        def work(number):
+            rnd = random.Random(number)
+            try:
+                for i in range(self.rounds):
+                    user = rnd.choice(users)
+                    manager = self.field.get_rating_manager(rnd.choice(pks))
+                    try:
+                        manager.add(rnd.choice(self.field.range + [0]), user,
+                                    '10.0.0.%d' % (user.pk,))
+                    except CannotDeleteVote:
+                        pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections['default'].close()
+
+        workers = [threading.Thread(target=work, args=(number,))
+                   for number in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+        content_type = ContentType.objects.get_for_model(RatingTestModel)
+        for instance in RatingTestModel.objects.filter(pk__in=pks):
+            manager = getattr(instance, self.field.name)
+            votes = Vote.objects.filter(content_type=content_type,
+                                        object_id=instance.pk,
+                                        key=self.field.key)
+            self.assertEqual(manager.scores,
+                             [votes.filter(score=choice).count()
+                              for choice in self.field.range])
+            self.assertEqual(manager.score,
+                             self.field.rating_calculator(
+                                 manager.scores, self.field.range))
+        duplicates = Vote.objects.filter(content_type=content_type)\
+            .values('object_id', 'key', 'user')\
+            .annotate(n=Count('pk')).filter(n__gt=1)
+        self.assertEqual(list(duplicates), [])
+
+
+class LimiterTestCase(VoteTestCase):
+    def testRelease(self):
+        manager = getattr(self.instance, self.field.name)
+        limiter = limiters.LocMemLimiter(limit=1)
+        self.assertTrue(limiter.allow(manager, '127.0.0.1'))
+        self.assertFalse(limiter.allow(manager, '127.0.0.1'))
+        # the rejected vote, then the first one
+        limiter.release(manager, '127.0.0.1')
+        limiter.release(manager, '127.0.0.1')
+        self.assertTrue(limiter.allow(manager, '127.0.0.1'))
+
+
+class BufferTestCase(TransactionVoteTestCase):
+    def setUp(self):
+        super(BufferTestCase, self).setUp()
+        self.old_buffer = buffers._buffer
+        buffers._buffer = buffers.LocMemBuffer(size=1000)
+
+    def tearDown(self):
+        buffers._buffer.pop()
+        buffers._buffer = self.old_buffer
+        super(BufferTestCase, self).tearDown()
+
+    def testDeltasAreCoalesced(self):
+        manager = getattr(self.instance, self.field.name)
+        score = self.field.range[-1]
+        for i in range(3):
+            adds = manager.add(score, None, '127.0.0.%d' % i, commit=False)
+            self.assertTrue(adds['buffered'])
+        self.assertEqual(Vote.objects.count(), 3)
+        instance = RatingTestModel.objects.get(pk=self.instance.pk)
+        self.assertFalse(any(getattr(instance, self.field.name).scores or []))
+
+        # one read and one UPDATE for the object
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(buffers._buffer.flush(), 1)
+        self.assertEqual(count_queries(context), 2)
+        instance = RatingTestModel.objects.get(pk=self.instance.pk)
+        self.assertEqual(getattr(instance, self.field.name).scores,
+                         [0] * (len(self.field.range) - 1) + [3])
+
+    def testRolledBackVotesAreNotBuffered(self):
+        manager = getattr(self.instance, self.field.name)
+        try:
+            with transaction.atomic():
+                manager.add(self.field.range[-1], None, '127.0.0.1',
+                            commit=False)
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            manager.add(self.field.range[-1], None, '127.0.0.2',
+                        commit=False)
+            self.assertEqual(buffers._buffer.count, 0)
+        self.assertEqual(buffers._buffer.count, 1)
+        self.assertEqual(Vote.objects.count(), 1)
+
+
+class MetricsTestCase(VoteTestCase):
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        self.old_collector = metrics._collector
+        metrics._collector = metrics.HistogramCollector(count_queries=True)
+
+    def tearDown(self):
+        metrics._collector = self.old_collector
+        super(MetricsTestCase, self).tearDown()
+
+    def testPhases(self):
+        rated = []
+
+        def receiver(sender, obj, score, user, **kwargs):
+            rated.append((obj, score, user))
+        xrating_rated.connect(receiver, sender=RatingTestModel)
+        try:
+            self.vote(self.field.range[0])
+            self.vote(-1)
+        finally:
+            xrating_rated.disconnect(receiver, sender=RatingTestModel)
+        self.assertEqual(rated, [(self.instance, self.field.range[0],
+                                  self.user)])
+
+        stats = metrics._collector.get_stats()
+        for name in ('view', 'fetch', 'add', 'write', 'limiter', 'aggregate'):
+            self.assertTrue(name in stats['histograms'], name)
+        self.assertEqual(stats['histograms']['view']['count'], 2)
+        self.assertEqual(stats['histograms']['limiter.queries']['max'], 1)
+        self.assertEqual(stats['counters'], {'rejected.InvalidRating': 1})
+
+    def testHistogram(self):
+        histogram = metrics.Histogram()
+        for value in range(1, 101):
+            histogram.add(value / 1000.0)
+        stats = histogram.get_stats()
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['p50'], 0.05)
+        self.assertEqual(stats['p99'], 0.1)
+
+
+class PackedHistogramTestCase(unittest.TestCase):
+    def testLazyDecoding(self):
+        counts = [3, 0, 2 ** 40, 1, 7]
+        histogram = histograms.LazyHistogram(histograms.pack(counts))
+        self.assertEqual(len(histogram), 5)
+        self.assertEqual(histogram._counts, None)
+        self.assertEqual(histogram, counts)
+        self.assertEqual(list(histogram), counts)
+        self.assertEqual(histograms.pack(histogram), histogram.data)
+
+    def testField(self):
+        field = PackedHistogramField(length=3)
+        self.assertEqual(field.get_default(), [0, 0, 0])
+        value = field.get_db_prep_value([1, 2, 3], connection)
+        loaded = field.from_db_value(value, None, connection, {})
+        self.assertTrue(isinstance(loaded, histograms.LazyHistogram))
+        self.assertEqual(loaded, [1, 2, 3])
+
+    def testFormulas(self):
+        vrange = [1, 2, 3, 4, 5]
+        scores = [4, 0, 1, 9, 2]
+        histogram = histograms.LazyHistogram(histograms.pack(scores))
+        bayesian = priors.BayesianFormula()
+        bayesian.set_mean(3.0)
+        for formula in (formulas.rating_var_formula, bayesian):
+            self.assertEqual(formula(histogram, vrange),
+                             formula(scores, vrange))
+        self.assertEqual(formulas.rating_bin_formula(
+            histograms.LazyHistogram(histograms.pack([3, 5])), [1, 2]),
+            formulas.rating_bin_formula([3, 5], [1, 2]))
+
+
+class ShardedFieldTestCase(unittest.TestCase):
+    def testStorage(self):
+        self.assertEqual(RatingField(shards=4).storage, STORAGE_TABLE)
+        self.assertRaises(ValueError, RatingField, shards=4, storage='json')
+
+
+class BatchVoteTestCase(VoteTestCase):
+    def post(self, items):
+        request = RequestFactory().post('/', json.dumps(items),
+                                        content_type='application/json')
+        request.user = self.user
+        return json.loads(BatchRatingView()(request).content.decode())
+
+    def testBatch(self):
+        objects = [RatingTestModel.objects.create() for i in range(3)]
+        label = '%s.%s' % (RatingTestModel._meta.app_label,
+                           RatingTestModel._meta.object_name)
+        items = [{'content_type': label, 'object_id': obj.pk,
+                  'field': self.field.name, 'score': self.field.range[0]}
+                 for obj in objects]
+        items.append({'content_type': self.content_type.pk,
+                      'object_id': 0, 'field': self.field.name,
+                      'score': self.field.range[0]})
+        items.append({'content_type': self.content_type.pk,
+                      'object_id': objects[0].pk, 'field': self.field.name,
+                      'score': -1})
+        self.assertEqual([result.get('error', result['status'])
+                          for result in self.post(items)],
+                         ['created'] * 3 + ['ObjectDoesNotExist',
+                                            'InvalidRating'])
+        self.assertEqual(Vote.objects.filter(user=self.user).count(), 3)
+
+
+class RollingPeriodsTestCase(VoteTestCase):
+    def setUp(self):
+        super(RollingPeriodsTestCase, self).setUp()
+        self.old_rolling = fields.RATINGS_ROLLING_PERIODS
+        fields.RATINGS_ROLLING_PERIODS = True
+        managers.RATINGS_ROLLING_PERIODS = True
+
+    def tearDown(self):
+        fields.RATINGS_ROLLING_PERIODS = self.old_rolling
+        managers.RATINGS_ROLLING_PERIODS = self.old_rolling
+        super(RollingPeriodsTestCase, self).tearDown()
+
+    def testPeriodScores(self):
+        manager = getattr(self.instance, self.field.name)
+        low, high = self.field.range[0], self.field.range[-1]
+        manager.add(low, None, '127.0.0.1')
+        manager.add(high, None, '127.0.0.2')
+        manager.add(high, None, '127.0.0.1')
+        Vote.objects.filter(ip_address='127.0.0.2').delete()
+        start = periods.truncate_hour(now())
+        self.assertEqual(
+            periods.get_window_histograms(self.content_type, self.field,
+                                          [self.instance.pk], start),
+            {self.instance.pk: [0] * (len(self.field.range) - 1) + [1]})
+
+        periods.recompute_periods(RatingTestModel, self.field)
+        instance = RatingTestModel.objects.get(pk=self.instance.pk)
+        self.assertEqual(getattr(instance, self.field.spec.day),
+                         getattr(instance, self.field.spec.score))
+
+        # Two days later the vote is only in the week and month windows.
+        periods.recompute_periods(RatingTestModel, self.field,
+                                  until=now() + timedelta(days=2))
+        instance = RatingTestModel.objects.get(pk=self.instance.pk)
+        empty = self.field.rating_calculator([0] * len(self.field.range),
+                                             self.field.range)
+        self.assertEqual(getattr(instance, self.field.spec.day), empty)
+        self.assertEqual(getattr(instance, self.field.spec.week),
+                         getattr(instance, self.field.spec.score))
+
+
+class LeaderboardTestCase(VoteTestCase):
+    def testPages(self):
+        column = self.field.spec.score
+        for score in [3, 1, 2, 2, 5, 0, 2]:
+            RatingTestModel.objects.create(**{column: score})
+        expected = list(RatingTestModel.objects.order_by('-' + column, '-pk'))
+        leaderboard = Leaderboard(RatingTestModel, self.field.name)
+        objects, cursor = [], None
+        while True:
+            page = leaderboard.get_page(cursor, size=3)
+            objects += page.objects
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(objects, expected)
+
+    def testTiedScores(self):
+        column = self.field.spec.score
+        old_leaderboards = leaderboards.RATINGS_LEADERBOARDS
+        leaderboards.RATINGS_LEADERBOARDS = {
+            get_label(RatingTestModel, self.field): {'score': 2}}
+        try:
+            for score in [1, 1, 3]:
+                obj = RatingTestModel.objects.create(**{column: score})
+            leaderboards.refresh(RatingTestModel, self.field)
+            # Tied with the lowest entry, but ranks above it by pk.
+            RatingTestModel.objects.filter(pk=obj.pk).update(**{column: 1})
+            LeaderboardEntry.objects.update_entry(
+                self.field.spec.content_type_id, self.field.key, 'score',
+                obj.pk, 1, 2)
+            expected = list(RatingTestModel.objects
+                            .order_by('-' + column, '-pk'))
+            leaderboard = Leaderboard(RatingTestModel, self.field.name)
+            objects, cursor = [], None
+            while True:
+                page = leaderboard.get_page(cursor, size=2)
+                objects += page.objects
+                cursor = page.next_cursor
+                if cursor is None:
+                    break
+            self.assertEqual(objects, expected)
+        finally:
+            leaderboards.RATINGS_LEADERBOARDS = old_leaderboards
+
+
+class RatingQuerySetTestCase(VoteTestCase):
+    def testWithRatings(self):
+        spec, other = self.field.spec, get_field('rating2').spec
+        obj = RatingQuerySet(RatingTestModel)\
+            .with_ratings(self.field.name, periods=['week'], histogram=False)\
+            .get(pk=self.instance.pk)
+        loaded = [name for name in spec.columns + other.columns
+                  if name in obj.__dict__]
+        self.assertEqual(loaded, [spec.week])
+
+    def testDeferredColumnsLoadedTogether(self):
+        for i in range(5):
+            RatingTestModel.objects.create()
+        objects = list(RatingQuerySet(RatingTestModel).without_ratings())
+        with self.assertNumQueries(1):
+            for obj in objects:
+                manager = getattr(obj, self.field.name)
+                self.assertEqual(manager.score, 0)
+                self.assertEqual(list(manager.scores),
+                                 [0] * len(self.field.range))
+
+
+class RankingTestCase(unittest.TestCase):
+    def testMemoryRanking(self):
+        ranking = MemoryRanking()
+        for member, score in [(1, 3.0), (2, 5.0), (3, 1.0), (4, 4.0)]:
+            ranking.update('key', member, score)
+        ranking.update('key', 3, 6.0)
+        ranking.remove('key', 4)
+        self.assertEqual(ranking.top('key', 2), [('3', 6.0), ('2', 5.0)])
+        self.assertEqual(ranking.rank('key', 1), 2)
+        self.assertEqual(ranking.score('key', 2), 5.0)
+        self.assertEqual(ranking.rank('key', 4), None)
+
+    def testResp(self):
+        client = RespClient()
+        self.assertEqual(client.pack(('ZADD', 'key', 1.5, 7)),
+                         b'*4\r\n$4\r\nZADD\r\n$3\r\nkey\r\n$3\r\n1.5\r\n'
+                         b'$1\r\n7\r\n')
+        reader = io.BytesIO(b'*2\r\n$1\r\n7\r\n:3\r\n$-1\r\n-ERR no\r\n')
+        self.assertEqual(client.read(reader), [b'7', 3])
+        self.assertEqual(client.read(reader), None)
+        self.assertTrue(isinstance(client.read(reader), RespError))
+
+
+@unittest.skipIf(formulas.numpy is None, 'NumPy is not installed')
+class VectorizedFormulaTestCase(unittest.TestCase):
+    def assertExact(self, formula, vrange, histograms):
+        self.assertEqual(formulas.evaluate(formula, histograms, vrange),
+                         [formula(scores, vrange) for scores in histograms])
+
+    def testBinFormula(self):
+        rnd = random.Random(0)
+        histograms = [[0, 0], [1, 0], [0, 1]] + [
+            [rnd.randint(0, 10 ** rnd.randint(0, 7)) for i in range(2)]
+            for j in range(10000)]
+        self.assertExact(formulas.rating_bin_formula, [1, 2], histograms)
+
+    def testVarFormula(self):
+        rnd = random.Random(0)
+        vrange = [1, 2, 3, 4, 5]
+        histograms = [[0] * 5] + [
+            [rnd.randint(0, 10 ** rnd.randint(0, 7)) for i in range(5)]
+            for j in range(10000)]
+        self.assertExact(formulas.rating_var_formula, vrange, histograms)
+
+    def testBayesianFormula(self):
+        rnd = random.Random(0)
+        vrange = [1, 2, 3, 4, 5]
+        formula = priors.BayesianFormula(weight=20)
+        formula.set_mean(3.7)
+        histograms = [[0] * 5] + [
+            [rnd.randint(0, 10 ** rnd.randint(0, 7)) for i in range(5)]
+            for j in range(10000)]
+        self.assertExact(formula, vrange, histograms)
+        self.assertEqual(formula([0] * 5, vrange), 3.7)
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""
+``on_commit`` for Django versions without ``transaction.on_commit`` (< 1.9):
+the commit, rollback and savepoint rollback of a connection are wrapped on
+first use to run or drop the callbacks registered in its transaction.
+"""
+from __future__ import unicode_literals
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+# Attribute of a connection holding ``(savepoint ids, callback)`` pairs.
+HOOKS_ATTR = '_xratings_commit_hooks'
+
+
+def on_commit(func, using=None):
+    """
+    Calls ``func`` once the outermost transaction of ``using`` commits, or
+    right away outside of transactions. It is not called if the transaction,
+    or a savepoint it was registered in, is rolled back.
+    """
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(func, using=using)
+        return
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if not connection.in_atomic_block:
+        func()
+        return
+    get_hooks(connection).append((set(connection.savepoint_ids), func))
+
+
+def get_hooks(connection):
+    hooks = connection.__dict__.get(HOOKS_ATTR)
+    if hooks is None:
+        hooks = connection.__dict__[HOOKS_ATTR] = []
+        install(connection, hooks)
+    return hooks
+
+
+def install(connection, hooks):
+    # Wraps the methods of ``connection`` (the instance, not the class).
+    commit, rollback = connection.commit, connection.rollback
+    savepoint_rollback = connection.savepoint_rollback
+    set_autocommit, close = connection.set_autocommit, connection.close
+    state = {'committed': False}
+
+    def run_hooks():
+        state['committed'] = False
+        while hooks:
+            sids, func = hooks.pop(0)
+            func()
+
+    def commit_and_run():
+        commit()
+        if not hooks:
+            return
+        if connection.features.autocommits_when_autocommit_is_off:
+            # ``atomic`` turns autocommit back on without
+            # ``set_autocommit``; the database already is in autocommit.
+            autocommit = connection.autocommit
+            connection.autocommit = True
+            try:
+                run_hooks()
+            finally:
+                connection.autocommit = autocommit
+        else:
+            state['committed'] = True
+
+    def set_autocommit_and_run(autocommit):
+        set_autocommit(autocommit)
+        if autocommit and state['committed']:
+            run_hooks()
+
+    def rollback_and_drop():
+        del hooks[:]
+        state['committed'] = False
+        rollback()
+
+    def savepoint_rollback_and_drop(sid):
+        hooks[:] = [(sids, func) for sids, func in hooks if sid not in sids]
+        savepoint_rollback(sid)
+
+    def close_and_drop():
+        del hooks[:]
+        state['committed'] = False
+        close()
+
+    connection.commit = commit_and_run
+    connection.set_autocommit = set_autocommit_and_run
+    connection.rollback = rollback_and_drop
+    connection.savepoint_rollback = savepoint_rollback_and_drop
+    connection.close = close_and_drop
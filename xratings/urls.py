@@ -3,9 +3,10 @@ from __future__ import unicode_literals
 
 from django.conf.urls import patterns, url
 
-from xratings.views import AddRatingView
+from xratings.views import AddRatingView, BatchRatingView
 
 urlpatterns = patterns('',
     url(r'xrating/add/$', AddRatingView.as_view(), name='rating_add'),
+    url(r'xrating/batch/$', BatchRatingView(), name='rating_batch'),
 )
 
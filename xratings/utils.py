@@ -0,0 +1,55 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+from django.db import connections
+from django.db.models import get_model, get_models
+
+
+def get_rating_field(model_label, field_name):
+    # Returns ``(model, field)`` for ``'app_label.ModelName'`` and the name of
+    # one of its rating fields.
+    try:
+        app_label, model_name = model_label.split('.')
+    except ValueError:
+        raise ValueError('`%s` is not in the `app_label.ModelName` format.' %
+                         (model_label,))
+    model = get_model(app_label, model_name)
+    if model is None:
+        raise LookupError('Unknown model `%s`.' % (model_label,))
+    for field in getattr(model, '_xratings', []):
+        if field.name == field_name:
+            return model, field
+    raise LookupError('`%s` has no rating field `%s`.' %
+                      (model_label, field_name))
+
+
+def get_rating_fields():
+    # Yields ``(model, field)`` for every rating field of installed models.
+    for model in get_models():
+        for field in getattr(model, '_xratings', []):
+            if field.model is model:
+                yield model, field
+
+
+def get_label(model, field=None):
+    # Returns ``'app_label.ModelName[.field_name]'``.
+    label = '%s.%s' % (model._meta.app_label, model._meta.object_name)
+    if field is not None:
+        label = '%s.%s' % (label, field.name)
+    return label
+
+
+def truncate_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def update_rows(model, columns, rows):
+    # Sets ``columns`` to the values of ``rows`` (with the primary key
+    # last) with one executemany UPDATE.
+    connection = connections[model._default_manager.db]
+    qn = connection.ops.quote_name
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        qn(model._meta.db_table),
+        ', '.join('%s = %%s' % (qn(column),) for column in columns),
+        qn(model._meta.pk.column))
+    connection.cursor().executemany(sql, rows)
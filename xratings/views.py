@@ -1,21 +1,38 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
+import json
+from collections import defaultdict
+
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.http import HttpResponse, Http404
+from django.utils import six
+from django.utils.encoding import force_text
 
 from xratings.exceptions import (InvalidRating, CannotDeleteVote, AuthRequired,
                                 IPLimitReached, CannotChangeVote)
+from xratings.limiters import get_limiter
+from xratings.metrics import get_collector
+from xratings.models import Vote
 
 
 class AddRatingView(object):
     def __call__(self, request, content_type_id, object_id, field_name, score):
         # Adds a vote to the specified model field
+        collector = get_collector()
+        with collector.phase('view'):
+            return self.add_vote(request, content_type_id, object_id,
+                                 field_name, score, collector)
 
+    def add_vote(self, request, content_type_id, object_id, field_name, score,
+                 collector):
         try:
-            instance = self.get_instance(content_type_id, object_id)
+            with collector.phase('fetch'):
+                instance = self.get_instance(content_type_id, object_id)
         except ObjectDoesNotExist:
+            collector.incr('rejected.ObjectDoesNotExist')
             raise Http404('Object does not exist')
 
         context = self.get_context(request)
@@ -24,20 +41,22 @@ class AddRatingView(object):
         try:
             field = getattr(instance, field_name)
         except AttributeError:
+            collector.incr('rejected.InvalidField')
             return self.invalid_field_response(request, context)
 
         context.update({'field': field, 'score': score, })
 
-        had_voted = bool(
-            field.get_rating_for_user(request.user,
-                                      request.META['REMOTE_ADDR'],
-                                      request.COOKIES))
-
-        context['had_voted'] = had_voted
-
         try:
-            adds = field.add(score, request.user,
-                             request.META.get('REMOTE_ADDR'), request.COOKIES)
+            try:
+                adds = field.add(score, request.user,
+                                 request.META.get('REMOTE_ADDR'),
+                                 request.COOKIES)
+            except (IPLimitReached, AuthRequired, InvalidRating,
+                    CannotChangeVote, CannotDeleteVote):
+                # Only rejected votes look the vote up, ``add`` reports it
+                # otherwise.
+                context['had_voted'] = self.had_voted(request, field)
+                raise
         except IPLimitReached:
             return self.too_many_votes_from_ip_response(request, context)
         except AuthRequired:
@@ -48,6 +67,9 @@ class AddRatingView(object):
             return self.cannot_change_vote_response(request, context)
         except CannotDeleteVote:
             return self.cannot_delete_vote_response(request, context)
+
+        # ``add`` reports the previous vote, no need to look it up first.
+        had_voted = context['had_voted'] = not adds['created']
         if had_voted:
             return self.rating_changed_response(request, context, adds)
         return self.rating_added_response(request, context, adds)
@@ -57,6 +79,15 @@ class AddRatingView(object):
             context = {}
         return context
 
+    def had_voted(self, request, field):
+        try:
+            return bool(field.get_rating_for_user(
+                request.user, request.META.get('REMOTE_ADDR'),
+                request.COOKIES))
+        except ValueError:
+            # Neither a user nor an IP address.
+            return False
+
     def render_to_response(self, template, context, request):
         raise NotImplementedError
 
@@ -116,7 +147,7 @@ class AddRatingView(object):
 
     def get_instance(self, content_type_id, object_id):
         return ContentType.objects\
-            .get(pk=content_type_id)\
+            .get_for_id(content_type_id)\
             .get_object_for_this_type(pk=object_id)
 
 
@@ -130,3 +161,152 @@ class AddRatingFromModel(AddRatingView):
 
         return super(AddRatingFromModel, self).__call__(
             request, content_type.id, object_id, field_name, score)
+
+
+class _LimitReached(Exception):
+    # Rolls back a batch whose new votes exceed the IP limit.
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+
+class BatchRatingView(object):
+    """
+    Adds several votes posted as a JSON list of objects with the keys
+    ``content_type`` (an id or ``'app_label.model'``), ``object_id``,
+    ``field`` and ``score``, in one transaction, see
+    ``VoteManager.add_in_bulk``.
+
+    Responds with a JSON list of per-vote results: ``{"status": "created"}``
+    (or ``"changed"``, ``"deleted"``) or ``{"status": "error", "error":
+    <exception name>, "message": ...}``, the exceptions being those of
+    ``xratings.exceptions`` or ``ObjectDoesNotExist``.
+    """
+    max_votes = 100
+
+    def __call__(self, request):
+        try:
+            items = json.loads(force_text(request.body))
+        except ValueError:
+            return self.invalid_request_response(request, 'Invalid JSON.')
+        if not isinstance(items, list):
+            return self.invalid_request_response(request,
+                                                 'Expected a list of votes.')
+        if len(items) > self.max_votes:
+            return self.invalid_request_response(
+                request, 'At most %d votes per request.' % (self.max_votes,))
+
+        results = [None] * len(items)
+        objects = self.get_objects(items, results)
+        ip_address = request.META.get('REMOTE_ADDR')
+        pending = []
+        for index, item in enumerate(items):
+            if results[index] is not None:
+                continue
+            obj, cookie = objects[index], None
+            manager = getattr(obj, item['field'], None)
+            if hasattr(manager, 'get_cookie_name'):
+                cookie = request.COOKIES.get(manager.get_cookie_name())
+            pending.append((index, (obj, item['field'], item['score'],
+                                    request.user, ip_address, cookie)))
+
+        # New votes over the IP limit are only known after the inserts; the
+        # batch is then repeated without them.
+        limited, allowed = set(), set()
+        try:
+            while True:
+                batch = [(index, vote) for index, vote in pending
+                         if index not in limited]
+                try:
+                    with transaction.atomic(using=Vote.objects.db):
+                        added = Vote.objects.add_in_bulk(
+                            [vote for index, vote in batch])
+                        self.check_ip_limit(batch, added, ip_address,
+                                            allowed)
+                    break
+                except _LimitReached as e:
+                    limited.update(e.indexes)
+        except Exception:
+            # Nothing was stored.
+            limiter = get_limiter()
+            for index, vote in pending:
+                if index in allowed:
+                    limiter.release(getattr(vote[0], vote[1]), ip_address)
+            raise
+        for index in limited:
+            results[index] = IPLimitReached()
+        for (index, vote), result in zip(batch, added):
+            results[index] = result
+        return self.batch_response(request, results)
+
+    def get_objects(self, items, results):
+        # Fetches the objects with one query per content type; items that
+        # are malformed or point nowhere get an exception in ``results``.
+        objects = [None] * len(items)
+        wanted = defaultdict(dict)
+        for index, item in enumerate(items):
+            try:
+                object_id = int(item['object_id'])
+                int(item['score'])
+                if not isinstance(item['field'], six.string_types):
+                    raise TypeError
+                content_type = self.get_content_type(item['content_type'])
+            except (KeyError, TypeError, ValueError):
+                results[index] = InvalidRating('Invalid vote.')
+            except ObjectDoesNotExist:
+                results[index] = ObjectDoesNotExist(
+                    'Invalid content type.')
+            else:
+                wanted[content_type][index] = object_id
+        for content_type, object_ids in wanted.items():
+            found = content_type.model_class()._default_manager.in_bulk(
+                list(set(object_ids.values())))
+            for index, object_id in object_ids.items():
+                if object_id in found:
+                    objects[index] = found[object_id]
+                else:
+                    results[index] = ObjectDoesNotExist(
+                        'Object does not exist.')
+        return objects
+
+    def get_content_type(self, value):
+        if isinstance(value, six.string_types) and '.' in value:
+            app_label, model = value.split('.', 1)
+            return ContentType.objects.get_by_natural_key(app_label,
+                                                          model.lower())
+        return ContentType.objects.get_for_id(int(value))
+
+    def check_ip_limit(self, batch, added, ip_address, allowed):
+        # Raises ``_LimitReached`` with the new votes over the limit, which
+        # do not count; votes in ``allowed`` passed in a previous attempt and
+        # are not counted again.
+        limiter = get_limiter()
+        exceeded = []
+        for (index, vote), result in zip(batch, added):
+            if result != 'created' or index in allowed:
+                continue
+            manager = getattr(vote[0], vote[1])
+            if limiter.allow(manager, ip_address):
+                allowed.add(index)
+            else:
+                limiter.release(manager, ip_address)
+                exceeded.append(index)
+        if exceeded:
+            raise _LimitReached(exceeded)
+
+    def invalid_request_response(self, request, message):
+        response = HttpResponse(json.dumps({'error': message}),
+                                content_type='application/json')
+        response.status_code = 400
+        return response
+
+    def batch_response(self, request, results):
+        data = []
+        for result in results:
+            if isinstance(result, Exception):
+                data.append({'status': 'error',
+                             'error': result.__class__.__name__,
+                             'message': force_text(result)})
+            else:
+                data.append({'status': result})
+        return HttpResponse(json.dumps(data),
+                            content_type='application/json')
@@ -0,0 +1,34 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def get_vote_cache():
+    # Returns the active cache, a dict mapping ``RatingManager.get_vote_key``
+    # to the score or ``None``, or ``None`` outside of ``vote_cache``.
+    return getattr(_local, 'votes', None)
+
+
+@contextmanager
+def vote_cache():
+    """
+    Remembers the votes looked up or cast by ``RatingManager`` within the
+    block, so asking for the same vote again costs no queries. Nested blocks
+    share the outer cache.
+
+    Example usage::
+
+        with vote_cache():
+            instance.rating.get_rating_for_user(user)
+            instance.rating.get_rating_for_user(user)  # no query
+    """
+    previous = get_vote_cache()
+    _local.votes = {} if previous is None else previous
+    try:
+        yield _local.votes
+    finally:
+        _local.votes = previous